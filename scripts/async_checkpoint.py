@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+金融文本相似度分类竞赛 - 后台异步保存checkpoint
+保存时只把张量拷贝到（锁页）CPU内存就返回训练，序列化和写盘在后台线程完成：
+先写入临时目录并fsync，再原子重命名为checkpoint-N，
+因此按checkpoint-*查找的逻辑永远只会看到完整的checkpoint
+"""
+
+import os
+import copy
+import json
+import random
+import shutil
+import threading
+import dataclasses
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Callable, Optional
+
+import numpy as np
+import torch
+
+TMP_PREFIX = '.tmp-'
+
+def _fsync_path(path: str):
+    """fsync单个文件或目录（部分平台不支持对目录fsync）"""
+    flags = os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0) if os.path.isdir(path) else os.O_RDONLY
+    try:
+        fd = os.open(path, flags)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def fsync_tree(root: str):
+    """把目录下所有文件及目录项刷到磁盘"""
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            _fsync_path(os.path.join(dirpath, name))
+        _fsync_path(dirpath)
+
+class AsyncCheckpointWriter:
+    """
+    单线程后台写盘器
+
+    同一时间最多一个checkpoint在写：下一次快照前会等待上一次写完，
+    这样锁页缓冲区可以在多次保存之间复用，内存占用固定为一份checkpoint。
+
+    Args:
+        pin_memory: 是否使用锁页内存（默认有CUDA时启用，设备到主机的拷贝可以异步进行）
+    """
+
+    def __init__(self, pin_memory: Optional[bool] = None):
+        self.pin_memory = torch.cuda.is_available() if pin_memory is None else pin_memory
+        self._buffers: Dict[str, torch.Tensor] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='checkpoint-writer')
+        self._future = None
+        self._writer_thread = None
+
+    def in_writer_thread(self) -> bool:
+        return threading.get_ident() == self._writer_thread
+
+    def _copy(self, obj, key: str):
+        if isinstance(obj, torch.Tensor):
+            buffer = self._buffers.get(key)
+            if buffer is None or buffer.shape != obj.shape or buffer.dtype != obj.dtype:
+                buffer = torch.empty(obj.shape, dtype=obj.dtype, device='cpu',
+                                     pin_memory=self.pin_memory and obj.is_cuda)
+                self._buffers[key] = buffer
+            buffer.copy_(obj.detach(), non_blocking=buffer.is_pinned())
+            return buffer
+        if isinstance(obj, dict):
+            return {k: self._copy(v, f'{key}.{k}') for k, v in obj.items()}
+        if isinstance(obj, (list, tuple)):
+            return type(obj)(self._copy(v, f'{key}.{i}') for i, v in enumerate(obj))
+        return copy.deepcopy(obj)
+
+    def snapshot(self, obj: Any) -> Any:
+        """
+        把（嵌套的）张量结构拷贝到CPU缓冲区
+
+        会先等待上一次写盘完成，这是保存路径上唯一可能阻塞训练的地方。
+        """
+        self.wait()
+        result = self._copy(obj, 'root')
+        if self.pin_memory and torch.cuda.is_available():
+            # 异步拷贝完成后才能交给后台线程读取
+            torch.cuda.synchronize()
+        return result
+
+    def submit(self, final_dir: str, write_fn: Callable[[str], None],
+               on_complete: Optional[Callable[[str], None]] = None):
+        """
+        在后台写出checkpoint
+
+        Args:
+            final_dir: 最终目录（如 output/checkpoint-500）
+            write_fn: 往给定的临时目录写文件
+            on_complete: 原子重命名之后调用，参数为最终目录
+        """
+        self.wait()
+        self._future = self._executor.submit(self._write, final_dir, write_fn, on_complete)
+
+    def _write(self, final_dir: str, write_fn: Callable[[str], None],
+               on_complete: Optional[Callable[[str], None]]):
+        self._writer_thread = threading.get_ident()
+        parent = os.path.dirname(os.path.abspath(final_dir))
+        tmp_dir = os.path.join(parent, TMP_PREFIX + os.path.basename(final_dir))
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+
+        write_fn(tmp_dir)
+        fsync_tree(tmp_dir)
+
+        # 目录不能直接rename覆盖非空目录，重复保存同一步时先删除旧目录
+        if os.path.exists(final_dir):
+            shutil.rmtree(final_dir)
+        os.replace(tmp_dir, final_dir)
+        _fsync_path(parent)
+
+        if on_complete is not None:
+            on_complete(final_dir)
+
+    def wait(self):
+        """等待正在进行的写盘结束，后台线程中的异常在这里抛出"""
+        if self._future is not None:
+            future, self._future = self._future, None
+            future.result()
+
+    def close(self):
+        self.wait()
+        self._executor.shutdown(wait=True)
+
+def capture_rng_state() -> Dict[str, Any]:
+    """与Trainer._save_rng_state相同的格式（单进程）"""
+    states = {
+        'python': random.getstate(),
+        'numpy': np.random.get_state(),
+        'cpu': torch.random.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        states['cuda'] = torch.cuda.random.get_rng_state()
+    return states
+
+def update_checkpoint_registry(run_dir: str, checkpoint_dir: str, metrics: Dict[str, Any]):
+    """checkpoint写完后更新checkpoint_info.json（utils依赖Swift，未安装时跳过）"""
+    try:
+        try:
+            from .utils import save_checkpoint_info
+        except ImportError:
+            from utils import save_checkpoint_info
+    except ImportError:
+        return
+    save_checkpoint_info(run_dir, checkpoint_dir, metrics)
+
+class AsyncCheckpointTrainerMixin:
+    """
+    Trainer mixin：_save_checkpoint只做快照，写盘交给后台线程
+
+    写出的文件与Trainer同步保存时一致（模型/适配器、optimizer.pt、scheduler.pt、
+    rng_state.pth、trainer_state.json），可以直接用resume_from_checkpoint恢复。
+    多进程、DeepSpeed/FSDP以及不带best_global_step的旧版transformers退回同步保存。
+    """
+
+    @property
+    def checkpoint_writer(self) -> AsyncCheckpointWriter:
+        # 用属性懒加载，便于给已创建的Trainer实例替换类
+        if getattr(self, '_checkpoint_writer', None) is None:
+            self._checkpoint_writer = AsyncCheckpointWriter()
+        return self._checkpoint_writer
+
+    def _supports_async_save(self) -> bool:
+        return (self.args.world_size == 1
+                and not getattr(self, 'is_deepspeed_enabled', False)
+                and not getattr(self, 'is_fsdp_enabled', False)
+                and hasattr(self.state, 'best_global_step'))
+
+    def _model_state_to_save(self, model) -> Dict[str, torch.Tensor]:
+        """PEFT模型只拷贝可训练参数（适配器），其余模型拷贝完整state_dict"""
+        model = self.accelerator.unwrap_model(model)
+        state_dict = model.state_dict()
+        if hasattr(model, 'peft_config'):
+            trainable = {name for name, p in model.named_parameters() if p.requires_grad}
+            state_dict = {k: v for k, v in state_dict.items() if k in trainable}
+        return state_dict
+
+    def _save_checkpoint(self, model, trial, *args, **kwargs):
+        if args or kwargs or not self._supports_async_save():
+            self.checkpoint_writer.wait()
+            return super()._save_checkpoint(model, trial, *args, **kwargs)
+
+        from transformers.trainer import TRAINER_STATE_NAME, OPTIMIZER_NAME, SCHEDULER_NAME, SCALER_NAME
+        from transformers.trainer_callback import ExportableState
+        from transformers.trainer_utils import PREFIX_CHECKPOINT_DIR
+
+        step = self.state.global_step
+        if self.hp_search_backend is None and trial is None:
+            self.store_flos()
+        run_dir = self._get_output_dir(trial=trial)
+        output_dir = os.path.join(run_dir, f"{PREFIX_CHECKPOINT_DIR}-{step}")
+        # Swift在训练结束后读取该属性
+        self.state.last_model_checkpoint = output_dir
+
+        if self.state.best_global_step:
+            best_dir = os.path.join(run_dir, f"{PREFIX_CHECKPOINT_DIR}-{self.state.best_global_step}")
+            # 本步的checkpoint还在后台写入，此时目录尚不存在
+            if self.state.best_global_step == step or os.path.exists(best_dir):
+                self.state.best_model_checkpoint = best_dir
+
+        # 1. 快照：所有张量拷贝到CPU缓冲区，其余状态深拷贝
+        tensors = {'model': self._model_state_to_save(model)}
+        if not self.args.save_only_model:
+            tensors['optimizer'] = self.optimizer.state_dict()
+            scaler = getattr(self.accelerator, 'scaler', None)
+            if scaler is not None:
+                tensors['scaler'] = scaler.state_dict()
+        snapshot = self.checkpoint_writer.snapshot(tensors)
+        scheduler_state = copy.deepcopy(self.lr_scheduler.state_dict()) if not self.args.save_only_model else None
+        rng_state = capture_rng_state()
+        # 其他mixin随checkpoint保存的对象（如采样器状态）
+        extra_state = copy.deepcopy(getattr(self, 'extra_checkpoint_state', dict)())
+
+        for cb in [cb for cb in self.callback_handler.callbacks + [self.control] if isinstance(cb, ExportableState)]:
+            name = cb.__class__.__name__
+            if isinstance(self.state.stateful_callbacks.get(name), list):
+                self.state.stateful_callbacks[name].append(cb.state())
+            else:
+                self.state.stateful_callbacks[name] = cb.state()
+        state_json = json.dumps(dataclasses.asdict(self.state), indent=2, sort_keys=True) + '\n'
+        metrics = next((log for log in reversed(self.state.log_history)
+                        if log.get('step') == step and any(k.startswith('eval_') for k in log)), {})
+
+        # 2. 后台写盘
+        def write(tmp_dir: str):
+            self._save(tmp_dir, state_dict=snapshot['model'])
+            if 'optimizer' in snapshot:
+                torch.save(snapshot['optimizer'], os.path.join(tmp_dir, OPTIMIZER_NAME))
+                torch.save(scheduler_state, os.path.join(tmp_dir, SCHEDULER_NAME))
+            if 'scaler' in snapshot:
+                torch.save(snapshot['scaler'], os.path.join(tmp_dir, SCALER_NAME))
+            torch.save(rng_state, os.path.join(tmp_dir, 'rng_state.pth'))
+            for name, obj in extra_state.items():
+                torch.save(obj, os.path.join(tmp_dir, name))
+            with open(os.path.join(tmp_dir, TRAINER_STATE_NAME), 'w', encoding='utf-8') as f:
+                f.write(state_json)
+
+        def on_complete(final_dir: str):
+            self._rotate_checkpoints(use_mtime=False, output_dir=run_dir)
+            update_checkpoint_registry(run_dir, final_dir, metrics)
+
+        self.checkpoint_writer.submit(output_dir, write, on_complete)
+
+    def _sorted_checkpoints(self, *args, **kwargs):
+        # 训练结束清理checkpoint前要等后台写完；后台线程自身的轮转不能等待自己
+        if not self.checkpoint_writer.in_writer_thread():
+            self.checkpoint_writer.wait()
+        return super()._sorted_checkpoints(*args, **kwargs)
+
+    def _load_best_model(self, *args, **kwargs):
+        self.checkpoint_writer.wait()
+        return super()._load_best_model(*args, **kwargs)
+
+    def train(self, *args, **kwargs):
+        try:
+            return super().train(*args, **kwargs)
+        finally:
+            self.checkpoint_writer.wait()
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+金融文本相似度分类竞赛 - 多checkpoint评估扫描
+只加载一次基座模型，依次热切换各checkpoint的LoRA适配器，
+在固定验证集上打分并输出一张对比表
+"""
+
+import os
+import csv
+import json
+import time
+import glob
+import argparse
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+import torch
+from transformers import AutoTokenizer, AutoModelForCausalLM
+from peft import PeftModel, load_peft_weights, set_peft_model_state_dict
+from swift.utils import read_from_jsonl
+
+try:
+    from .model_trainer import get_project_root, load_config, build_query, SYSTEM_PROMPT
+    from .evaluate import calculate_metrics
+    from .compile_utils import (make_buckets, bucket_length, compile_and_warmup, print_compile_report,
+                                RecompileCounter)
+except ImportError:
+    from model_trainer import get_project_root, load_config, build_query, SYSTEM_PROMPT
+    from evaluate import calculate_metrics
+    from compile_utils import (make_buckets, bucket_length, compile_and_warmup, print_compile_report,
+                               RecompileCounter)
+
+# 编译模式下所有checkpoint共用的适配器名，换checkpoint时原地覆盖权重
+SWEEP_ADAPTER = 'sweep'
+
+def list_checkpoints(output_dir: str) -> List[str]:
+    """按训练步数列出目录下所有LoRA checkpoint"""
+    checkpoint_dirs = [
+        d for d in glob.glob(os.path.join(output_dir, 'checkpoint-*'))
+        if os.path.exists(os.path.join(d, 'adapter_config.json'))
+    ]
+
+    def step_of(path: str) -> int:
+        try:
+            return int(path.rstrip('/').split('-')[-1])
+        except ValueError:
+            return -1
+
+    return sorted(checkpoint_dirs, key=step_of)
+
+def load_validation_samples(num_samples: int = 1000, data_file: Optional[str] = None) -> List[Dict]:
+    """加载固定验证集（与register_datasets中的train[:1000]一致）"""
+    if data_file is None:
+        data_file = str(get_project_root() / 'data' / 'train.jsonl')
+
+    samples = read_from_jsonl(data_file)
+    return samples[:num_samples]
+
+def get_label_token_ids(tokenizer) -> List[int]:
+    """获取"0"和"1"对应的token id"""
+    return [tokenizer.encode(label, add_special_tokens=False)[0] for label in ['0', '1']]
+
+def build_batch_cache(tokenizer, samples: List[Dict], batch_size: int = 16,
+                      max_length: int = 256, buckets: Optional[List[int]] = None) -> List[Dict[str, torch.Tensor]]:
+    """
+    预先分词并组批，所有checkpoint共享同一份批次缓存
+
+    样本按长度排序后组批以减少padding，每个批次记录原始下标，
+    采用左padding，使最后一个位置即为生成位置。
+
+    Args:
+        tokenizer: 分词器
+        samples: 验证样本
+        batch_size: 批次大小
+        max_length: 最大序列长度
+        buckets: 序列长度桶（编译模式），宽度pad到桶长度，末尾不足的批次复制已有行补齐
+
+    Returns:
+        批次列表，每个批次包含input_ids、attention_mask和indices
+    """
+    encoded = []
+    for sample in samples:
+        messages = [
+            {'role': 'system', 'content': SYSTEM_PROMPT},
+            {'role': 'user', 'content': build_query(sample['text1'], sample['text2'])}
+        ]
+        text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        ids = tokenizer(text, add_special_tokens=False, truncation=True, max_length=max_length)['input_ids']
+        encoded.append(ids)
+
+    order = sorted(range(len(encoded)), key=lambda i: len(encoded[i]))
+    pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+
+    batches = []
+    for start in range(0, len(order), batch_size):
+        indices = order[start:start + batch_size]
+        width = max(len(encoded[i]) for i in indices)
+        rows = indices
+        if buckets:
+            width = bucket_length(width, buckets)
+            # 补齐的行只用于固定形状，indices里不包含它们
+            rows = indices + [indices[-1]] * (batch_size - len(indices))
+        input_ids = torch.full((len(rows), width), pad_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(rows), width), dtype=torch.long)
+        for row, i in enumerate(rows):
+            ids = encoded[i]
+            input_ids[row, width - len(ids):] = torch.tensor(ids, dtype=torch.long)
+            attention_mask[row, width - len(ids):] = 1
+        batches.append({
+            'input_ids': input_ids,
+            'attention_mask': attention_mask,
+            'indices': torch.tensor(indices, dtype=torch.long)
+        })
+
+    return batches
+
+@torch.inference_mode()
+def score_batches(model, batches: List[Dict[str, torch.Tensor]], label_token_ids: List[int],
+                  num_samples: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    在缓存批次上打分
+
+    只对最后一个位置、且只对"0"/"1"两行计算lm_head，避免完整词表的投影。
+
+    Returns:
+        (预测标签, 类别1的概率)
+    """
+    causal_lm = model.get_base_model() if isinstance(model, PeftModel) else model
+    backbone = causal_lm.model
+    lm_head_weight = causal_lm.lm_head.weight[label_token_ids]
+    device = lm_head_weight.device
+
+    predictions = np.zeros(num_samples, dtype=np.int64)
+    probabilities = np.zeros(num_samples, dtype=np.float32)
+
+    for batch in batches:
+        hidden = backbone(
+            input_ids=batch['input_ids'].to(device),
+            attention_mask=batch['attention_mask'].to(device),
+            use_cache=False
+        )[0][:, -1]
+        logits = torch.nn.functional.linear(hidden.to(lm_head_weight.dtype), lm_head_weight).float()
+        indices = batch['indices'].numpy()
+        probs = torch.softmax(logits, dim=-1)[:len(indices), 1].cpu().numpy()
+        probabilities[indices] = probs
+        predictions[indices] = (probs > 0.5).astype(np.int64)
+
+    return predictions, probabilities
+
+def load_base_model(model_id: str, torch_dtype: str = 'bfloat16'):
+    """加载基座模型和分词器（整个扫描过程只加载一次）"""
+    tokenizer = AutoTokenizer.from_pretrained(model_id, trust_remote_code=True)
+    tokenizer.padding_side = 'left'
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    model = AutoModelForCausalLM.from_pretrained(
+        model_id,
+        torch_dtype=getattr(torch, torch_dtype),
+        device_map='auto',
+        trust_remote_code=True
+    )
+    model.eval()
+    return model, tokenizer
+
+def sweep_checkpoints(checkpoints: List[str], model_id: str, num_samples: int = 1000,
+                      batch_size: int = 16, max_length: int = 256,
+                      include_base: bool = False, compile: bool = False,
+                      compile_mode: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    对多个checkpoint进行评估扫描
+
+    Args:
+        checkpoints: checkpoint目录列表
+        model_id: 基座模型
+        num_samples: 验证样本数
+        batch_size: 批次大小
+        max_length: 最大序列长度
+        include_base: 是否同时评估不带适配器的基座模型（编译模式下基座以eager方式评估）
+        compile: 是否torch.compile主干网络（序列长度分桶，加载第一个适配器后逐桶预热）
+        compile_mode: torch.compile的mode
+
+    Returns:
+        每个checkpoint一行的评估结果
+    """
+    print(f"🤖 加载基座模型: {model_id}")
+    load_start = time.time()
+    model, tokenizer = load_base_model(model_id)
+    load_time = time.time() - load_start
+    print(f"✅ 基座模型加载完成 ({load_time:.1f}s)")
+
+    samples = load_validation_samples(num_samples)
+    y_true = [int(s['label']) for s in samples]
+    buckets = make_buckets(max_length) if compile else None
+    batches = build_batch_cache(tokenizer, samples, batch_size, max_length, buckets)
+    label_token_ids = get_label_token_ids(tokenizer)
+    print(f"✅ 批次缓存完成: {len(samples)} 个样本, {len(batches)} 个批次")
+
+    rows = []
+    compile_report = None
+    recompile_counter = RecompileCounter() if compile else None
+
+    def evaluate_current(name: str, path: str):
+        start = time.time()
+        y_pred, y_prob = score_batches(model, batches, label_token_ids, len(samples))
+        elapsed = time.time() - start
+        metrics = calculate_metrics(y_true, y_pred, y_prob)
+        rows.append({
+            'checkpoint': name,
+            'path': path,
+            'accuracy': metrics.get('accuracy', 0),
+            'f1_macro': metrics.get('f1_macro', 0),
+            'precision_class_1': metrics.get('precision_class_1', 0),
+            'recall_class_1': metrics.get('recall_class_1', 0),
+            'auc': metrics.get('auc'),
+            'best_threshold': metrics.get('best_threshold'),
+            'best_threshold_accuracy': metrics.get('best_threshold_accuracy'),
+            'eval_seconds': elapsed,
+            'samples_per_second': len(samples) / elapsed if elapsed > 0 else 0
+        })
+        if recompile_counter is not None:
+            rows[-1]['recompiles'] = recompile_counter()['recompiles']
+        print(f"  • {name}: 准确率 {rows[-1]['accuracy']:.4f} ({elapsed:.1f}s)")
+
+    if include_base:
+        evaluate_current('base', model_id)
+
+    def compile_backbone():
+        causal_lm = model.get_base_model()
+        pad_id = tokenizer.pad_token_id
+
+        def run(length: int):
+            dummy = {
+                'input_ids': torch.full((batch_size, length), pad_id, dtype=torch.long),
+                'attention_mask': torch.ones((batch_size, length), dtype=torch.long),
+                'indices': torch.arange(batch_size)
+            }
+            score_batches(model, [dummy], label_token_ids, batch_size)
+
+        report = compile_and_warmup(causal_lm.model, run, buckets, mode=compile_mode)
+        print_compile_report(report)
+        recompile_counter()
+        return report
+
+    previous = None
+    for path in checkpoints:
+        name = os.path.basename(path.rstrip('/'))
+        adapter_name = name.replace('-', '_').replace('.', '_')
+        if compile:
+            # 固定适配器名并原地拷贝权重：参数对象不变，编译好的图可以直接复用
+            if previous is None:
+                model = PeftModel.from_pretrained(model, path, adapter_name=SWEEP_ADAPTER)
+                model.eval()
+                compile_report = compile_backbone()
+            else:
+                set_peft_model_state_dict(model, load_peft_weights(path), adapter_name=SWEEP_ADAPTER)
+            previous = SWEEP_ADAPTER
+        elif previous is None:
+            model = PeftModel.from_pretrained(model, path, adapter_name=adapter_name)
+            model.eval()
+        else:
+            model.load_adapter(path, adapter_name=adapter_name)
+            model.set_adapter(adapter_name)
+            # 切换后释放上一个适配器，显存占用保持在单个适配器
+            model.delete_adapter(previous)
+        if not compile:
+            previous = adapter_name
+        evaluate_current(name, path)
+
+    for row in rows:
+        row['model_load_seconds'] = load_time
+        if compile_report is not None:
+            row['compile_seconds'] = compile_report['total_compile_seconds']
+    return rows
+
+def print_sweep_table(rows: List[Dict[str, Any]]):
+    """打印checkpoint对比表"""
+    if not rows:
+        return
+
+    best = max(rows, key=lambda r: r['accuracy'])
+    print("\n" + "=" * 78)
+    print(f"{'checkpoint':<24}{'准确率':>10}{'F1(宏)':>10}{'P(1)':>10}{'R(1)':>10}{'耗时(s)':>10}")
+    print("-" * 78)
+    for row in rows:
+        marker = ' 🏆' if row is best else ''
+        print(f"{row['checkpoint']:<24}{row['accuracy']:>10.4f}{row['f1_macro']:>10.4f}"
+              f"{row['precision_class_1']:>10.4f}{row['recall_class_1']:>10.4f}"
+              f"{row['eval_seconds']:>10.1f}{marker}")
+    print("=" * 78)
+
+def save_sweep_results(rows: List[Dict[str, Any]], result_path: str):
+    """保存对比表（JSON + CSV）"""
+    os.makedirs(os.path.dirname(result_path) or '.', exist_ok=True)
+
+    with open(result_path, 'w', encoding='utf-8') as f:
+        json.dump(rows, f, ensure_ascii=False, indent=2)
+
+    csv_path = os.path.splitext(result_path)[0] + '.csv'
+    if rows:
+        with open(csv_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+
+    print("📄 扫描结果已保存:")
+    print(f"  • {result_path}")
+    print(f"  • {csv_path}")
+
+def main():
+    """主函数"""
+    project_root = get_project_root()
+    config = load_config()
+
+    parser = argparse.ArgumentParser(description="多checkpoint评估扫描")
+    parser.add_argument('--output-dir', default=str(project_root / 'models' / 'enhanced_output'),
+                        help='checkpoint所在目录')
+    parser.add_argument('--checkpoints', nargs='*', help='指定checkpoint列表（默认扫描全部）')
+    parser.add_argument('--model', default=config['model']['model_id'], help='基座模型')
+    parser.add_argument('--num-samples', type=int, default=1000, help='验证样本数')
+    parser.add_argument('--batch-size', type=int, default=16, help='批次大小')
+    parser.add_argument('--max-length', type=int, default=config['training']['max_length'],
+                        help='最大序列长度')
+    parser.add_argument('--include-base', action='store_true', help='同时评估基座模型')
+    parser.add_argument('--compile', action='store_true',
+                        help='torch.compile主干网络（序列长度分桶，所有checkpoint复用同一组编译图）')
+    parser.add_argument('--compile-mode', default=None, choices=['default', 'reduce-overhead', 'max-autotune'],
+                        help='torch.compile的mode')
+    parser.add_argument('--result-path', default=str(project_root / 'results' / 'checkpoint_sweep.json'),
+                        help='结果输出路径')
+
+    args = parser.parse_args()
+
+    print("🔍 多checkpoint评估扫描")
+    print("=" * 50)
+
+    checkpoints = args.checkpoints or list_checkpoints(args.output_dir)
+    if not checkpoints:
+        print(f"❌ 未找到checkpoint: {args.output_dir}")
+        return
+
+    print(f"📁 待评估checkpoint: {len(checkpoints)} 个")
+    rows = sweep_checkpoints(checkpoints, args.model, args.num_samples, args.batch_size,
+                             args.max_length, args.include_base, args.compile, args.compile_mode)
+    print_sweep_table(rows)
+    save_sweep_results(rows, args.result_path)
+
+if __name__ == '__main__':
+    main()
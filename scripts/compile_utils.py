@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+金融文本相似度分类竞赛 - torch.compile与形状分桶
+序列长度pad到少量固定桶，启动时逐桶预热编译，避免动态形状反复重编译；
+记录每个桶的编译耗时和相对eager的稳态加速比，重编译次数可接入逐步耗时分解
+"""
+
+import os
+import json
+import time
+from typing import Dict, Any, List, Optional, Callable
+
+import torch
+from transformers import TrainerCallback
+
+def make_buckets(max_length: int, min_length: int = 64) -> List[int]:
+    """min_length起按2倍递增直到max_length（最后一个桶等于max_length）"""
+    buckets, length = [], min_length
+    while length < max_length:
+        buckets.append(length)
+        length *= 2
+    buckets.append(max_length)
+    return buckets
+
+def bucket_length(length: int, buckets: List[int]) -> int:
+    """不小于length的最小桶（超过最大桶时返回最大桶，调用方应已截断）"""
+    for bucket in buckets:
+        if length <= bucket:
+            return bucket
+    return buckets[-1]
+
+def pad_batch_to_bucket(batch: Dict[str, torch.Tensor], buckets: List[int], pad_token_id: int,
+                        padding_side: str = 'right') -> Dict[str, torch.Tensor]:
+    """把批次的序列维度pad到所在的桶（token级labels用-100填充）"""
+    width = batch['input_ids'].shape[1]
+    target = bucket_length(width, buckets)
+    if target == width:
+        return batch
+
+    fill = {'input_ids': pad_token_id, 'attention_mask': 0, 'labels': -100}
+    padded = dict(batch)
+    for key, value in fill.items():
+        tensor = batch.get(key)
+        if not isinstance(tensor, torch.Tensor) or tensor.dim() != 2 or tensor.shape[1] != width:
+            continue
+        pad = tensor.new_full((tensor.shape[0], target - width), value)
+        padded[key] = torch.cat([tensor, pad] if padding_side == 'right' else [pad, tensor], dim=1)
+    return padded
+
+class BucketPaddingCollator:
+    """包装已有collator：动态padding后再pad到桶长度"""
+
+    def __init__(self, collator: Callable, buckets: List[int], pad_token_id: int, padding_side: str = 'right'):
+        self.collator = collator
+        self.buckets = buckets
+        self.pad_token_id = pad_token_id
+        self.padding_side = padding_side
+
+    def __call__(self, features):
+        return pad_batch_to_bucket(self.collator(features), self.buckets, self.pad_token_id, self.padding_side)
+
+def compiled_graph_count() -> int:
+    """dynamo累计编译出的计算图数量"""
+    try:
+        from torch._dynamo.utils import counters
+    except ImportError:
+        return 0
+    return int(counters['stats'].get('unique_graphs', 0))
+
+class RecompileCounter:
+    """每次调用返回累计图数量和距上次调用新增的编译次数，可作为逐步耗时分解的额外指标"""
+
+    def __init__(self):
+        self._last = compiled_graph_count()
+
+    def __call__(self) -> Dict[str, int]:
+        total = compiled_graph_count()
+        recompiles, self._last = total - self._last, total
+        return {'compiled_graphs': total, 'recompiles': recompiles}
+
+def compile_module(module: torch.nn.Module, num_shapes: int, mode: Optional[str] = None):
+    """
+    原地编译模块（静态形状），state_dict键名和模块对象保持不变
+
+    Args:
+        num_shapes: 预计出现的形状数（桶数×训练/评估等），用于放宽dynamo的缓存上限
+    """
+    import torch._dynamo
+    torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit, num_shapes + 2)
+    module.compile(dynamic=False, mode=mode)
+
+def _sync():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+def time_buckets(run: Callable[[int], None], buckets: List[int], repeats: int = 3) -> List[Dict[str, float]]:
+    """逐桶计时：第一次调用单独记录（编译时包含编译耗时），之后取平均作为稳态耗时"""
+    rows = []
+    for bucket in buckets:
+        _sync()
+        start = time.perf_counter()
+        run(bucket)
+        _sync()
+        first = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            run(bucket)
+        _sync()
+        rows.append({'bucket': bucket, 'first_call_seconds': first,
+                     'steady_seconds': (time.perf_counter() - start) / repeats})
+    return rows
+
+def compile_and_warmup(module: torch.nn.Module, run: Callable[[int], None], buckets: List[int],
+                       num_modes: int = 1, mode: Optional[str] = None, repeats: int = 3) -> Dict[str, Any]:
+    """
+    先测eager耗时，再编译并逐桶预热，返回编译耗时与稳态加速比
+
+    Args:
+        module: 被编译的模块
+        run: 给定桶长度执行一次前向（或前向+反向）
+        num_modes: 每个桶会出现的图变体数（如训练+评估为2）
+    """
+    graphs_before = compiled_graph_count()
+    with torch.random.fork_rng(devices=range(torch.cuda.device_count()) if torch.cuda.is_available() else []):
+        eager = time_buckets(run, buckets, repeats)
+        compile_module(module, len(buckets) * num_modes, mode)
+        compiled = time_buckets(run, buckets, repeats)
+
+    rows = []
+    for e, c in zip(eager, compiled):
+        rows.append({
+            'bucket': e['bucket'],
+            'compile_seconds': max(c['first_call_seconds'] - c['steady_seconds'], 0.0),
+            'eager_seconds': e['steady_seconds'],
+            'compiled_seconds': c['steady_seconds'],
+            'speedup': e['steady_seconds'] / c['steady_seconds'] if c['steady_seconds'] > 0 else None
+        })
+    return {
+        'buckets': rows,
+        'total_compile_seconds': sum(r['compile_seconds'] for r in rows),
+        'warmup_graphs': compiled_graph_count() - graphs_before
+    }
+
+def print_compile_report(report: Dict[str, Any]):
+    """打印逐桶编译耗时与加速比"""
+    print(f"🔥 torch.compile预热完成: 编译 {report['total_compile_seconds']:.1f}s, "
+          f"{report['warmup_graphs']} 个计算图")
+    for row in report['buckets']:
+        speedup = f"{row['speedup']:.2f}x" if row['speedup'] else '-'
+        print(f"  • 桶 {row['bucket']:>5}: 编译 {row['compile_seconds']:.1f}s, "
+              f"eager {row['eager_seconds'] * 1000:.1f}ms → {row['compiled_seconds'] * 1000:.1f}ms ({speedup})")
+
+class CompileWarmupCallback(TrainerCallback):
+    """
+    训练开始时（模型已由Trainer准备好、混合精度包装已生效）编译模型并逐桶预热训练与评估图
+
+    预热在fork的随机数状态下运行并清空梯度，不影响训练的可复现性。
+    报告写入 output_dir/compile_report.json。
+
+    Args:
+        buckets: 序列长度桶
+        train_batch_size: 训练批次大小（需配合dataloader_drop_last保证形状固定）
+        eval_batch_size: 评估批次大小
+        pad_token_id: 预热输入使用的token
+        mode: torch.compile的mode
+    """
+
+    def __init__(self, buckets: List[int], train_batch_size: int, eval_batch_size: int,
+                 pad_token_id: int = 0, mode: Optional[str] = None):
+        self.buckets = buckets
+        self.train_batch_size = train_batch_size
+        self.eval_batch_size = eval_batch_size
+        self.pad_token_id = pad_token_id
+        self.mode = mode
+
+    def _dummy_batch(self, batch_size: int, length: int, device) -> Dict[str, torch.Tensor]:
+        return {
+            'input_ids': torch.full((batch_size, length), self.pad_token_id, dtype=torch.long, device=device),
+            'attention_mask': torch.ones((batch_size, length), dtype=torch.long, device=device),
+            'labels': torch.zeros(batch_size, dtype=torch.long, device=device)
+        }
+
+    def on_train_begin(self, args, state, control, model=None, **kwargs):
+        device = next(model.parameters()).device
+
+        def run(length: int):
+            model.train()
+            model(**self._dummy_batch(self.train_batch_size, length, device)).loss.backward()
+            model.zero_grad(set_to_none=True)
+            model.eval()
+            with torch.no_grad():
+                model(**self._dummy_batch(self.eval_batch_size, length, device))
+            model.train()
+
+        report = compile_and_warmup(model, run, self.buckets, num_modes=2, mode=self.mode)
+        print_compile_report(report)
+        if state.is_world_process_zero:
+            os.makedirs(args.output_dir, exist_ok=True)
+            with open(os.path.join(args.output_dir, 'compile_report.json'), 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
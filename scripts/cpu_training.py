@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+金融文本相似度分类竞赛 - CPU训练支持
+显式配置intra-op/inter-op线程数，CPU支持时启用bf16 autocast，
+DataLoader worker绑定到主进程所在NUMA节点的空闲核心；
+附带微型Qwen结构模型上 samples/sec 随线程数变化的基准
+"""
+
+import os
+import glob
+import json
+import time
+import argparse
+from typing import Dict, Any, List, Optional
+
+import torch
+
+def _parse_cpu_list(text: str) -> List[int]:
+    """解析 0-3,8-11 形式的CPU列表"""
+    cpus = []
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-')
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+def available_cpus() -> List[int]:
+    """当前进程允许使用的逻辑CPU"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def numa_nodes() -> Dict[int, List[int]]:
+    """NUMA节点 -> 逻辑CPU列表（非Linux或单节点时返回一个节点）"""
+    nodes = {}
+    for path in glob.glob('/sys/devices/system/node/node[0-9]*/cpulist'):
+        node = int(os.path.basename(os.path.dirname(path))[4:])
+        with open(path, 'r') as f:
+            nodes[node] = _parse_cpu_list(f.read())
+    return nodes or {0: available_cpus()}
+
+def physical_cores(cpus: List[int]) -> List[int]:
+    """每个物理核心只保留一个逻辑CPU（去掉超线程兄弟）"""
+    seen, cores = set(), []
+    for cpu in cpus:
+        path = f'/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list'
+        try:
+            with open(path, 'r') as f:
+                siblings = tuple(_parse_cpu_list(f.read()))
+        except OSError:
+            siblings = (cpu,)
+        if siblings not in seen:
+            seen.add(siblings)
+            cores.append(cpu)
+    return cores
+
+def cpu_supports_bf16() -> bool:
+    """CPU是否有原生bf16指令（AVX512_BF16或AMX），没有时bf16 autocast反而更慢"""
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            flags = f.read()
+        if 'avx512_bf16' in flags or 'amx_bf16' in flags:
+            return True
+    except OSError:
+        pass
+    check = getattr(getattr(torch.ops, 'mkldnn', None), '_is_mkldnn_bf16_supported', None)
+    try:
+        return bool(check()) if check is not None else False
+    except Exception:
+        return False
+
+def bind_to_numa_node(node: int) -> List[int]:
+    """把主进程限制在指定NUMA节点的CPU上（内存按首次访问分配在本地节点）"""
+    cpus = [c for c in numa_nodes().get(node, []) if c in set(available_cpus())]
+    if not cpus:
+        raise ValueError(f"NUMA节点{node}上没有可用的CPU")
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    return cpus
+
+def configure_cpu_threads(intra_op: Optional[int] = None, inter_op: Optional[int] = None,
+                          num_workers: int = 0) -> Dict[str, int]:
+    """
+    设置PyTorch线程数
+
+    默认intra-op线程数 = 可用物理核心数 - DataLoader worker数，超线程对矩阵乘法基本没有收益。
+    inter-op线程数只能在第一次并行计算前设置一次，之后的设置会被忽略。
+
+    Returns:
+        {'intra_op', 'inter_op', 'physical_cores'}
+    """
+    cores = physical_cores(available_cpus())
+    if intra_op is None:
+        intra_op = max(len(cores) - num_workers, 1)
+    if inter_op is None:
+        inter_op = 1
+
+    torch.set_num_threads(intra_op)
+    try:
+        torch.set_num_interop_threads(inter_op)
+    except RuntimeError:
+        # 已经执行过并行计算
+        inter_op = torch.get_num_interop_threads()
+
+    # 让DataLoader worker等子进程里的OpenMP/MKL不再各自开满线程
+    os.environ.setdefault('OMP_NUM_THREADS', str(intra_op))
+    os.environ.setdefault('MKL_NUM_THREADS', str(intra_op))
+    return {'intra_op': intra_op, 'inter_op': inter_op, 'physical_cores': len(cores)}
+
+class NumaWorkerInit:
+    """
+    DataLoader worker初始化：绑定到主进程所在NUMA节点上计算线程未占用的核心
+
+    主进程的计算线程占用前intra_op个物理核心，worker依次分到剩余核心
+    （没有剩余时与计算线程共用整个节点），每个worker只开1个线程。
+    可pickle，兼容spawn方式启动的worker。
+
+    Args:
+        cpus: 主进程可用的CPU
+        intra_op: 主进程计算线程数
+        base_fn: 原有的worker_init_fn（如Trainer的seed_worker），先调用它
+    """
+
+    def __init__(self, cpus: List[int], intra_op: int, base_fn=None):
+        cores = physical_cores(cpus)
+        compute = set(cores[:intra_op])
+        self.free_cpus = [c for c in cpus if c not in compute] or list(cpus)
+        self.base_fn = base_fn
+
+    def __call__(self, worker_id: int):
+        if self.base_fn is not None:
+            self.base_fn(worker_id)
+        torch.set_num_threads(1)
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, {self.free_cpus[worker_id % len(self.free_cpus)]})
+
+def attach_numa_worker_init(dataloader, intra_op: int):
+    """给已创建的DataLoader挂上NUMA感知的worker初始化（保留原有的worker_init_fn）"""
+    if dataloader.num_workers > 0:
+        dataloader.worker_init_fn = NumaWorkerInit(available_cpus(), intra_op, dataloader.worker_init_fn)
+    return dataloader
+
+class CPUTrainerMixin:
+    """
+    Trainer mixin：训练/评估的DataLoader worker按NUMA拓扑绑核
+
+    Args:
+        cpu_threads: configure_cpu_threads的返回值
+    """
+
+    def __init__(self, *args, cpu_threads: Optional[Dict[str, int]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cpu_threads = cpu_threads or {'intra_op': torch.get_num_threads()}
+
+    def get_train_dataloader(self):
+        return attach_numa_worker_init(super().get_train_dataloader(), self.cpu_threads['intra_op'])
+
+    def get_eval_dataloader(self, *args, **kwargs):
+        return attach_numa_worker_init(super().get_eval_dataloader(*args, **kwargs), self.cpu_threads['intra_op'])
+
+def build_tiny_qwen(hidden_size: int = 256, num_layers: int = 4, vocab_size: int = 8192):
+    """随机初始化的微型Qwen2分类模型（结构与Qwen2-7B一致，只缩小尺寸）"""
+    from transformers import Qwen2Config, Qwen2ForSequenceClassification
+    config = Qwen2Config(
+        vocab_size=vocab_size,
+        hidden_size=hidden_size,
+        intermediate_size=hidden_size * 4,
+        num_hidden_layers=num_layers,
+        num_attention_heads=max(hidden_size // 64, 1),
+        num_key_value_heads=max(hidden_size // 256, 1),
+        max_position_embeddings=2048,
+        num_labels=2,
+        pad_token_id=0
+    )
+    return Qwen2ForSequenceClassification(config)
+
+def benchmark_threads(thread_counts: List[int], steps: int = 10, batch_size: int = 16, seq_len: int = 128,
+                      bf16: Optional[bool] = None, hidden_size: int = 256, num_layers: int = 4) -> List[Dict[str, Any]]:
+    """
+    微型Qwen模型上 samples/sec 随intra-op线程数的变化（前向+反向+AdamW）
+
+    Args:
+        thread_counts: 待测的线程数
+        bf16: 是否使用bf16 autocast，None表示按CPU能力自动选择
+    """
+    if bf16 is None:
+        bf16 = cpu_supports_bf16()
+
+    torch.manual_seed(0)
+    model = build_tiny_qwen(hidden_size, num_layers)
+    model.train()
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-4)
+    input_ids = torch.randint(1, model.config.vocab_size, (batch_size, seq_len))
+    labels = torch.randint(0, 2, (batch_size,))
+
+    def train_step():
+        with torch.autocast('cpu', dtype=torch.bfloat16, enabled=bf16):
+            loss = model(input_ids=input_ids, labels=labels).loss
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad(set_to_none=True)
+
+    results = []
+    for threads in thread_counts:
+        torch.set_num_threads(threads)
+        for _ in range(2):
+            train_step()
+
+        start = time.perf_counter()
+        for _ in range(steps):
+            train_step()
+        elapsed = time.perf_counter() - start
+
+        results.append({
+            'threads': threads,
+            'bf16': bf16,
+            'step_seconds': elapsed / steps,
+            'samples_per_second': steps * batch_size / elapsed
+        })
+        print(f"  • {threads:>3} 线程: {results[-1]['samples_per_second']:.1f} samples/s")
+
+    base = results[0]['samples_per_second']
+    for row in results:
+        row['speedup'] = row['samples_per_second'] / base
+    return results
+
+def main():
+    """运行CPU线程数基准"""
+    parser = argparse.ArgumentParser(description="CPU训练线程数基准（微型Qwen结构模型）")
+    parser.add_argument('--threads', type=int, nargs='+', default=None,
+                        help='待测线程数，默认1,2,4,...直到物理核心数')
+    parser.add_argument('--steps', type=int, default=10, help='每个线程数测量的步数')
+    parser.add_argument('--batch-size', type=int, default=16, help='批次大小')
+    parser.add_argument('--seq-len', type=int, default=128, help='序列长度')
+    parser.add_argument('--precision', choices=['auto', 'bf16', 'fp32'], default='auto', help='计算精度')
+    parser.add_argument('--numa-node', type=int, default=None, help='绑定到指定NUMA节点')
+    parser.add_argument('--output', default='results/cpu_thread_benchmark.json', help='结果输出路径')
+    args = parser.parse_args()
+
+    if args.numa_node is not None:
+        bind_to_numa_node(args.numa_node)
+    cores = physical_cores(available_cpus())
+    thread_counts = args.threads
+    if not thread_counts:
+        thread_counts, n = [], 1
+        while n < len(cores):
+            thread_counts.append(n)
+            n *= 2
+        thread_counts.append(len(cores))
+    bf16 = {'auto': None, 'bf16': True, 'fp32': False}[args.precision]
+
+    print("🧵 CPU训练线程数基准")
+    print("=" * 50)
+    print(f"  • 物理核心: {len(cores)}，NUMA节点: {len(numa_nodes())}，原生bf16: {cpu_supports_bf16()}")
+    results = benchmark_threads(thread_counts, args.steps, args.batch_size, args.seq_len, bf16)
+
+    print("\n" + "=" * 50)
+    print(f"{'线程数':>8}{'samples/s':>14}{'加速比':>10}{'ms/step':>12}")
+    print("-" * 50)
+    for row in results:
+        print(f"{row['threads']:>8}{row['samples_per_second']:>14.1f}{row['speedup']:>10.2f}"
+              f"{row['step_seconds'] * 1000:>12.1f}")
+    print("=" * 50)
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"📄 结果已保存: {args.output}")
+
+if __name__ == '__main__':
+    main()
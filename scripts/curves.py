@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+金融文本相似度分类竞赛 - ROC/PR曲线与阈值扫描
+按概率排序一次、累加一次，得到所有阈值下的TP/FP，
+ROC、PR曲线、AUC、平均精确率和使准确率最高的阈值都由这两列累加和推出（O(n log n)）
+"""
+
+import os
+import json
+import argparse
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+# 结果文件中类别1概率的字段名（按顺序查找）
+PROBABILITY_KEYS = ('probability', 'prob', 'score')
+# compute_curves返回的标量摘要
+SUMMARY_KEYS = ('auc', 'average_precision', 'best_threshold', 'best_threshold_accuracy', 'accuracy_at_0.5')
+
+def record_probability(record: Dict) -> Optional[float]:
+    """读取单条预测记录的类别1概率，没有时返回None"""
+    for key in PROBABILITY_KEYS:
+        value = record.get(key)
+        if value is not None:
+            return float(value)
+    return None
+
+def extract_probabilities(records: List[Dict]) -> Optional[np.ndarray]:
+    """所有记录都带概率时返回float64数组，否则返回None"""
+    probabilities = [record_probability(r) for r in records]
+    if not probabilities or any(p is None for p in probabilities):
+        return None
+    return np.asarray(probabilities, dtype=np.float64)
+
+def threshold_counts(y_true, scores) -> Dict[str, np.ndarray]:
+    """
+    按分数从高到低排序并累加，返回每个不同阈值处的累计TP/FP
+
+    阈值t对应的预测规则为 score >= t 判为1。
+
+    Returns:
+        {'thresholds', 'tp', 'fp', 'positives', 'negatives'}
+    """
+    y_true = np.asarray(y_true).astype(bool).ravel()
+    scores = np.asarray(scores, dtype=np.float64).ravel()
+    if y_true.shape != scores.shape:
+        raise ValueError(f"标签和概率长度不匹配: {y_true.shape} vs {scores.shape}")
+
+    order = np.argsort(-scores, kind='mergesort')
+    scores, y_true = scores[order], y_true[order]
+    # 同分样本必须一起越过阈值，只保留每段相同分数的最后一个位置
+    last = np.r_[np.flatnonzero(np.diff(scores)), len(scores) - 1] if len(scores) else np.empty(0, dtype=np.int64)
+    tp = np.cumsum(y_true, dtype=np.int64)[last]
+    fp = (last + 1) - tp
+    positives = int(y_true.sum())
+    return {
+        'thresholds': scores[last],
+        'tp': tp,
+        'fp': fp,
+        'positives': positives,
+        'negatives': len(y_true) - positives
+    }
+
+def compute_curves(y_true, scores) -> Dict[str, Any]:
+    """
+    一次排序得到ROC/PR曲线、AUC、平均精确率和最优准确率阈值
+
+    曲线从 (0, 0) 开始（阈值为+inf，全部判为0）；
+    average_precision与sklearn相同，为按召回率增量加权的精确率之和。
+    """
+    counts = threshold_counts(y_true, scores)
+    pos, neg = counts['positives'], counts['negatives']
+    tp = np.r_[0, counts['tp']].astype(np.float64)
+    fp = np.r_[0, counts['fp']].astype(np.float64)
+    thresholds = np.r_[np.inf, counts['thresholds']]
+
+    tpr = tp / pos if pos else np.zeros_like(tp)
+    fpr = fp / neg if neg else np.zeros_like(fp)
+    predicted = tp + fp
+    precision = np.divide(tp, predicted, out=np.ones_like(tp), where=predicted > 0)
+    recall = tpr
+
+    accuracy = (tp + (neg - fp)) / max(pos + neg, 1)
+    best = int(np.argmax(accuracy))
+
+    return {
+        'auc': float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2)) if pos and neg else None,
+        'average_precision': float(np.sum(np.diff(recall) * precision[1:])) if pos else None,
+        'best_threshold': float(thresholds[best]),
+        'best_threshold_accuracy': float(accuracy[best]),
+        'accuracy_at_0.5': float(accuracy[np.searchsorted(-thresholds, -0.5, side='right') - 1]),
+        'curves': {
+            'thresholds': thresholds,
+            'fpr': fpr,
+            'tpr': tpr,
+            'precision': precision,
+            'recall': recall,
+            'accuracy': accuracy
+        }
+    }
+
+def downsample_curves(curves: Dict[str, np.ndarray], max_points: int = 1000) -> Dict[str, np.ndarray]:
+    """按下标均匀抽取不超过max_points个点（保留首尾），float32存储"""
+    length = len(curves['thresholds'])
+    index = np.unique(np.linspace(0, length - 1, min(length, max_points)).round().astype(np.int64))
+    return {name: values[index].astype(np.float32) for name, values in curves.items()}
+
+def save_curves(result: Dict[str, Any], path: str, max_points: int = 1000):
+    """曲线数组写入npz，标量摘要写入同名json"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    np.savez_compressed(path, **downsample_curves(result['curves'], max_points))
+    summary = {k: result.get(k) for k in SUMMARY_KEYS}
+    with open(os.path.splitext(path)[0] + '.json', 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+
+def main():
+    """对结果文件中的概率做ROC/PR分析"""
+    try:
+        from .significance import load_label_array
+        from .streaming_eval import iter_jsonl_chunks
+    except ImportError:
+        from significance import load_label_array
+        from streaming_eval import iter_jsonl_chunks
+
+    parser = argparse.ArgumentParser(description="ROC/PR曲线与阈值扫描")
+    parser.add_argument('--result-file', default='results/enhanced_result.jsonl',
+                        help='带probability字段的结果文件')
+    parser.add_argument('--label-file', default='test_label.jsonl', help='标签文件')
+    parser.add_argument('--max-points', type=int, default=1000, help='保存的曲线点数上限')
+    parser.add_argument('--output', default='evaluation_results/curves.npz', help='曲线输出路径')
+    args = parser.parse_args()
+
+    print("📈 ROC/PR曲线与阈值扫描")
+    print("=" * 50)
+    y_true = load_label_array(args.label_file)
+    chunks = []
+    for chunk in iter_jsonl_chunks(args.result_file, 100_000):
+        probabilities = extract_probabilities(chunk)
+        if probabilities is None:
+            print(f"❌ 结果文件缺少概率字段（{', '.join(PROBABILITY_KEYS)}）: {args.result_file}")
+            return
+        chunks.append(probabilities)
+    scores = np.concatenate(chunks) if chunks else np.empty(0)
+    if len(scores) != len(y_true):
+        print(f"❌ 标签和预测长度不匹配: {len(y_true)} vs {len(scores)}")
+        return
+
+    result = compute_curves(y_true, scores)
+    auc = f"{result['auc']:.4f}" if result['auc'] is not None else '-'
+    print(f"  • AUC: {auc}")
+    if result['average_precision'] is not None:
+        print(f"  • 平均精确率: {result['average_precision']:.4f}")
+    print(f"  • 阈值0.5准确率: {result['accuracy_at_0.5']:.4f}")
+    print(f"  • 最优阈值: {result['best_threshold']:.4f} (准确率 {result['best_threshold_accuracy']:.4f})")
+
+    save_curves(result, args.output, args.max_points)
+    print(f"📄 曲线已保存: {args.output}")
+
+if __name__ == '__main__':
+    main()
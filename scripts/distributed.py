@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+金融文本相似度分类竞赛 - 多进程数据并行
+兼容torchrun：CPU上用gloo、有GPU时用NCCL做梯度all-reduce；
+训练数据只由rank 0分词一次写成预分词缓存，各rank按 seed+epoch 确定性地切分自己的分片；
+checkpoint与指标只由rank 0写出。附带1/2/4进程的扩展性基准
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import tempfile
+from typing import Dict, Any, List, Optional, Callable
+
+import numpy as np
+import torch
+import torch.distributed as dist
+from torch.utils.data import Dataset, DataLoader, Sampler
+
+try:
+    from .feature_cache import texts_fingerprint
+except ImportError:
+    from feature_cache import texts_fingerprint
+
+def setup_distributed(backend: Optional[str] = None) -> Dict[str, Any]:
+    """
+    按torchrun设置的环境变量初始化进程组（WORLD_SIZE为1时不初始化）
+
+    Args:
+        backend: None表示有GPU时用nccl，否则用gloo
+    """
+    world_size = int(os.environ.get('WORLD_SIZE', 1))
+    rank = int(os.environ.get('RANK', 0))
+    local_rank = int(os.environ.get('LOCAL_RANK', 0))
+
+    if world_size > 1 and not dist.is_initialized():
+        if backend is None:
+            backend = 'nccl' if torch.cuda.is_available() else 'gloo'
+        if backend == 'nccl':
+            torch.cuda.set_device(local_rank)
+        dist.init_process_group(backend=backend)
+
+    return {
+        'rank': rank,
+        'world_size': world_size,
+        'local_rank': local_rank,
+        'backend': dist.get_backend() if dist.is_initialized() else None
+    }
+
+def is_main_process() -> bool:
+    return not dist.is_initialized() or dist.get_rank() == 0
+
+def barrier():
+    if dist.is_initialized():
+        dist.barrier()
+
+def cleanup_distributed():
+    if dist.is_initialized():
+        dist.destroy_process_group()
+
+def pretokenized_paths(cache_dir: str, name: str) -> Dict[str, str]:
+    base = os.path.join(cache_dir, name)
+    return {
+        'tokens': f'{base}.tokens.npy',
+        'offsets': f'{base}.offsets.npy',
+        'labels': f'{base}.labels.npy',
+        'meta': f'{base}.json'
+    }
+
+def write_pretokenized(token_ids: List[List[int]], labels: List[int], cache_dir: str, name: str,
+                       meta: Dict[str, Any]):
+    """把分词结果写成扁平token数组+偏移量（元信息最后写，存在即代表完整）"""
+    os.makedirs(cache_dir, exist_ok=True)
+    paths = pretokenized_paths(cache_dir, name)
+    if os.path.exists(paths['meta']):
+        os.remove(paths['meta'])
+
+    offsets = np.zeros(len(token_ids) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(ids) for ids in token_ids])
+    tokens = np.fromiter((t for ids in token_ids for t in ids), dtype=np.int32, count=int(offsets[-1]))
+    np.save(paths['tokens'], tokens)
+    np.save(paths['offsets'], offsets)
+    np.save(paths['labels'], np.asarray(labels, dtype=np.int64))
+
+    with open(paths['meta'], 'w', encoding='utf-8') as f:
+        json.dump({**meta, 'num_samples': len(token_ids), 'num_tokens': int(offsets[-1])}, f, ensure_ascii=False)
+
+def get_or_pretokenize(tokenize: Callable[[List[str]], List[List[int]]], texts: List[str], labels: List[int],
+                       cache_dir: str, name: str, meta: Dict[str, Any]) -> 'PretokenizedDataset':
+    """
+    rank 0分词并写缓存，其余rank等待后直接读取
+
+    Args:
+        tokenize: 文本列表 -> token id列表
+        meta: 参与缓存校验的字段（模型名、最大长度等）
+    """
+    expected = {**meta, 'fingerprint': texts_fingerprint(texts)}
+    if is_main_process() and not PretokenizedDataset.is_valid(cache_dir, name, expected):
+        print(f"🔤 预分词 {len(texts)} 条样本 → {cache_dir}/{name}")
+        write_pretokenized(tokenize(texts), labels, cache_dir, name, expected)
+    barrier()
+    return PretokenizedDataset(cache_dir, name)
+
+class PretokenizedDataset(Dataset):
+    """只读memmap上的预分词数据集，返回未padding的样本，由collator负责组批"""
+
+    def __init__(self, cache_dir: str, name: str):
+        paths = pretokenized_paths(cache_dir, name)
+        self.tokens = np.load(paths['tokens'], mmap_mode='r')
+        self.offsets = np.load(paths['offsets'])
+        self.labels = np.load(paths['labels'])
+
+    @staticmethod
+    def is_valid(cache_dir: str, name: str, expected: Dict[str, Any]) -> bool:
+        meta_path = pretokenized_paths(cache_dir, name)['meta']
+        if not os.path.exists(meta_path):
+            return False
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        return all(meta.get(k) == v for k, v in expected.items())
+
+    def lengths(self) -> List[int]:
+        return np.diff(self.offsets).tolist()
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, idx):
+        ids = torch.from_numpy(np.array(self.tokens[self.offsets[idx]:self.offsets[idx + 1]], dtype=np.int64))
+        return {
+            'input_ids': ids,
+            'attention_mask': torch.ones_like(ids),
+            'labels': torch.tensor(int(self.labels[idx]), dtype=torch.long)
+        }
+
+class ShardedSampler(Sampler):
+    """
+    确定性分片采样器
+
+    所有rank用相同的 seed+epoch 生成同一个排列，补齐到world_size的整数倍后
+    按 rank::world_size 取分片，保证各rank样本数相同、互不重叠且可复现。
+    """
+
+    def __init__(self, num_samples: int, rank: int = 0, world_size: int = 1, seed: int = 42, shuffle: bool = True):
+        self.num_samples = num_samples
+        self.rank = rank
+        self.world_size = world_size
+        self.seed = seed
+        self.shuffle = shuffle
+        self.epoch = 0
+        self.shard_size = -(-num_samples // world_size)
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def shard(self) -> List[int]:
+        if self.shuffle:
+            generator = torch.Generator()
+            generator.manual_seed(self.seed + self.epoch)
+            order = torch.randperm(self.num_samples, generator=generator).tolist()
+        else:
+            order = list(range(self.num_samples))
+        # 循环补齐，保证每个rank的步数一致（否则all-reduce会互相等待）
+        total = self.shard_size * self.world_size
+        order += order[:total - len(order)]
+        return order[self.rank:total:self.world_size]
+
+    def __iter__(self):
+        return iter(self.shard())
+
+    def __len__(self):
+        return self.shard_size
+
+class ShardedDataLoader(DataLoader):
+    """把Trainer的set_epoch转发给分片采样器"""
+
+    def set_epoch(self, epoch: int):
+        self.sampler.set_epoch(epoch)
+
+class ShardedDataTrainerMixin:
+    """
+    Trainer mixin：训练集用ShardedSampler按rank切分，不再经accelerate二次切分
+
+    模型仍由Trainer用DDP包装，反向时自动all-reduce梯度；
+    checkpoint、日志和指标由Trainer按should_save/is_world_process_zero只在rank 0写出。
+    """
+
+    def get_train_dataloader(self):
+        if not dist.is_initialized():
+            return super().get_train_dataloader()
+
+        sampler = ShardedSampler(len(self.train_dataset), dist.get_rank(), dist.get_world_size(), self.args.seed)
+        return ShardedDataLoader(
+            self.train_dataset,
+            batch_size=self._train_batch_size,
+            sampler=sampler,
+            collate_fn=self.data_collator,
+            drop_last=self.args.dataloader_drop_last,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+        )
+
+def pad_collate(features: List[Dict[str, torch.Tensor]], pad_token_id: int = 0) -> Dict[str, torch.Tensor]:
+    """右padding组批（基准用，不依赖tokenizer）"""
+    longest = max(len(f['input_ids']) for f in features)
+    input_ids = torch.full((len(features), longest), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(features), longest), dtype=torch.long)
+    for i, f in enumerate(features):
+        input_ids[i, :len(f['input_ids'])] = f['input_ids']
+        attention_mask[i, :len(f['input_ids'])] = 1
+    return {
+        'input_ids': input_ids,
+        'attention_mask': attention_mask,
+        'labels': torch.stack([f['labels'] for f in features])
+    }
+
+def _benchmark_worker(args):
+    """torchrun启动的基准进程：微型Qwen上做固定步数的DDP训练（每rank批次固定，弱扩展）"""
+    try:
+        from .cpu_training import build_tiny_qwen, configure_cpu_threads, physical_cores, available_cpus
+    except ImportError:
+        from cpu_training import build_tiny_qwen, configure_cpu_threads, physical_cores, available_cpus
+    from torch.nn.parallel import DistributedDataParallel
+
+    use_cuda = torch.cuda.is_available() and args.backend != 'gloo'
+    info = setup_distributed(args.backend or ('nccl' if use_cuda else 'gloo'))
+    world_size = info['world_size']
+    if not use_cuda:
+        # 各进程平分物理核心，避免线程超额订阅
+        configure_cpu_threads(max(len(physical_cores(available_cpus())) // world_size, 1))
+
+    generator = np.random.default_rng(0)
+    num_samples = args.batch_size * (args.steps + 2) * 4
+    lengths = generator.integers(args.seq_len // 2, args.seq_len + 1, num_samples)
+    dataset = get_or_pretokenize(
+        lambda texts: [generator.integers(1, 8192, n).tolist() for n in lengths],
+        [str(i) for i in range(num_samples)], (np.arange(num_samples) % 2).tolist(),
+        args.cache_dir, 'scaling_benchmark', {'seq_len': args.seq_len}
+    )
+
+    device = torch.device(f"cuda:{info['local_rank']}" if use_cuda else 'cpu')
+    torch.manual_seed(0)
+    model = build_tiny_qwen(args.hidden_size, args.num_layers).to(device)
+    if dist.is_initialized():
+        model = DistributedDataParallel(model, device_ids=[device.index] if device.type == 'cuda' else None)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-4)
+
+    sampler = ShardedSampler(len(dataset), info['rank'], world_size, seed=0)
+    loader = iter(DataLoader(dataset, batch_size=args.batch_size, sampler=sampler, collate_fn=pad_collate))
+
+    def train_step():
+        batch = {k: v.to(device) for k, v in next(loader).items()}
+        loss = model(**batch).loss
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad(set_to_none=True)
+
+    for _ in range(2):
+        train_step()
+    barrier()
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        train_step()
+    barrier()
+    elapsed = time.perf_counter() - start
+
+    if is_main_process():
+        result = {
+            'world_size': world_size,
+            'backend': info['backend'] or ('cuda' if use_cuda else 'cpu'),
+            'samples_per_second': args.steps * args.batch_size * world_size / elapsed,
+            'step_seconds': elapsed / args.steps
+        }
+        with open(args.result_file, 'w', encoding='utf-8') as f:
+            json.dump(result, f)
+    cleanup_distributed()
+
+def benchmark_scaling(nprocs: List[int], steps: int = 20, batch_size: int = 8, seq_len: int = 128,
+                      hidden_size: int = 256, num_layers: int = 4, backend: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    依次用torchrun启动1/2/4个进程，比较总吞吐和扩展效率
+
+    Returns:
+        每个进程数一行：world_size, samples_per_second, step_seconds, speedup, efficiency
+    """
+    results = []
+    with tempfile.TemporaryDirectory(prefix='ddp_bench_') as tmp:
+        for n in nprocs:
+            result_file = os.path.join(tmp, f'result_{n}.json')
+            command = [
+                sys.executable, '-m', 'torch.distributed.run', '--standalone', f'--nproc_per_node={n}',
+                os.path.abspath(__file__), '--worker',
+                '--steps', str(steps), '--batch-size', str(batch_size), '--seq-len', str(seq_len),
+                '--hidden-size', str(hidden_size), '--num-layers', str(num_layers),
+                '--cache-dir', os.path.join(tmp, 'tokens'), '--result-file', result_file
+            ]
+            if backend:
+                command += ['--backend', backend]
+            subprocess.run(command, check=True)
+
+            with open(result_file, 'r', encoding='utf-8') as f:
+                results.append(json.load(f))
+            print(f"  • {n} 进程: {results[-1]['samples_per_second']:.1f} samples/s")
+
+    base = results[0]['samples_per_second'] / results[0]['world_size']
+    for row in results:
+        row['speedup'] = row['samples_per_second'] / base
+        row['efficiency'] = row['speedup'] / row['world_size']
+    return results
+
+def main():
+    """运行多进程扩展性基准（--worker为torchrun启动的子进程入口）"""
+    parser = argparse.ArgumentParser(description="多进程数据并行扩展性基准")
+    parser.add_argument('--nprocs', type=int, nargs='+', default=[1, 2, 4], help='待测进程数')
+    parser.add_argument('--steps', type=int, default=20, help='每个配置测量的步数')
+    parser.add_argument('--batch-size', type=int, default=8, help='每个进程的批次大小')
+    parser.add_argument('--seq-len', type=int, default=128, help='最大序列长度')
+    parser.add_argument('--hidden-size', type=int, default=256, help='微型模型隐藏维度')
+    parser.add_argument('--num-layers', type=int, default=4, help='微型模型层数')
+    parser.add_argument('--backend', choices=['gloo', 'nccl'], default=None, help='通信后端，默认自动选择')
+    parser.add_argument('--output', default='results/ddp_scaling_benchmark.json', help='结果输出路径')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--cache-dir', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        _benchmark_worker(args)
+        return
+
+    print("🔗 多进程数据并行扩展性基准")
+    print("=" * 50)
+    results = benchmark_scaling(args.nprocs, args.steps, args.batch_size, args.seq_len,
+                                args.hidden_size, args.num_layers, args.backend)
+
+    print("\n" + "=" * 58)
+    print(f"{'进程数':>8}{'后端':>8}{'samples/s':>14}{'加速比':>10}{'扩展效率':>12}")
+    print("-" * 58)
+    for row in results:
+        print(f"{row['world_size']:>8}{row['backend']:>8}{row['samples_per_second']:>14.1f}"
+              f"{row['speedup']:>10.2f}{row['efficiency']:>12.1%}")
+    print("=" * 58)
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"📄 结果已保存: {args.output}")
+
+if __name__ == '__main__':
+    main()
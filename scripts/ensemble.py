@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+金融文本相似度分类竞赛 - 流式多模型集成
+N个结果文件（jsonl或列式结果目录）按块同步读取，每块构成 (样本, 模型) 的投票矩阵和概率矩阵，
+用多数投票、平均概率或加权概率得到集成结果并逐块写出，内存只与块大小有关
+"""
+
+import os
+import json
+import time
+import argparse
+from itertools import zip_longest
+from typing import Dict, Any, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    from .curves import record_probability
+    from .response_parser import parse_batch
+    from .result_store import ResultStore, is_result_store
+    from .significance import load_label_array
+    from .streaming_eval import iter_jsonl_chunks
+except ImportError:
+    from curves import record_probability
+    from response_parser import parse_batch
+    from result_store import ResultStore, is_result_store
+    from significance import load_label_array
+    from streaming_eval import iter_jsonl_chunks
+
+ENSEMBLE_METHODS = ('majority_vote', 'average', 'weighted')
+DEFAULT_CHUNK_SIZE = 50_000
+
+def iter_result_columns(result_file: str, chunk_size: int = DEFAULT_CHUNK_SIZE) \
+        -> Iterator[Tuple[np.ndarray, np.ndarray, List[str], Optional[List[Dict]]]]:
+    """
+    按块读取单个结果的投票和分数
+
+    两种格式的投票都用response_parser.parse_batch解析原始输出，规则相同；
+    分数为类别1概率，没有概率的行用投票(0/1)代替。
+
+    Yields:
+        (votes int8, scores float32, responses, records)；列式结果的records为None，需要时按行还原
+    """
+    if is_result_store(result_file):
+        store = ResultStore(result_file)
+        probabilities = store.probability_column
+        for start in range(0, len(store), chunk_size):
+            stop = min(start + chunk_size, len(store))
+            # 投票与jsonl一样由原始输出解析，不用按评估规则写入的prediction列
+            responses = [store.response(i) for i in range(start, stop)]
+            votes = parse_batch(responses)
+            scores = np.asarray(probabilities[start:stop], dtype=np.float32)
+            scores = np.where(np.isnan(scores), votes, scores).astype(np.float32)
+            yield votes, scores, responses, None
+        return
+
+    for records in iter_jsonl_chunks(result_file, chunk_size):
+        responses = [r.get('response', '0') for r in records]
+        votes = parse_batch(responses)
+        scores = np.fromiter((v if p is None else p for p, v in zip(map(record_probability, records), votes)),
+                             dtype=np.float32, count=len(records))
+        yield votes, scores, responses, records
+
+def iter_column_chunks(result_files: Sequence[str], chunk_size: int = DEFAULT_CHUNK_SIZE) \
+        -> Iterator[List[Tuple[np.ndarray, np.ndarray, List[str], Optional[List[Dict]]]]]:
+    """所有结果同步按块读取，每次产出各结果的同一块；长度不一致时抛出ValueError"""
+    readers = [iter_result_columns(path, chunk_size) for path in result_files]
+    offset = 0
+    for chunks in zip_longest(*readers):
+        lengths = {len(chunk[0]) if chunk is not None else 0 for chunk in chunks}
+        if len(lengths) != 1:
+            raise ValueError(f"预测文件长度不一致（第 {offset} 条之后）")
+        offset += lengths.pop()
+        yield list(chunks)
+
+def _normalize_weights(weights: Optional[Sequence[float]], num_models: int) -> np.ndarray:
+    if weights is None:
+        return np.full(num_models, 1.0 / num_models)
+    weights = np.asarray(weights, dtype=np.float64)
+    if weights.shape != (num_models,):
+        raise ValueError(f"权重个数与模型数不一致: {len(weights)} vs {num_models}")
+    if weights.sum() <= 0:
+        raise ValueError("权重之和必须为正")
+    return weights / weights.sum()
+
+def combine(votes: np.ndarray, scores: np.ndarray, method: str = 'majority_vote',
+            weights: Optional[Sequence[float]] = None, threshold: float = 0.5) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    合并一块 (样本, 模型) 矩阵
+
+    Args:
+        votes: 各模型的0/1投票
+        scores: 各模型的类别1概率
+        method: 'majority_vote' 超过半数为1（平票为0）；'average' 平均概率；'weighted' 加权平均概率
+        weights: weighted方法的模型权重（None为等权）
+        threshold: 平均/加权概率判为1的阈值
+
+    Returns:
+        (预测 int8, 集成分数 float32)；多数投票的分数为投1的比例
+    """
+    num_models = votes.shape[1]
+    if method == 'majority_vote':
+        vote_counts = votes.sum(axis=1, dtype=np.int32)
+        return (vote_counts * 2 > num_models).astype(np.int8), (vote_counts / num_models).astype(np.float32)
+    if method == 'average':
+        score = scores.mean(axis=1)
+    elif method == 'weighted':
+        score = scores @ _normalize_weights(weights, num_models).astype(np.float32)
+    else:
+        raise ValueError(f"未知的集成方法: {method}，可选 {ENSEMBLE_METHODS}")
+    return (score >= threshold).astype(np.int8), score.astype(np.float32)
+
+def iter_ensemble(result_files: Sequence[str], method: str = 'majority_vote',
+                  weights: Optional[Sequence[float]] = None, threshold: float = 0.5,
+                  chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[List[Dict]]:
+    """
+    流式集成，按块产出集成后的记录
+
+    记录以第一个结果的对应行为基础，附加各模型的原始输出和投票，
+    probability字段为集成分数，可直接用于ROC/阈值分析。
+    """
+    if method not in ENSEMBLE_METHODS:
+        raise ValueError(f"未知的集成方法: {method}，可选 {ENSEMBLE_METHODS}")
+    first_store = ResultStore(result_files[0]) if is_result_store(result_files[0]) else None
+    start = 0
+    for chunks in iter_column_chunks(result_files, chunk_size):
+        votes = np.stack([chunk[0] for chunk in chunks], axis=1)
+        scores = np.stack([chunk[1] for chunk in chunks], axis=1)
+        predictions, ensemble_scores = combine(votes, scores, method, weights, threshold)
+
+        records = chunks[0][3]
+        if records is None:
+            records = [first_store.record(i) for i in range(start, start + len(votes))]
+        responses = list(zip(*(chunk[2] for chunk in chunks)))
+        for i, record in enumerate(records):
+            prediction = int(predictions[i])
+            record['original_responses'] = list(responses[i])
+            record['votes'] = votes[i].tolist()
+            record['response'] = str(prediction)
+            record['prediction'] = prediction
+            record['probability'] = float(ensemble_scores[i])
+            record['vote_count'] = len(result_files)
+        start += len(votes)
+        yield records
+
+def learn_weights(result_files: Sequence[str], label_file: str,
+                  chunk_size: int = DEFAULT_CHUNK_SIZE) -> np.ndarray:
+    """
+    由验证标签学习模型权重：w = log(acc / (1 - acc))，不优于随机的模型权重为0
+
+    只流式累计各模型的正确数，内存与样本数无关（标签除外）。
+    """
+    y_true = load_label_array(label_file)
+    correct = np.zeros(len(result_files), dtype=np.int64)
+    start = 0
+    for chunks in iter_column_chunks(result_files, chunk_size):
+        votes = np.stack([chunk[0] for chunk in chunks], axis=1)
+        labels = y_true[start:start + len(votes)]
+        if len(labels) != len(votes):
+            raise ValueError(f"标签数少于预测数: {len(y_true)}")
+        correct += (votes == labels[:, None]).sum(axis=0)
+        start += len(votes)
+    if start != len(y_true):
+        raise ValueError(f"标签和预测长度不匹配: {len(y_true)} vs {start}")
+
+    accuracy = np.clip(correct / max(start, 1), 1e-6, 1 - 1e-6)
+    weights = np.maximum(np.log(accuracy / (1 - accuracy)), 0.0)
+    return weights if weights.sum() > 0 else np.ones(len(result_files))
+
+def ensemble_to_file(result_files: Sequence[str], output_path: str, method: str = 'majority_vote',
+                     weights: Optional[Sequence[float]] = None, threshold: float = 0.5,
+                     chunk_size: int = DEFAULT_CHUNK_SIZE) -> Dict[str, Any]:
+    """流式集成并逐块写出jsonl（先写临时文件，完成后原子替换），返回摘要"""
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    tmp_path = output_path + '.tmp'
+    start = time.perf_counter()
+    num_samples = num_positive = num_unanimous = 0
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for records in iter_ensemble(result_files, method, weights, threshold, chunk_size):
+                f.writelines(json.dumps(r, ensure_ascii=False) + '\n' for r in records)
+                num_samples += len(records)
+                num_positive += sum(r['prediction'] for r in records)
+                num_unanimous += sum(min(r['votes']) == max(r['votes']) for r in records)
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    seconds = time.perf_counter() - start
+    return {
+        'result_files': list(result_files),
+        'method': method,
+        'weights': None if weights is None else [float(w) for w in weights],
+        'threshold': threshold,
+        'output': output_path,
+        'num_samples': num_samples,
+        'positive_rate': num_positive / num_samples if num_samples else 0.0,
+        'unanimous_rate': num_unanimous / num_samples if num_samples else 0.0,
+        'seconds': seconds,
+        'samples_per_second': num_samples / seconds if seconds > 0 else 0.0
+    }
+
+def main():
+    """流式集成入口"""
+    try:
+        from .ensemble_search import load_ensemble_config
+    except ImportError:
+        from ensemble_search import load_ensemble_config
+
+    parser = argparse.ArgumentParser(description="流式多模型集成")
+    parser.add_argument('results', nargs='*', help='结果文件（jsonl或列式结果目录）')
+    parser.add_argument('--method', choices=ENSEMBLE_METHODS, default='majority_vote', help='集成方法')
+    parser.add_argument('--weights', default=None, help='weighted方法的权重，逗号分隔')
+    parser.add_argument('--config', default=None,
+                        help='ensemble_search输出的配置；提供结果文件时按配置中的模型序号挑选')
+    parser.add_argument('--label-file', default=None, help='提供时由验证标签学习weighted方法的权重')
+    parser.add_argument('--threshold', type=float, default=0.5, help='平均/加权概率的判定阈值')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='每块样本数')
+    parser.add_argument('--output', default='results/ensemble_result.jsonl', help='集成结果输出路径')
+    args = parser.parse_args()
+
+    print("🤝 流式多模型集成")
+    print("=" * 50)
+    if args.config:
+        config = load_ensemble_config(args.config, args.results or None)
+        args.results, args.method, args.threshold = config['prediction_files'], config['method'], config['threshold']
+        args.weights = ','.join(str(w) for w in config['weights']) if config['weights'] else None
+        print(f"📋 使用集成配置: {args.config}")
+    if not args.results:
+        print("❌ 请提供结果文件或 --config")
+        return
+    missing = [path for path in args.results if not (os.path.isfile(path) or is_result_store(path))]
+    if missing:
+        print(f"❌ 找不到结果文件: {missing}")
+        return
+
+    weights = [float(w) for w in args.weights.split(',')] if args.weights else None
+    if args.method == 'weighted' and weights is None and args.label_file:
+        weights = learn_weights(args.results, args.label_file, args.chunk_size).tolist()
+        print(f"⚖️ 学习到的权重: {[round(w, 4) for w in weights]}")
+
+    try:
+        summary = ensemble_to_file(args.results, args.output, args.method, weights, args.threshold, args.chunk_size)
+    except ValueError as e:
+        print(f"❌ 无法进行集成: {e}")
+        return
+
+    print(f"  • 模型数: {len(args.results)}，方法: {args.method}")
+    print(f"  • 样本数: {summary['num_samples']:,}，正类比例: {summary['positive_rate']:.4f}，"
+          f"全票一致: {summary['unanimous_rate']:.4f}")
+    print(f"  • 耗时: {summary['seconds']:.2f}s ({summary['samples_per_second']:.0f} 条/s)")
+    print(f"📄 集成结果已保存: {args.output}")
+
+if __name__ == '__main__':
+    main()
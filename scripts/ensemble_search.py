@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+金融文本相似度分类竞赛 - 集成子集与权重搜索
+在验证集的 (样本, 模型) 预测矩阵上搜索最佳集成：模型数较少时穷举全部2^K个子集，
+较多时贪心前向选择；一批候选子集用一次矩阵乘法打分（投票矩阵按不同行压缩后计数），
+可选坐标下降调权重，输出的配置直接传给utils.ensemble_predictions
+"""
+
+import os
+import json
+import time
+import argparse
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    from .curves import compute_curves
+    from .ensemble import iter_column_chunks, DEFAULT_CHUNK_SIZE
+    from .significance import load_label_array, metrics_from_cells
+except ImportError:
+    from curves import compute_curves
+    from ensemble import iter_column_chunks, DEFAULT_CHUNK_SIZE
+    from significance import load_label_array, metrics_from_cells
+
+SEARCH_METRICS = ('accuracy', 'f1_macro', 'f1_class_1')
+SEARCH_METHODS = ('majority_vote', 'average')
+# 每次矩阵乘法评估的候选数，限制 (样本, 候选) 临时矩阵的内存
+CANDIDATE_BATCH = 256
+WEIGHT_GRID = (0.0, 0.25, 0.5, 1.0, 1.5, 2.0, 3.0)
+
+class ValidationColumns:
+    """
+    验证集预测列缓存
+
+    majority_vote只依赖 (投票模式, 标签)，相同的行压缩为一行加计数；
+    average依赖连续的概率，保留全部行。
+
+    Args:
+        votes: (样本, 模型) 的0/1投票
+        scores: (样本, 模型) 的类别1概率
+        y_true: 标签
+    """
+
+    def __init__(self, votes: np.ndarray, scores: np.ndarray, y_true: np.ndarray):
+        self.votes = np.asarray(votes, dtype=np.int8)
+        self.scores = np.asarray(scores, dtype=np.float32)
+        self.y_true = np.asarray(y_true, dtype=np.int8)
+        if not (len(self.votes) == len(self.scores) == len(self.y_true)):
+            raise ValueError(f"标签和预测长度不匹配: {len(self.y_true)} vs {len(self.votes)}")
+        self.num_samples, self.num_models = self.votes.shape
+        self._compressed: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None
+
+    def compressed_votes(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """不同的 (投票模式, 标签) 行，返回 (投票, 标签, 行数)"""
+        if self._compressed is None:
+            rows = np.concatenate([self.votes, self.y_true[:, None]], axis=1)
+            unique, counts = np.unique(rows, axis=0, return_counts=True)
+            self._compressed = (unique[:, :-1].astype(np.float32), unique[:, -1].astype(np.float64),
+                                counts.astype(np.float64))
+        return self._compressed
+
+    def design(self, method: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """打分用的 (列矩阵, 标签, 样本权重)"""
+        if method == 'majority_vote':
+            return self.compressed_votes()
+        return self.scores, self.y_true.astype(np.float64), np.ones(self.num_samples)
+
+def load_validation_columns(result_files: Sequence[str], label_file: str,
+                            chunk_size: int = DEFAULT_CHUNK_SIZE) -> ValidationColumns:
+    """流式读取K个验证结果（取值规则同ensemble.iter_result_columns）拼成列矩阵"""
+    votes, scores = [], []
+    for chunks in iter_column_chunks(result_files, chunk_size):
+        votes.append(np.stack([chunk[0] for chunk in chunks], axis=1))
+        scores.append(np.stack([chunk[1] for chunk in chunks], axis=1))
+    y_true = load_label_array(label_file)
+    if not votes:
+        raise ValueError("验证结果为空")
+    return ValidationColumns(np.concatenate(votes), np.concatenate(scores), y_true)
+
+def batch_metrics(predictions: np.ndarray, y: np.ndarray, sample_weight: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    一批候选的指标：两次矩阵-向量乘法得到每个候选的TN/FP/FN/TP
+
+    Args:
+        predictions: (行, 候选) 的0/1预测
+    """
+    # float32累加在2^24以内是精确整数，更大的验证集改用float64
+    dtype = np.float32 if sample_weight.sum() < 1 << 24 else np.float64
+    predictions = predictions.astype(dtype)
+    predicted_positive = sample_weight.astype(dtype) @ predictions
+    tp = (sample_weight * y).astype(dtype) @ predictions
+    positives = float(sample_weight @ y)
+    total = float(sample_weight.sum())
+    fp, fn = predicted_positive - tp, positives - tp
+    cells = np.stack([total - positives - fp, fp, fn, tp], axis=-1)
+    return metrics_from_cells(cells)
+
+def evaluate_masks(columns: np.ndarray, y: np.ndarray, sample_weight: np.ndarray, masks: np.ndarray,
+                   method: str = 'majority_vote', metric: str = 'accuracy', threshold: float = 0.5) -> np.ndarray:
+    """
+    分批评估子集掩码 (模型, 候选)，规则与ensemble.combine相同：
+    多数投票超过半数为1，平均概率不小于阈值为1
+    """
+    masks = masks.astype(np.float32)
+    values = np.empty(masks.shape[1])
+    for start in range(0, masks.shape[1], CANDIDATE_BATCH):
+        batch = masks[:, start:start + CANDIDATE_BATCH]
+        sizes = batch.sum(axis=0)
+        summed = columns @ batch
+        if method == 'majority_vote':
+            predictions = summed * 2 > sizes
+        else:
+            predictions = summed >= threshold * sizes
+        values[start:start + CANDIDATE_BATCH] = batch_metrics(predictions, y, sample_weight)[metric]
+    return values
+
+def _subset_masks(codes: np.ndarray, num_models: int) -> np.ndarray:
+    return ((codes[None, :] >> np.arange(num_models, dtype=np.int64)[:, None]) & 1).astype(np.float32)
+
+def exhaustive_search(data: ValidationColumns, method: str = 'majority_vote', metric: str = 'accuracy',
+                      threshold: float = 0.5, top_k: int = 10) -> Dict[str, Any]:
+    """穷举全部非空子集，返回最佳子集和前top_k个"""
+    columns, y, sample_weight = data.design(method)
+    codes = np.arange(1, 1 << data.num_models, dtype=np.int64)
+    values = np.concatenate([
+        evaluate_masks(columns, y, sample_weight, _subset_masks(codes[i:i + 65536], data.num_models),
+                       method, metric, threshold)
+        for i in range(0, len(codes), 65536)
+    ])
+    # 分数相同时优先模型少的子集
+    sizes = np.array([bin(int(c)).count('1') for c in codes])
+    order = np.lexsort((sizes, -values))[:top_k]
+    top = [{'models': [int(k) for k in np.flatnonzero(_subset_masks(codes[[i]], data.num_models)[:, 0])],
+            metric: float(values[i])} for i in order]
+    return {'search': 'exhaustive', 'num_candidates': int(len(codes)), 'models': top[0]['models'],
+            'score': top[0][metric], 'top': top}
+
+def greedy_search(data: ValidationColumns, method: str = 'majority_vote', metric: str = 'accuracy',
+                  threshold: float = 0.5) -> Dict[str, Any]:
+    """
+    贪心前向选择：每步加入使指标最高的模型，一直加到全部模型，取整条路径上最好的前缀
+
+    不在第一次没有提升时停止：多数投票下偶数个模型平票判0，加入第二个模型常常变差，
+    第三个模型之后才会提升。
+    """
+    columns, y, sample_weight = data.design(method)
+    num_models = data.num_models
+    selected: List[int] = []
+    history, num_candidates = [], 0
+    while len(selected) < num_models:
+        remaining = [k for k in range(num_models) if k not in selected]
+        masks = np.zeros((num_models, len(remaining)), dtype=np.float32)
+        masks[selected, :] = 1
+        masks[remaining, np.arange(len(remaining))] = 1
+        values = evaluate_masks(columns, y, sample_weight, masks, method, metric, threshold)
+        num_candidates += len(remaining)
+        best = int(np.argmax(values))
+        selected.append(remaining[best])
+        history.append({'models': list(selected), metric: float(values[best])})
+    # 分数相同时取模型少的前缀
+    best = max(range(len(history)), key=lambda i: (history[i][metric], -i))
+    return {'search': 'greedy', 'num_candidates': num_candidates, 'models': history[best]['models'],
+            'score': history[best][metric], 'top': sorted(history, key=lambda h: -h[metric])[:10]}
+
+def tune_weights(data: ValidationColumns, models: Sequence[int], metric: str = 'accuracy',
+                 threshold: float = 0.5, grid: Sequence[float] = WEIGHT_GRID,
+                 max_passes: int = 10) -> Dict[str, Any]:
+    """
+    坐标下降调整加权平均概率的权重
+
+    每次只改一个模型的权重，该模型在网格上的全部取值作为一批候选，一次矩阵乘法打分；
+    一轮没有任何提升时停止。
+    """
+    scores = data.scores[:, list(models)]
+    y, sample_weight = data.y_true.astype(np.float64), np.ones(data.num_samples)
+    weights = np.ones(len(models))
+
+    def evaluate(candidates: np.ndarray) -> np.ndarray:
+        # 候选 (模型, 候选) 先归一化，与ensemble.combine的weighted规则一致
+        totals = candidates.sum(axis=0)
+        valid = totals > 0
+        values = np.full(candidates.shape[1], -np.inf)
+        normalized = (candidates[:, valid] / totals[valid]).astype(np.float32)
+        values[valid] = batch_metrics(scores @ normalized >= threshold, y, sample_weight)[metric]
+        return values
+
+    best_score = float(evaluate(weights[:, None])[0])
+    passes = 0
+    for passes in range(1, max_passes + 1):
+        improved = False
+        for j in range(len(models)):
+            candidates = np.repeat(weights[:, None], len(grid), axis=1)
+            candidates[j] = grid
+            values = evaluate(candidates)
+            best = int(np.argmax(values))
+            if values[best] > best_score:
+                best_score, weights, improved = float(values[best]), candidates[:, best].copy(), True
+        if not improved:
+            break
+    return {'weights': (weights / weights.sum()).tolist(), 'score': best_score, 'passes': passes}
+
+def search_ensemble(data: ValidationColumns, method: str = 'majority_vote', metric: str = 'accuracy',
+                    threshold: float = 0.5, max_exhaustive: int = 12, tune: bool = False,
+                    tune_threshold: bool = False) -> Dict[str, Any]:
+    """
+    搜索最佳集成配置
+
+    Args:
+        max_exhaustive: 模型数不超过该值时穷举，否则贪心前向选择
+        tune: 在选出的子集上坐标下降调权重，验证分数更高时结果方法改为weighted
+        tune_threshold: 在最终集成分数上按准确率选择阈值，所选指标不下降时采用
+    """
+    if method not in SEARCH_METHODS:
+        raise ValueError(f"未知的搜索方法: {method}，可选 {SEARCH_METHODS}")
+    if metric not in SEARCH_METRICS:
+        raise ValueError(f"未知的指标: {metric}，可选 {SEARCH_METRICS}")
+
+    start = time.perf_counter()
+    if data.num_models <= max_exhaustive:
+        result = exhaustive_search(data, method, metric, threshold)
+    else:
+        result = greedy_search(data, method, metric, threshold)
+    result.update({'method': method, 'metric': metric, 'threshold': threshold, 'weights': None})
+
+    single = evaluate_masks(*data.design(method), np.eye(data.num_models, dtype=np.float32), method, metric, threshold)
+    result['single_model_scores'] = single.tolist()
+
+    if tune:
+        tuned = tune_weights(data, result['models'], metric, threshold)
+        result.update({'tuned_score': tuned['score'], 'tune_passes': tuned['passes']})
+        # 概率校准较差时加权平均可能不如搜索得到的方法，只在验证分数更高时采用
+        if tuned['score'] > result['score']:
+            result.update({'method': 'weighted', 'weights': tuned['weights'], 'score': tuned['score']})
+    if tune_threshold and result['method'] != 'majority_vote':
+        weights = np.asarray(result['weights'] or np.full(len(result['models']), 1 / len(result['models'])))
+        ensemble_scores = data.scores[:, result['models']] @ weights.astype(np.float32)
+        curves = compute_curves(data.y_true, ensemble_scores)
+        # 阈值按准确率选出，score按所选指标在新阈值下重新计算，与保存的阈值一致
+        predictions = (ensemble_scores >= curves['best_threshold'])[:, None]
+        score = float(batch_metrics(predictions, data.y_true.astype(np.float64),
+                                    np.ones(data.num_samples))[metric][0])
+        result['threshold_accuracy'] = curves['best_threshold_accuracy']
+        if score >= result['score']:
+            result.update({'threshold': curves['best_threshold'], 'score': score})
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+def build_config(result: Dict[str, Any], result_files: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+    """搜索结果转为集成配置，字段与utils.ensemble_predictions的参数对应"""
+    config = {
+        'models': result['models'],
+        'method': result['method'],
+        'weights': result['weights'],
+        'threshold': result['threshold'],
+        'validation': {k: result[k] for k in ('metric', 'score', 'search', 'num_candidates', 'seconds')}
+    }
+    if result_files is not None:
+        config['prediction_files'] = [result_files[k] for k in result['models']]
+    return config
+
+def load_ensemble_config(config_path: str, prediction_files: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+    """
+    读取搜索得到的配置，返回可直接展开传给utils.ensemble_predictions的参数
+
+    Args:
+        prediction_files: 与验证时顺序相同的K个测试结果文件，按配置中的模型序号挑选；
+                          None时使用配置中记录的验证结果文件
+    """
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    files = [prediction_files[k] for k in config['models']] if prediction_files is not None \
+        else config['prediction_files']
+    return {'prediction_files': files, 'method': config['method'],
+            'weights': config['weights'], 'threshold': config['threshold']}
+
+def synthetic_columns(num_samples: int, num_models: int, seed: int = 0) -> ValidationColumns:
+    """合成验证矩阵：各模型的概率由共享的样本难度加各自噪声得到，模型之间相关"""
+    rng = np.random.default_rng(seed)
+    y_true = rng.integers(0, 2, num_samples, dtype=np.int8)
+    margin = rng.normal(1.0, 1.0, num_samples)[:, None] + rng.normal(0, 1.5, (num_samples, num_models)) \
+        + rng.uniform(-0.5, 0.5, num_models)
+    logits = np.where(y_true[:, None] == 1, margin, -margin)
+    scores = (1 / (1 + np.exp(-logits))).astype(np.float32)
+    return ValidationColumns((scores >= 0.5).astype(np.int8), scores, y_true)
+
+def main():
+    """集成搜索入口"""
+    parser = argparse.ArgumentParser(description="集成子集与权重搜索")
+    parser.add_argument('results', nargs='*', help='K个验证结果文件（jsonl或列式结果目录）')
+    parser.add_argument('--label-file', default='test_label.jsonl', help='验证标签文件')
+    parser.add_argument('--synthetic', type=int, default=0, help='不读文件，用K个合成模型做基准')
+    parser.add_argument('--synthetic-samples', type=int, default=100_000, help='合成验证集样本数')
+    parser.add_argument('--method', choices=SEARCH_METHODS, default='majority_vote', help='集成方法')
+    parser.add_argument('--metric', choices=SEARCH_METRICS, default='accuracy', help='选择指标')
+    parser.add_argument('--threshold', type=float, default=0.5, help='平均概率的判定阈值')
+    parser.add_argument('--max-exhaustive', type=int, default=12, help='模型数不超过该值时穷举全部子集')
+    parser.add_argument('--tune-weights', action='store_true', help='坐标下降调整所选子集的权重')
+    parser.add_argument('--tune-threshold', action='store_true', help='按准确率选择概率阈值')
+    parser.add_argument('--output', default='results/ensemble_config.json', help='集成配置输出路径')
+    args = parser.parse_args()
+
+    print("🔎 集成子集与权重搜索")
+    print("=" * 50)
+    start = time.perf_counter()
+    if args.synthetic:
+        data = synthetic_columns(args.synthetic_samples, args.synthetic)
+        result_files = None
+    elif args.results:
+        result_files = args.results
+        try:
+            data = load_validation_columns(result_files, args.label_file)
+        except (ValueError, FileNotFoundError) as e:
+            print(f"❌ 无法读取验证结果: {e}")
+            return
+    else:
+        print("❌ 请提供验证结果文件或 --synthetic")
+        return
+    load_seconds = time.perf_counter() - start
+    print(f"✅ 验证矩阵: {data.num_samples:,} 条 × {data.num_models} 个模型 ({load_seconds:.1f}s)")
+
+    result = search_ensemble(data, args.method, args.metric, args.threshold, args.max_exhaustive,
+                             args.tune_weights, args.tune_threshold)
+    names = result_files or [f'model_{k}' for k in range(data.num_models)]
+    best_single = int(np.argmax(result['single_model_scores']))
+    print(f"  • 搜索方式: {result['search']}，候选数: {result['num_candidates']:,}，耗时: {result['seconds']:.2f}s")
+    print(f"  • 最佳单模型: {names[best_single]} ({args.metric} {result['single_model_scores'][best_single]:.4f})")
+    print(f"  • 最佳集成: {[names[k] for k in result['models']]}")
+    print(f"  • 方法: {result['method']}，{args.metric}: {result['score']:.4f}，阈值: {result['threshold']:.4f}")
+    if result['weights'] is not None:
+        print(f"  • 权重: {[round(w, 4) for w in result['weights']]}")
+
+    config = build_config(result, result_files)
+    config['search_result'] = result
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+    print(f"📄 集成配置已保存: {args.output}")
+    print("💡 使用: utils.ensemble_predictions(**ensemble_search.load_ensemble_config(配置路径, 测试结果文件))")
+
+if __name__ == '__main__':
+    main()
@@ -7,15 +7,22 @@
 import os
 import json
 import numpy as np
-from typing import Dict, List, Tuple
+from typing import Dict, List, Tuple, Optional
 from collections import Counter, defaultdict
 from swift.utils import read_from_jsonl
 import matplotlib.pyplot as plt
 import seaborn as sns
-from sklearn.metrics import (
-    accuracy_score, precision_score, recall_score, f1_score,
-    confusion_matrix, classification_report, roc_auc_score
-)
+
+try:
+    from .metrics import ConfusionCounts, accumulate_confusion
+    from .significance import bootstrap_ci
+    from .curves import compute_curves, extract_probabilities, save_curves
+    from .result_store import ResultStore, is_result_store, store_mismatch, store_path_for
+except ImportError:
+    from metrics import ConfusionCounts, accumulate_confusion
+    from significance import bootstrap_ci
+    from curves import compute_curves, extract_probabilities, save_curves
+    from result_store import ResultStore, is_result_store, store_mismatch, store_path_for
 
 def load_test_labels() -> List[int]:
     """加载测试集标签"""
@@ -60,45 +67,45 @@ def load_predictions(result_file: str) -> Tuple[List[int], List[Dict]]:
         print(f"❌ 加载预测结果失败: {e}")
         return [], []
 
-def calculate_metrics(y_true: List[int], y_pred: List[int]) -> Dict:
-    """计算各种评估指标"""
+def calculate_metrics(y_true, y_pred=None, y_prob=None, return_curves: bool = False) -> Dict:
+    """
+    计算各种评估指标
 
-    metrics = {}
+    一次bincount得到混淆矩阵，所有指标都由它推出（结果中也包含confusion_matrix）。
+    提供类别1概率时，再由一次排序+累加和得到AUC、平均精确率和最优准确率阈值，
+    auc改为基于概率的值；没有概率时auc为硬标签AUC。
 
-    try:
-        # 基本指标
-        metrics['accuracy'] = accuracy_score(y_true, y_pred)
-        metrics['precision_macro'] = precision_score(y_true, y_pred, average='macro')
-        metrics['recall_macro'] = recall_score(y_true, y_pred, average='macro')
-        metrics['f1_macro'] = f1_score(y_true, y_pred, average='macro')
-        metrics['precision_micro'] = precision_score(y_true, y_pred, average='micro')
-        metrics['recall_micro'] = recall_score(y_true, y_pred, average='micro')
-        metrics['f1_micro'] = f1_score(y_true, y_pred, average='micro')
-
-        # 类别特定的指标
-        metrics['precision_class_0'] = precision_score(y_true, y_pred, pos_label=0)
-        metrics['precision_class_1'] = precision_score(y_true, y_pred, pos_label=1)
-        metrics['recall_class_0'] = recall_score(y_true, y_pred, pos_label=0)
-        metrics['recall_class_1'] = recall_score(y_true, y_pred, pos_label=1)
-        metrics['f1_class_0'] = f1_score(y_true, y_pred, pos_label=0)
-        metrics['f1_class_1'] = f1_score(y_true, y_pred, pos_label=1)
-
-        # 计算AUC（如果需要概率值，这里简化处理）
-        # 对于二分类，AUC可以使用预测值近似计算
-        try:
-            metrics['auc'] = roc_auc_score(y_true, y_pred)
-        except:
-            metrics['auc'] = None
+    Args:
+        y_true: 真实标签（列表/数组）；y_pred为None时也可以是流式输入，
+            每项为 (y_true块, y_pred块) 或ConfusionCounts，或者直接传入一个ConfusionCounts
+        y_pred: 预测标签
+        y_prob: 类别1的概率（可选）
+        return_curves: 是否在结果中附带完整曲线数组（键curves）
+    """
 
+    try:
+        if isinstance(y_true, ConfusionCounts):
+            counts = y_true
+        elif y_pred is None:
+            counts = accumulate_confusion(y_true)
+        else:
+            counts = ConfusionCounts.from_arrays(y_true, y_pred)
+        metrics = counts.metrics()
+        if y_prob is not None:
+            curves = compute_curves(y_true, y_prob)
+            if not return_curves:
+                curves.pop('curves')
+            metrics.update(curves)
+        return metrics
     except Exception as e:
         print(f"⚠️ 计算指标时出错: {e}")
+        return {}
 
-    return metrics
-
-def plot_confusion_matrix(y_true: List[int], y_pred: List[int], save_path: str = 'evaluation_results/confusion_matrix.png'):
-    """绘制混淆矩阵"""
+def plot_confusion_matrix(y_true: List[int], y_pred: List[int], save_path: str = 'evaluation_results/confusion_matrix.png',
+                          cm: Optional[List[List[int]]] = None):
+    """绘制混淆矩阵（传入calculate_metrics得到的confusion_matrix时不再重新计算）"""
 
-    cm = confusion_matrix(y_true, y_pred)
+    cm = np.asarray(cm if cm is not None else ConfusionCounts.from_arrays(y_true, y_pred).counts)
     plt.figure(figsize=(8, 6))
 
     # 使用seaborn绘制热力图
@@ -112,7 +119,7 @@ def plot_confusion_matrix(y_true: List[int], y_pred: List[int], save_path: str =
 
     # 添加指标文本
     accuracy = np.trace(cm) / np.sum(cm)
-    plt.text(0.5, -0.1, '.3f',
+    plt.text(0.5, -0.1, f'准确率: {accuracy:.3f}',
              ha='center', va='center', transform=plt.gca().transAxes,
              fontsize=12, fontweight='bold')
 
@@ -123,8 +130,9 @@ def plot_confusion_matrix(y_true: List[int], y_pred: List[int], save_path: str =
     print("📊 混淆矩阵已保存至:")
     print(f"  {save_path}")
 
-def analyze_errors(y_true: List[int], y_pred: List[int], predictions_data: List[Dict]) -> Dict:
-    """分析错误样本"""
+def analyze_errors(y_true: List[int], y_pred: List[int], predictions_data: List[Dict],
+                   store: Optional[ResultStore] = None) -> Dict:
+    """分析错误样本（提供列式结果store时直接按行读取文本，不再解析query）"""
 
     error_analysis = {
         'total_errors': 0,
@@ -151,13 +159,15 @@ def analyze_errors(y_true: List[int], y_pred: List[int], predictions_data: List[
             if len(error_analysis['error_samples']) < 50:  # 只保存前50个错误样本
                 sample_info = {
                     'index': i,
-                    'true_label': true,
-                    'pred_label': pred,
+                    'true_label': int(true),
+                    'pred_label': int(pred),
                     'error_type': error_type
                 }
 
                 # 添加文本内容（如果可用）
-                if i < len(predictions_data):
+                if store is not None:
+                    sample_info['text1'], sample_info['text2'] = store.text_pair(i)
+                elif i < len(predictions_data):
                     pred_data = predictions_data[i]
                     query = pred_data.get('query', '')
 
@@ -284,8 +294,14 @@ def print_evaluation_summary(metrics: Dict, error_analysis: Dict):
     print(f"  召回率(微平均): {metrics.get('recall_micro', 0):.4f}")
     print(f"  F1值(微平均): {metrics.get('f1_micro', 0):.4f}")
 
-    if metrics.get('auc'):
-        print(f"  AUC: {metrics.get('auc', 0):.4f}")
+    # 有概率时才有平均精确率和阈值；没有概率时auc是由硬标签算出的
+    if metrics.get('average_precision') is not None:
+        if metrics.get('auc') is not None:
+            print(f"  AUC: {metrics['auc']:.4f}")
+        print(f"  平均精确率: {metrics['average_precision']:.4f}")
+        print(f"  最优阈值: {metrics['best_threshold']:.4f} (准确率 {metrics['best_threshold_accuracy']:.4f})")
+    elif metrics.get('auc') is not None:
+        print(f"  AUC(硬标签): {metrics['auc']:.4f}")
     print("\n🏷️ 类别特定指标:")
     print(f"  • 类别0 (不相似) - 精确率: {metrics.get('precision_class_0', 0):.4f}, 召回率: {metrics.get('recall_class_0', 0):.4f}, F1: {metrics.get('f1_class_0', 0):.4f}")
     print(f"  • 类别1 (相似) - 精确率: {metrics.get('precision_class_1', 0):.4f}, 召回率: {metrics.get('recall_class_1', 0):.4f}, F1: {metrics.get('f1_class_1', 0):.4f}")
@@ -302,14 +318,23 @@ def print_evaluation_summary(metrics: Dict, error_analysis: Dict):
     improvement = current_acc - baseline_acc
 
     print(f"\n🏆 与基线对比:")
-    print(".4f")
-    print(".4f")
-    if improvement > 0:
-        print(".4f")
-    elif improvement < 0:
-        print(".4f")
-    else:
-        print("  • 与基线持平")
+    print(f"  • 基线准确率: {baseline_acc:.4f}")
+    print(f"  • 当前准确率: {current_acc:.4f} ({improvement:+.4f})")
+
+    # 基线落在置信区间内时，差异可能只是测试集抽样噪声
+    bootstrap = metrics.get('bootstrap')
+    if bootstrap:
+        low, high = bootstrap['accuracy']['ci']
+        print(f"  • 95%置信区间: [{low:.4f}, {high:.4f}]")
+        for name in ('f1_macro', 'f1_class_1'):
+            row = bootstrap[name]
+            print(f"  • {name}: {row['value']:.4f} [{row['ci'][0]:.4f}, {row['ci'][1]:.4f}]")
+        if low > baseline_acc:
+            print("  • 显著优于基线")
+        elif high < baseline_acc:
+            print("  • 显著低于基线")
+        else:
+            print("  • 与基线的差异不显著")
 
 def main():
     """主评估函数"""
@@ -334,6 +359,17 @@ def main():
 
     print(f"✅ 找到结果文件: {result_file}")
 
+    # 同名的列式结果（直接memmap读取，无需解析）；与结果文件对不上时回退到结果文件
+    store = None
+    if is_result_store(store_path_for(result_file)):
+        store = ResultStore(store_path_for(result_file))
+        mismatch = store_mismatch(store, result_file)
+        if mismatch:
+            print(f"⚠️ 列式结果 {store.path} 已过期（{mismatch}），改用 {result_file}")
+            store = None
+        else:
+            print(f"✅ 使用列式结果: {store.path}")
+
     # 加载测试标签
     print("\n📥 加载测试标签...")
     y_true = load_test_labels()
@@ -342,8 +378,11 @@ def main():
 
     # 加载预测结果
     print("\n📥 加载预测结果...")
-    y_pred, predictions_data = load_predictions(result_file)
-    if not y_pred:
+    if store is not None:
+        y_pred, predictions_data = np.asarray(store.predictions, dtype=np.int64), []
+    else:
+        y_pred, predictions_data = load_predictions(result_file)
+    if len(y_pred) == 0:
         return
 
     # 检查长度一致性
@@ -355,11 +394,14 @@ def main():
 
     # 计算指标
     print("\n🧮 计算评估指标...")
-    metrics = calculate_metrics(y_true, y_pred)
+    y_prob = store.probabilities if store is not None else extract_probabilities(predictions_data)
+    metrics = calculate_metrics(y_true, y_pred, y_prob, return_curves=True)
+    curves = metrics.pop('curves', None)
+    metrics['bootstrap'] = bootstrap_ci(y_true, y_pred)
 
     # 错误分析
     print("\n🔍 分析错误样本...")
-    error_analysis = analyze_errors(y_true, y_pred, predictions_data)
+    error_analysis = analyze_errors(y_true, y_pred, predictions_data, store)
     error_analysis['y_true'] = y_true  # 保存用于绘图
     error_analysis['y_pred'] = y_pred
 
@@ -369,8 +411,12 @@ def main():
 
     # 生成可视化
     print("\n📈 生成可视化图表...")
-    plot_confusion_matrix(y_true, y_pred, f"{output_dir}/confusion_matrix.png")
+    plot_confusion_matrix(y_true, y_pred, f"{output_dir}/confusion_matrix.png", metrics.get('confusion_matrix'))
     plot_error_analysis(error_analysis, f"{output_dir}/error_analysis.png")
+    if curves is not None:
+        # 曲线以紧凑数组保存，不再画图
+        save_curves({**metrics, 'curves': curves}, f"{output_dir}/curves.npz")
+        print(f"📈 ROC/PR曲线已保存至: {output_dir}/curves.npz")
 
     # 保存评估报告
     save_evaluation_report(metrics, error_analysis, result_file, output_dir)
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+金融文本相似度分类竞赛 - 冻结主干特征缓存
+冻结的主干网络只在训练集/测试集上跑一次前向，把最后一个token的隐藏状态
+以float16 memmap形式缓存到磁盘，之后只在缓存特征上训练分类头
+"""
+
+import os
+import json
+import time
+import hashlib
+from typing import Dict, Any, List, Optional, Callable, Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+def texts_fingerprint(texts: List[str]) -> str:
+    """计算文本列表的指纹，用于判断缓存是否仍然有效"""
+    digest = hashlib.sha1()
+    for text in texts:
+        digest.update(text.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def cache_paths(cache_dir: str, name: str) -> Tuple[str, str]:
+    """返回特征文件和元信息文件路径"""
+    return os.path.join(cache_dir, f"{name}.f16"), os.path.join(cache_dir, f"{name}.json")
+
+def load_cached_features(cache_dir: str, name: str, expected_meta: Dict[str, Any]) -> Optional[np.memmap]:
+    """
+    读取已有的特征缓存
+
+    元信息文件在特征写完之后才落盘，因此存在且与期望一致即代表缓存完整可用。
+
+    Returns:
+        只读memmap，缓存不存在或不匹配时返回None
+    """
+    feature_path, meta_path = cache_paths(cache_dir, name)
+    if not (os.path.exists(feature_path) and os.path.exists(meta_path)):
+        return None
+
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+
+    for key, value in expected_meta.items():
+        if meta.get(key) != value:
+            return None
+
+    return np.memmap(feature_path, dtype=np.float16, mode='r',
+                     shape=(meta['num_samples'], meta['hidden_size']))
+
+@torch.inference_mode()
+def extract_features(backbone, tokenizer, texts: List[str], cache_dir: str, name: str,
+                     meta: Dict[str, Any], max_length: int = 512, batch_size: int = 32) -> np.memmap:
+    """
+    用冻结主干提取最后一个有效token的隐藏状态并写入memmap
+
+    Args:
+        backbone: 主干网络（不含分类头，输出last_hidden_state）
+        tokenizer: 分词器
+        texts: 输入文本
+        cache_dir: 缓存目录
+        name: 缓存名称
+        meta: 写入元信息的字段（模型名、最大长度等）
+        max_length: 最大序列长度
+        batch_size: 提取批次大小
+
+    Returns:
+        只读memmap，形状为(样本数, hidden_size)
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    feature_path, meta_path = cache_paths(cache_dir, name)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    hidden_size = backbone.config.hidden_size
+    device = next(backbone.parameters()).device
+    features = np.memmap(feature_path, dtype=np.float16, mode='w+', shape=(len(texts), hidden_size))
+
+    # 按长度排序组批，减少padding
+    lengths = [len(t) for t in texts]
+    order = sorted(range(len(texts)), key=lambda i: lengths[i])
+
+    backbone.eval()
+    start_time = time.time()
+    for start in range(0, len(order), batch_size):
+        indices = order[start:start + batch_size]
+        encoding = tokenizer(
+            [texts[i] for i in indices],
+            truncation=True,
+            max_length=max_length,
+            padding=True,
+            return_tensors='pt'
+        )
+        input_ids = encoding['input_ids'].to(device)
+        attention_mask = encoding['attention_mask'].to(device)
+
+        hidden = backbone(input_ids=input_ids, attention_mask=attention_mask, use_cache=False)[0]
+        last_index = attention_mask.sum(dim=1) - 1
+        pooled = hidden[torch.arange(hidden.size(0), device=device), last_index]
+        features[indices] = pooled.float().cpu().numpy().astype(np.float16)
+
+        if (start // batch_size) % 50 == 0:
+            print(f"  • {name}: {min(start + batch_size, len(order))}/{len(order)}")
+
+    features.flush()
+    del features
+
+    meta = dict(meta, num_samples=len(texts), hidden_size=hidden_size,
+                extract_seconds=time.time() - start_time)
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    return np.memmap(feature_path, dtype=np.float16, mode='r', shape=(len(texts), hidden_size))
+
+def get_or_extract_features(load_backbone: Callable[[], Tuple[Any, Any]], texts: List[str],
+                            cache_dir: str, name: str, model_name: str, max_length: int = 512,
+                            batch_size: int = 32) -> np.memmap:
+    """
+    优先读取缓存，缓存缺失时才加载主干并提取
+
+    Args:
+        load_backbone: 返回(backbone, tokenizer)的函数，只在需要提取时调用
+    """
+    expected_meta = {
+        'model_name': model_name,
+        'max_length': max_length,
+        'num_samples': len(texts),
+        'fingerprint': texts_fingerprint(texts)
+    }
+
+    features = load_cached_features(cache_dir, name, expected_meta)
+    if features is not None:
+        print(f"✅ 使用特征缓存: {cache_paths(cache_dir, name)[0]}")
+        return features
+
+    print(f"🔧 提取特征: {name} ({len(texts)} 个样本)")
+    backbone, tokenizer = load_backbone()
+    return extract_features(backbone, tokenizer, texts, cache_dir, name, expected_meta,
+                            max_length, batch_size)
+
+def build_head(hidden_size: int, head_type: str = 'linear', mlp_dim: int = 1024,
+               dropout: float = 0.1, num_labels: int = 2) -> nn.Module:
+    """
+    构建分类头
+
+    linear头与train_basic中替换的model.score结构相同，训练结果可以直接加载回去。
+    """
+    if head_type == 'linear':
+        return nn.Linear(hidden_size, num_labels)
+    if head_type == 'mlp':
+        return nn.Sequential(
+            nn.Dropout(dropout),
+            nn.Linear(hidden_size, mlp_dim),
+            nn.GELU(),
+            nn.Dropout(dropout),
+            nn.Linear(mlp_dim, num_labels)
+        )
+    raise ValueError(f"未知的分类头类型: {head_type}")
+
+def train_head(train_features: np.ndarray, train_labels: List[int],
+               eval_features: np.ndarray, eval_labels: List[int],
+               head_type: str = 'linear', epochs: int = 50, learning_rate: float = 1e-3,
+               batch_size: int = 256, weight_decay: float = 0.01, mlp_dim: int = 1024,
+               seed: int = 42, device: Optional[torch.device] = None) -> Tuple[nn.Module, List[Dict]]:
+    """
+    在缓存特征上训练分类头
+
+    特征整体搬到设备上（32000×3584的float16约230MB），每个epoch只是几次矩阵乘法。
+
+    Returns:
+        (验证准确率最高的分类头, 每个epoch的指标)
+    """
+    if device is None:
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    torch.manual_seed(seed)
+
+    x_train = torch.from_numpy(np.asarray(train_features)).to(device)
+    y_train = torch.tensor(train_labels, dtype=torch.long, device=device)
+    x_eval = torch.from_numpy(np.asarray(eval_features)).to(device)
+    y_eval = torch.tensor(eval_labels, dtype=torch.long, device=device)
+
+    head = build_head(x_train.shape[1], head_type, mlp_dim).to(device)
+    optimizer = torch.optim.AdamW(head.parameters(), lr=learning_rate, weight_decay=weight_decay)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=epochs)
+    loss_fn = nn.CrossEntropyLoss()
+
+    history = []
+    best_acc, best_state = -1.0, None
+
+    for epoch in range(epochs):
+        start = time.time()
+        head.train()
+        permutation = torch.randperm(x_train.shape[0], device=device)
+        total_loss = 0.0
+        for i in range(0, x_train.shape[0], batch_size):
+            idx = permutation[i:i + batch_size]
+            logits = head(x_train[idx].float())
+            loss = loss_fn(logits, y_train[idx])
+            optimizer.zero_grad(set_to_none=True)
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item() * idx.numel()
+        scheduler.step()
+
+        head.eval()
+        with torch.no_grad():
+            eval_pred = torch.cat([
+                head(x_eval[i:i + batch_size].float()).argmax(dim=-1)
+                for i in range(0, x_eval.shape[0], batch_size)
+            ])
+        accuracy = (eval_pred == y_eval).float().mean().item()
+
+        history.append({
+            'epoch': epoch + 1,
+            'loss': total_loss / x_train.shape[0],
+            'eval_accuracy': accuracy,
+            'seconds': time.time() - start
+        })
+        print(f"  epoch {epoch + 1:>3}: loss {history[-1]['loss']:.4f}, "
+              f"准确率 {accuracy:.4f} ({history[-1]['seconds']:.2f}s)")
+
+        if accuracy > best_acc:
+            best_acc = accuracy
+            best_state = {k: v.detach().clone() for k, v in head.state_dict().items()}
+
+    head.load_state_dict(best_state)
+    return head, history
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+金融文本相似度分类竞赛 - 多结果文件排行榜
+标签只加载一次并放入共享内存，进程池并行评估一批结果文件，
+输出按准确率排序的排行榜（指标、置信区间、吞吐量），JSON + CSV
+"""
+
+import os
+import csv
+import json
+import glob
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    from .metrics import ConfusionCounts
+    from .significance import bootstrap_ci, load_label_array
+    from .curves import compute_curves, extract_probabilities
+    from .streaming_eval import iter_jsonl_chunks, record_prediction
+    from .result_store import ResultStore, is_result_store
+except ImportError:
+    from metrics import ConfusionCounts
+    from significance import bootstrap_ci, load_label_array
+    from curves import compute_curves, extract_probabilities
+    from streaming_eval import iter_jsonl_chunks, record_prediction
+    from result_store import ResultStore, is_result_store
+
+# 工作进程中挂载的共享标签数组
+_shared_labels: Optional[np.ndarray] = None
+_shared_memory = None
+
+def _attach_labels(name: str, length: int):
+    """工作进程初始化：按名称挂载父进程创建的共享内存，不拷贝标签"""
+    global _shared_labels, _shared_memory
+    _shared_memory = shared_memory.SharedMemory(name=name)
+    _shared_labels = np.ndarray((length,), dtype=np.int8, buffer=_shared_memory.buf)
+
+def load_result_arrays(result_file: str, chunk_size: int = 100_000) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """一遍读取结果文件的预测和概率（不是每条都有概率时概率返回None；列式结果直接读列）"""
+    if is_result_store(result_file):
+        store = ResultStore(result_file)
+        return np.asarray(store.predictions), store.probabilities
+    predictions, probabilities = [], []
+    for chunk in iter_jsonl_chunks(result_file, chunk_size):
+        predictions.append(np.fromiter((record_prediction(r) for r in chunk), dtype=np.int8, count=len(chunk)))
+        if probabilities is not None:
+            chunk_probabilities = extract_probabilities(chunk)
+            probabilities = None if chunk_probabilities is None else probabilities + [chunk_probabilities]
+    y_pred = np.concatenate(predictions) if predictions else np.empty(0, dtype=np.int8)
+    y_prob = np.concatenate(probabilities) if probabilities else None
+    return y_pred, y_prob
+
+def _path_size(path: str) -> int:
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+    return os.path.getsize(path)
+
+def evaluate_result_file(result_file: str, num_resamples: int = 10_000, alpha: float = 0.05,
+                         y_true: Optional[np.ndarray] = None) -> Dict[str, Any]:
+    """
+    评估单个结果文件（在工作进程中运行时使用共享标签）
+
+    Returns:
+        排行榜的一行；文件无法评估时包含error字段
+    """
+    y_true = _shared_labels if y_true is None else y_true
+    row: Dict[str, Any] = {'result_file': result_file}
+    try:
+        start = time.perf_counter()
+        y_pred, y_prob = load_result_arrays(result_file)
+        load_seconds = time.perf_counter() - start
+        if len(y_pred) != len(y_true):
+            row['error'] = f"标签和预测长度不匹配: {len(y_true)} vs {len(y_pred)}"
+            return row
+
+        start = time.perf_counter()
+        metrics = ConfusionCounts.from_arrays(y_true, y_pred).metrics()
+        ci = bootstrap_ci(y_true, y_pred, num_resamples, alpha)
+        curves = compute_curves(y_true, y_prob) if y_prob is not None else {}
+        eval_seconds = time.perf_counter() - start
+    except Exception as e:
+        row['error'] = str(e)
+        return row
+
+    row.update({
+        'num_samples': len(y_true),
+        'accuracy': metrics['accuracy'],
+        'accuracy_ci_low': ci['accuracy']['ci'][0],
+        'accuracy_ci_high': ci['accuracy']['ci'][1],
+        'f1_macro': metrics['f1_macro'],
+        'f1_macro_ci_low': ci['f1_macro']['ci'][0],
+        'f1_macro_ci_high': ci['f1_macro']['ci'][1],
+        'precision_class_1': metrics['precision_class_1'],
+        'recall_class_1': metrics['recall_class_1'],
+        'auc': curves.get('auc'),
+        'best_threshold': curves.get('best_threshold'),
+        'best_threshold_accuracy': curves.get('best_threshold_accuracy'),
+        'file_mb': _path_size(result_file) / 1024 ** 2,
+        'modified': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(os.path.getmtime(result_file))),
+        'load_seconds': load_seconds,
+        'eval_seconds': eval_seconds,
+        'samples_per_second': len(y_true) / (load_seconds + eval_seconds) if load_seconds + eval_seconds > 0 else 0
+    })
+    return row
+
+def build_leaderboard(result_files: List[str], y_true: np.ndarray, num_workers: int = 4,
+                      num_resamples: int = 10_000, alpha: float = 0.05) -> List[Dict[str, Any]]:
+    """
+    并行评估所有结果文件，按准确率降序返回（出错的文件排在最后）
+
+    标签写入共享内存一次，各工作进程按名称挂载，不随任务重复序列化。
+    """
+    labels = np.ascontiguousarray(y_true, dtype=np.int8)
+    shm = shared_memory.SharedMemory(create=True, size=max(labels.nbytes, 1))
+    try:
+        np.ndarray(labels.shape, dtype=np.int8, buffer=shm.buf)[:] = labels
+        rows = []
+        with ProcessPoolExecutor(max_workers=num_workers, initializer=_attach_labels,
+                                 initargs=(shm.name, len(labels))) as executor:
+            futures = {executor.submit(evaluate_result_file, path, num_resamples, alpha): path
+                       for path in result_files}
+            for future in as_completed(futures):
+                row = future.result()
+                rows.append(row)
+                status = f"❌ {row['error']}" if 'error' in row else f"准确率 {row['accuracy']:.4f}"
+                print(f"  • {os.path.basename(row['result_file'])}: {status}")
+    finally:
+        shm.close()
+        shm.unlink()
+
+    rows.sort(key=lambda r: ('error' in r, -r.get('accuracy', 0)))
+    for rank, row in enumerate(rows, 1):
+        row['rank'] = rank
+    return rows
+
+def print_leaderboard(rows: List[Dict[str, Any]]):
+    """打印排行榜"""
+    print("\n" + "=" * 92)
+    print(f"{'#':>3}  {'结果文件':<36}{'准确率':>9}{'95% CI':>20}{'F1(宏)':>9}{'AUC':>8}{'条/s':>10}")
+    print("-" * 92)
+    for row in rows:
+        name = os.path.basename(row['result_file'])[:34]
+        if 'error' in row:
+            print(f"{row['rank']:>3}  {name:<36}{'-':>9}  {row['error']}")
+            continue
+        auc = f"{row['auc']:.4f}" if row['auc'] is not None else '-'
+        ci = f"[{row['accuracy_ci_low']:.4f}, {row['accuracy_ci_high']:.4f}]"
+        print(f"{row['rank']:>3}  {name:<36}{row['accuracy']:>9.4f}{ci:>20}{row['f1_macro']:>9.4f}"
+              f"{auc:>8}{row['samples_per_second']:>10.0f}")
+    print("=" * 92)
+
+def save_leaderboard(rows: List[Dict[str, Any]], output_path: str):
+    """保存排行榜（JSON + CSV）"""
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(rows, f, ensure_ascii=False, indent=2)
+
+    csv_path = os.path.splitext(output_path)[0] + '.csv'
+    fieldnames = ['rank'] + [k for k in dict.fromkeys(k for row in rows for k in row) if k != 'rank']
+    with open(csv_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    print("📄 排行榜已保存:")
+    print(f"  • {output_path}")
+    print(f"  • {csv_path}")
+
+def main():
+    """排行榜入口"""
+    parser = argparse.ArgumentParser(description="并行评估多个结果文件并生成排行榜")
+    parser.add_argument('results', nargs='+', help='结果文件或glob（如 "results/*.jsonl"）')
+    parser.add_argument('--label-file', default='test_label.jsonl', help='标签文件')
+    parser.add_argument('--workers', type=int, default=min(8, os.cpu_count() or 1), help='并行进程数')
+    parser.add_argument('--num-resamples', type=int, default=10_000, help='bootstrap重抽样次数')
+    parser.add_argument('--alpha', type=float, default=0.05, help='置信区间显著性水平')
+    parser.add_argument('--output', default='results/leaderboard.json', help='排行榜输出路径')
+    args = parser.parse_args()
+
+    result_files = sorted({path for pattern in args.results for path in (glob.glob(pattern) or [pattern])
+                           if os.path.isfile(path) or is_result_store(path)})
+    print("🏆 多结果文件排行榜")
+    print("=" * 50)
+    if not result_files:
+        print(f"❌ 未找到结果文件: {args.results}")
+        return
+    if not os.path.exists(args.label_file):
+        print(f"❌ 找不到标签文件: {args.label_file}")
+        return
+
+    y_true = load_label_array(args.label_file)
+    print(f"✅ 标签: {len(y_true)} 条，结果文件: {len(result_files)} 个，进程数: {args.workers}")
+
+    start = time.perf_counter()
+    rows = build_leaderboard(result_files, y_true, args.workers, args.num_resamples, args.alpha)
+    print(f"⏱️ 总耗时: {time.perf_counter() - start:.1f}s")
+    print_leaderboard(rows)
+    save_leaderboard(rows, args.output)
+
+if __name__ == '__main__':
+    main()
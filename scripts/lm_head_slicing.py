@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+金融文本相似度分类竞赛 - SFT训练时只在回答位置计算lm_head
+回答只有一个数字（加结束符），loss只依赖少数几个位置的logits。
+先按labels挑出需要监督的位置，再做lm_head投影，避免对每个位置计算约15万词表的logits
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+import torch
+import torch.nn.functional as F
+from transformers import TrainerCallback
+from transformers.modeling_outputs import CausalLMOutputWithPast
+
+# 只用于计算loss的参数，不传给主干网络
+LOSS_ONLY_KWARGS = ('num_items_in_batch', 'logits_to_keep', 'num_logits_to_keep', 'return_dict')
+# 启用切片后原始forward保存在CausalLM上的属性名
+ORIGINAL_FORWARD_ATTR = '_full_lm_head_forward'
+# 切片与完整计算的loss允许的相对误差（bf16下两者的矩阵乘法顺序不同）
+LOSS_CHECK_TOLERANCE = 1e-3
+
+def find_causal_lm(model):
+    """去掉DDP/PEFT外层包装，找到带lm_head的CausalLM"""
+    while hasattr(model, 'module'):
+        model = model.module
+    if hasattr(model, 'get_base_model'):
+        model = model.get_base_model()
+    if not (hasattr(model, 'lm_head') and hasattr(model, 'model')):
+        raise ValueError(f"不支持的模型结构: {type(model).__name__}")
+    return model
+
+def sliced_lm_loss(causal_lm, hidden_states: torch.Tensor, labels: torch.Tensor,
+                   restrict_token_ids: Optional[List[int]] = None,
+                   num_items_in_batch: Optional[int] = None) -> torch.Tensor:
+    """
+    只在被监督的位置计算lm_head和交叉熵
+
+    与完整计算的关系：不限制词表时结果与完整lm_head+交叉熵完全一致；
+    限制词表时softmax只在给定token（以及批次中出现的目标token）上归一化，
+    相当于把生成任务变成小类别分类，loss数值会与完整计算不同。
+
+    Args:
+        causal_lm: 带lm_head的模型
+        hidden_states: 主干输出 (batch, seq, hidden)
+        labels: 未移位的labels，-100表示不计算loss
+        restrict_token_ids: 限制lm_head只计算这些行
+        num_items_in_batch: 梯度累积时用于归一化的总token数
+    """
+    targets = labels[:, 1:]
+    selected = targets != -100
+    hidden = hidden_states[:, :-1][selected]
+    targets = targets[selected]
+
+    weight = causal_lm.lm_head.weight
+    bias = getattr(causal_lm.lm_head, 'bias', None)
+    if restrict_token_ids is not None:
+        # 目标中可能包含结束符等token，一并加入保证每个目标都可表示
+        rows = torch.unique(torch.cat([
+            torch.tensor(restrict_token_ids, device=targets.device), targets
+        ]))
+        lookup = torch.full((weight.size(0),), -100, dtype=torch.long, device=targets.device)
+        lookup[rows] = torch.arange(rows.numel(), device=targets.device)
+        targets = lookup[targets]
+        weight = weight[rows]
+        bias = bias[rows] if bias is not None else None
+
+    logits = F.linear(hidden.to(weight.dtype), weight, bias).float()
+
+    if num_items_in_batch is not None:
+        return F.cross_entropy(logits, targets, reduction='sum') / num_items_in_batch
+    return F.cross_entropy(logits, targets)
+
+def enable_last_position_lm_head(model, restrict_token_ids: Optional[List[int]] = None,
+                                 check_first_batch: bool = False):
+    """
+    替换CausalLM的forward：训练且带labels时只在回答位置计算lm_head
+
+    返回的logits为None（Swift的Trainer在logits为None时跳过token准确率统计），
+    评估阶段和不带labels的调用仍走原始forward。
+
+    Args:
+        restrict_token_ids: 限制lm_head只计算这些行
+        check_first_batch: 第一个训练批次额外用完整lm_head算一次loss并与切片结果对比
+
+    Returns:
+        原始forward，便于恢复
+    """
+    causal_lm = find_causal_lm(model)
+    original_forward = causal_lm.forward
+    pending_check = [check_first_batch]
+
+    def forward(input_ids=None, attention_mask=None, position_ids=None, past_key_values=None,
+                inputs_embeds=None, labels=None, **kwargs):
+        if labels is None or not causal_lm.training:
+            return original_forward(input_ids=input_ids, attention_mask=attention_mask,
+                                    position_ids=position_ids, past_key_values=past_key_values,
+                                    inputs_embeds=inputs_embeds, labels=labels, **kwargs)
+
+        if pending_check[0]:
+            # 先清除标记：对比时会再次调用本forward
+            pending_check[0] = False
+            report_loss_check(causal_lm, dict(input_ids=input_ids, attention_mask=attention_mask,
+                                              position_ids=position_ids, inputs_embeds=inputs_embeds,
+                                              labels=labels, **kwargs),
+                              restricted=restrict_token_ids is not None)
+
+        num_items_in_batch = kwargs.get('num_items_in_batch')
+        backbone_kwargs = {k: v for k, v in kwargs.items() if k not in LOSS_ONLY_KWARGS}
+        backbone_kwargs['use_cache'] = False
+
+        outputs = causal_lm.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=past_key_values,
+            inputs_embeds=inputs_embeds,
+            **backbone_kwargs
+        )
+        loss = sliced_lm_loss(causal_lm, outputs[0], labels, restrict_token_ids, num_items_in_batch)
+        return CausalLMOutputWithPast(loss=loss, logits=None)
+
+    causal_lm.forward = forward
+    setattr(causal_lm, ORIGINAL_FORWARD_ATTR, original_forward)
+    return original_forward
+
+def disable_last_position_lm_head(model):
+    """恢复原始forward"""
+    causal_lm = find_causal_lm(model)
+    if 'forward' in causal_lm.__dict__:
+        del causal_lm.forward
+    causal_lm.__dict__.pop(ORIGINAL_FORWARD_ATTR, None)
+
+@torch.no_grad()
+def compare_with_full_loss(model, inputs: Dict[str, torch.Tensor], seed: int = 0) -> Tuple[float, float]:
+    """
+    对同一批次分别用完整lm_head和切片lm_head计算loss，用于确认两者一致
+
+    已启用切片时通过保存的原始forward计算完整loss、通过当前forward计算切片loss，
+    不会卸下切片；两次前向使用相同的随机种子，dropout掩码一致。
+
+    Returns:
+        (完整计算的loss, 切片计算的loss)
+    """
+    causal_lm = find_causal_lm(model)
+    was_training = causal_lm.training
+    causal_lm.train()
+    full_forward = causal_lm.__dict__.get(ORIGINAL_FORWARD_ATTR)
+    devices = [causal_lm.lm_head.weight.device] if causal_lm.lm_head.weight.is_cuda else []
+
+    def run(fn):
+        with torch.random.fork_rng(devices=devices):
+            torch.manual_seed(seed)
+            return fn()
+
+    try:
+        if full_forward is not None:
+            full_loss = run(lambda: full_forward(**inputs).loss).item()
+            sliced_loss = run(lambda: causal_lm(**inputs).loss).item()
+        else:
+            full_loss = run(lambda: causal_lm(**inputs).loss).item()
+            backbone_kwargs = {k: v for k, v in inputs.items() if k not in LOSS_ONLY_KWARGS + ('labels',)}
+            backbone_kwargs['use_cache'] = False
+            hidden = run(lambda: causal_lm.model(**backbone_kwargs)[0])
+            sliced_loss = sliced_lm_loss(causal_lm, hidden, inputs['labels'],
+                                         num_items_in_batch=inputs.get('num_items_in_batch')).item()
+    finally:
+        causal_lm.train(was_training)
+    return full_loss, sliced_loss
+
+def report_loss_check(model, inputs: Dict[str, torch.Tensor], restricted: bool = False) -> bool:
+    """打印切片与完整计算的loss对比，不限制词表时两者应在容差内一致"""
+    full_loss, sliced_loss = compare_with_full_loss(model, inputs)
+    rel_diff = abs(full_loss - sliced_loss) / max(abs(full_loss), 1e-8)
+    if restricted:
+        print(f"✂️ lm_head切片检查: 完整 {full_loss:.6f}, 切片 {sliced_loss:.6f}（限制词表，数值不同属预期）")
+        return True
+    passed = rel_diff <= LOSS_CHECK_TOLERANCE
+    print(f"{'✅' if passed else '❌'} lm_head切片检查: 完整 {full_loss:.6f}, 切片 {sliced_loss:.6f}, "
+          f"相对误差 {rel_diff:.2e}")
+    return passed
+
+class LastPositionLMHeadCallback(TrainerCallback):
+    """
+    训练开始时启用切片lm_head
+
+    Args:
+        restrict_to_labels: 是否把lm_head限制在"0"/"1"两行（以及目标中出现的token）
+        label_tokens: 标签文本
+        check: 第一个训练批次对比切片与完整lm_head的loss
+    """
+
+    def __init__(self, restrict_to_labels: bool = False, label_tokens: Tuple[str, ...] = ('0', '1'),
+                 check: bool = False):
+        self.restrict_to_labels = restrict_to_labels
+        self.label_tokens = label_tokens
+        self.check = check
+
+    def on_train_begin(self, args, state, control, model=None, **kwargs):
+        restrict_token_ids = None
+        if self.restrict_to_labels:
+            tokenizer = kwargs.get('processing_class') or kwargs.get('tokenizer')
+            tokenizer = getattr(tokenizer, 'tokenizer', tokenizer)
+            restrict_token_ids = [
+                tokenizer.encode(token, add_special_tokens=False)[0] for token in self.label_tokens
+            ]
+        enable_last_position_lm_head(model, restrict_token_ids, check_first_batch=self.check)
+        print(f"✂️ 已启用回答位置lm_head切片 (限制词表: {restrict_token_ids or '否'})")
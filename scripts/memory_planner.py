@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+金融文本相似度分类竞赛 - 训练前显存与耗时规划
+读取train_config.json和本地模型配置，统计数据集真实token长度分布，
+估算参数、优化器、LoRA、激活（开/关梯度检查点）和logits显存，
+并结合短时校准运行的实测步耗时推算总训练时间。全程离线，不下载权重
+"""
+
+import os
+import json
+import math
+import glob
+import argparse
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+DTYPE_BYTES = {'bfloat16': 2, 'float16': 2, 'float32': 4}
+GB = 1024 ** 3
+# 没有本地tokenizer时的估算：Qwen分词器对中文约1.4字/token
+CHARS_PER_TOKEN = 1.4
+# CUDA上下文、cuBLAS工作区等与配置无关的固定开销
+CUDA_OVERHEAD_GB = 1.0
+# 显存碎片预留比例
+FRAGMENTATION_RATIO = 0.1
+
+LORA_MODULE_SHAPES = {
+    'q_proj': ('hidden', 'hidden'),
+    'k_proj': ('hidden', 'kv'),
+    'v_proj': ('hidden', 'kv'),
+    'o_proj': ('hidden', 'hidden'),
+    'gate_proj': ('hidden', 'intermediate'),
+    'up_proj': ('hidden', 'intermediate'),
+    'down_proj': ('intermediate', 'hidden'),
+}
+
+def _model_trainer():
+    """延迟导入model_trainer（依赖Swift），参数统计等纯计算函数可以在train_basic中单独使用"""
+    try:
+        from . import model_trainer
+    except ImportError:
+        import model_trainer
+    return model_trainer
+
+def load_model_config(path: Optional[str] = None) -> Dict[str, Any]:
+    """读取本地模型配置（config.json格式）"""
+    if path is None:
+        config = _model_trainer().load_config()
+        path = config['model'].get('config_file', 'config/qwen2_7b_config.json')
+    if not os.path.isabs(path):
+        path = str(_model_trainer().get_project_root() / path)
+    if os.path.isdir(path):
+        path = os.path.join(path, 'config.json')
+
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def model_dims(model_config: Dict[str, Any]) -> Dict[str, int]:
+    """提取计算所需的维度"""
+    hidden = model_config['hidden_size']
+    heads = model_config['num_attention_heads']
+    kv_heads = model_config.get('num_key_value_heads', heads)
+    return {
+        'hidden': hidden,
+        'intermediate': model_config['intermediate_size'],
+        'layers': model_config['num_hidden_layers'],
+        'heads': heads,
+        'kv': hidden // heads * kv_heads,
+        'vocab': model_config['vocab_size'],
+        'tied': model_config.get('tie_word_embeddings', False)
+    }
+
+def count_parameters(model_config: Dict[str, Any]) -> Dict[str, int]:
+    """
+    按Qwen2结构统计参数量
+
+    Returns:
+        {'embedding', 'per_layer', 'layers', 'lm_head', 'total'}
+    """
+    d = model_dims(model_config)
+    h, kv, inter = d['hidden'], d['kv'], d['intermediate']
+
+    attention = h * h + h + 2 * (h * kv + kv) + h * h  # q(带bias) k v(带bias) o
+    mlp = 3 * h * inter
+    norms = 2 * h
+    per_layer = attention + mlp + norms
+
+    embedding = d['vocab'] * h
+    lm_head = 0 if d['tied'] else d['vocab'] * h
+    layers = per_layer * d['layers']
+    return {
+        'embedding': embedding,
+        'per_layer': per_layer,
+        'layers': layers,
+        'lm_head': lm_head,
+        'total': embedding + layers + h + lm_head
+    }
+
+def count_lora_parameters(model_config: Dict[str, Any], rank: int, target_modules: List[str],
+                          num_lora_layers: Optional[int] = None) -> int:
+    """统计LoRA参数量：每个目标模块 r×(输入维度+输出维度)"""
+    d = model_dims(model_config)
+    if num_lora_layers is None:
+        num_lora_layers = d['layers']
+
+    per_layer = 0
+    for module in target_modules:
+        if module not in LORA_MODULE_SHAPES:
+            continue
+        fan_in, fan_out = LORA_MODULE_SHAPES[module]
+        per_layer += rank * (d[fan_in] + d[fan_out])
+    return per_layer * num_lora_layers
+
+def activation_bytes_per_token(model_config: Dict[str, Any], dtype_bytes: int = 2,
+                               flash_attention: bool = True, seq_len: int = 0) -> int:
+    """
+    单层单token需要为反向保存的激活字节数
+
+    按Qwen2块内保存的张量估算：两次RMSNorm的输入输出、q/k/v、注意力输出、
+    o_proj输入、残差，以及SwiGLU的gate/up/激活/乘积。
+    非flash attention还要保存每个头的注意力分数和softmax结果（与序列长度成正比）。
+    """
+    d = model_dims(model_config)
+    elements = 7 * d['hidden'] + 2 * d['kv'] + 4 * d['intermediate']
+    if not flash_attention:
+        elements += 2 * d['heads'] * seq_len
+    return elements * dtype_bytes
+
+def load_token_lengths(data_file: str, model_id: str, max_length: int,
+                       tokenizer_path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    统计训练数据（含system、模板和回答）的token长度分布
+
+    优先使用本地已缓存的tokenizer（local_files_only），否则按字符数估算。
+    """
+    with open(data_file, 'r', encoding='utf-8') as f:
+        samples = [json.loads(line) for line in f if line.strip()]
+
+    tokenizer = None
+    try:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(tokenizer_path or model_id, local_files_only=True,
+                                                  trust_remote_code=True)
+    except Exception:
+        pass
+
+    trainer = _model_trainer()
+    texts = []
+    for s in samples:
+        messages = [
+            {'role': 'system', 'content': trainer.SYSTEM_PROMPT},
+            {'role': 'user', 'content': trainer.build_query(s['text1'], s['text2'])},
+            {'role': 'assistant', 'content': str(s.get('label', 0))}
+        ]
+        if tokenizer is not None:
+            texts.append(tokenizer.apply_chat_template(messages, tokenize=False))
+        else:
+            texts.append(''.join(f"<|im_start|>{m['role']}\n{m['content']}<|im_end|>\n" for m in messages))
+
+    if tokenizer is not None:
+        lengths = np.array([len(ids) for ids in tokenizer(texts, add_special_tokens=False)['input_ids']])
+        source = 'tokenizer'
+    else:
+        lengths = np.ceil(np.array([len(t) for t in texts]) / CHARS_PER_TOKEN).astype(np.int64)
+        source = f'estimate({CHARS_PER_TOKEN} chars/token)'
+
+    truncated = np.minimum(lengths, max_length)
+    return {
+        'source': source,
+        'num_samples': int(len(lengths)),
+        'lengths': truncated,
+        'mean': float(truncated.mean()),
+        'p50': int(np.percentile(truncated, 50)),
+        'p90': int(np.percentile(truncated, 90)),
+        'p99': int(np.percentile(truncated, 99)),
+        'max': int(truncated.max()),
+        'truncated_ratio': float((lengths > max_length).mean()),
+        'total_tokens': int(truncated.sum())
+    }
+
+def estimate_memory(model_config: Dict[str, Any], train_config: Dict[str, Any],
+                    tokens_per_micro_batch: int, seq_len: int, gradient_checkpointing: bool,
+                    supervised_tokens_per_micro_batch: Optional[int] = None) -> Dict[str, float]:
+    """
+    估算峰值显存（GB）
+
+    Args:
+        tokens_per_micro_batch: 一个micro-batch的token数（含padding）
+        seq_len: 单条序列长度（非flash attention时用于注意力分数）
+        gradient_checkpointing: 是否开启梯度检查点
+        supervised_tokens_per_micro_batch: 只在回答位置计算lm_head时的logits行数
+    """
+    d = model_dims(model_config)
+    training, lora = train_config['training'], train_config['lora']
+    dtype_bytes = DTYPE_BYTES.get(train_config['model']['torch_dtype'], 2)
+
+    params = count_parameters(model_config)
+    top_n = lora.get('top_n_layers')
+    num_lora_layers = top_n or d['layers']
+    lora_params = count_lora_parameters(model_config, lora['lora_rank'], lora['target_modules'], num_lora_layers)
+
+    # LoRA权重由PEFT保持为fp32：权重4 + 梯度4 + AdamW两个状态8
+    lora_bytes = lora_params * 4
+    lora_grad_bytes = lora_params * 4
+    optimizer_bytes = lora_params * 8
+
+    # 只有需要反向的层才保存激活：顶部N层模式下底部层在no_grad中运行
+    flash = True
+    per_token_layer = activation_bytes_per_token(model_config, dtype_bytes, flash, seq_len)
+    if gradient_checkpointing:
+        # 每层只保存输入，反向时一次重算一层
+        activation_bytes = tokens_per_micro_batch * (num_lora_layers * d['hidden'] * dtype_bytes + per_token_layer)
+    else:
+        activation_bytes = tokens_per_micro_batch * num_lora_layers * per_token_layer
+
+    # logits：bf16输出 + fp32上转 + fp32的log_softmax/梯度
+    logits_rows = supervised_tokens_per_micro_batch if supervised_tokens_per_micro_batch else tokens_per_micro_batch
+    logits_bytes = logits_rows * d['vocab'] * (dtype_bytes + 4 + 4)
+
+    parts = {
+        'parameters': params['total'] * dtype_bytes / GB,
+        'lora': lora_bytes / GB,
+        'gradients': lora_grad_bytes / GB,
+        'optimizer': optimizer_bytes / GB,
+        'activations': activation_bytes / GB,
+        'logits': logits_bytes / GB,
+        'cuda_overhead': CUDA_OVERHEAD_GB
+    }
+    subtotal = sum(parts.values())
+    parts['fragmentation'] = subtotal * FRAGMENTATION_RATIO
+    parts['total'] = subtotal + parts['fragmentation']
+    parts['lora_params'] = lora_params
+    parts['model_params'] = params['total']
+    return parts
+
+def estimate_steps(token_stats: Dict[str, Any], train_config: Dict[str, Any], packing: bool = True) -> Dict[str, int]:
+    """估算每个epoch的micro-batch数和总优化步数"""
+    training = train_config['training']
+    batch_size = training['per_device_train_batch_size']
+    accumulation = training['gradient_accumulation_steps']
+    max_length = training['max_length']
+
+    if packing:
+        rows = math.ceil(token_stats['total_tokens'] / max_length)
+    else:
+        rows = token_stats['num_samples']
+
+    micro_batches = math.ceil(rows / batch_size)
+    steps_per_epoch = math.ceil(micro_batches / accumulation)
+    return {
+        'rows_per_epoch': rows,
+        'micro_batches_per_epoch': micro_batches,
+        'steps_per_epoch': steps_per_epoch,
+        'total_steps': steps_per_epoch * training['num_train_epochs']
+    }
+
+def read_calibration(calibration_dir: str) -> Optional[float]:
+    """
+    从短时校准运行读取每个优化步的实测耗时（秒）
+
+    优先使用StepProfilerCallback写出的step_profile.jsonl（去掉首步后取中位数），
+    否则读取输出目录（或其中最新checkpoint）的trainer_state.json，使用train_runtime/global_step。
+    """
+    profile_path = os.path.join(calibration_dir, 'step_profile.jsonl')
+    if os.path.exists(profile_path):
+        with open(profile_path, 'r', encoding='utf-8') as f:
+            step_seconds = [json.loads(line)['step_seconds'] for line in f if line.strip()]
+        if len(step_seconds) > 1:
+            return float(np.median(step_seconds[1:]))
+
+    candidates = [os.path.join(calibration_dir, 'trainer_state.json')]
+    candidates += sorted(glob.glob(os.path.join(calibration_dir, 'checkpoint-*', 'trainer_state.json')),
+                         key=lambda p: int(p.split('checkpoint-')[-1].split(os.sep)[0]), reverse=True)
+    for path in candidates:
+        if not os.path.exists(path):
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        for entry in reversed(state.get('log_history', [])):
+            if 'train_runtime' in entry and entry.get('step'):
+                return entry['train_runtime'] / entry['step']
+    return None
+
+def plan(train_config: Dict[str, Any], model_config: Dict[str, Any], token_stats: Dict[str, Any],
+         gpu_memory_gb: float = 22.0, step_seconds: Optional[float] = None) -> Dict[str, Any]:
+    """汇总显存、步数和耗时规划"""
+    training = train_config['training']
+    packing = True  # 与get_training_args保持一致
+    max_length = training['max_length']
+    batch_size = training['per_device_train_batch_size']
+
+    # packing时每行都被填满到max_length；否则按最长样本估算峰值
+    seq_len = max_length if packing else token_stats['max']
+    tokens_per_micro_batch = batch_size * seq_len
+    supervised = None
+    if training.get('last_position_lm_head'):
+        # 每条样本的回答为一个数字加结束符
+        samples_per_row = max_length / token_stats['mean'] if packing else 1
+        supervised = int(math.ceil(batch_size * samples_per_row * 2))
+
+    memory = {
+        'with_gradient_checkpointing': estimate_memory(model_config, train_config, tokens_per_micro_batch,
+                                                       seq_len, True, supervised),
+        'without_gradient_checkpointing': estimate_memory(model_config, train_config, tokens_per_micro_batch,
+                                                          seq_len, False, supervised)
+    }
+    steps = estimate_steps(token_stats, train_config, packing)
+
+    result = {
+        'token_lengths': {k: v for k, v in token_stats.items() if k != 'lengths'},
+        'memory_gb': memory,
+        'gpu_memory_gb': gpu_memory_gb,
+        'configured_gradient_checkpointing': training['gradient_checkpointing'],
+        'steps': steps,
+        'step_seconds': step_seconds,
+        'projected_hours': steps['total_steps'] * step_seconds / 3600 if step_seconds else None
+    }
+    configured = memory['with_gradient_checkpointing' if training['gradient_checkpointing']
+                        else 'without_gradient_checkpointing']
+    result['fits'] = configured['total'] <= gpu_memory_gb
+    return result
+
+def print_plan(result: Dict[str, Any]):
+    """打印规划报告"""
+    lengths = result['token_lengths']
+    print("\n📏 token长度分布 (来源: {}):".format(lengths['source']))
+    print(f"  • 样本数: {lengths['num_samples']}, 平均: {lengths['mean']:.1f}")
+    print(f"  • P50/P90/P99/最大: {lengths['p50']}/{lengths['p90']}/{lengths['p99']}/{lengths['max']}")
+    print(f"  • 被截断比例: {lengths['truncated_ratio']:.2%}")
+
+    print("\n💾 显存估算 (GB):")
+    keys = ['parameters', 'lora', 'gradients', 'optimizer', 'activations', 'logits',
+            'cuda_overhead', 'fragmentation', 'total']
+    with_gc = result['memory_gb']['with_gradient_checkpointing']
+    without_gc = result['memory_gb']['without_gradient_checkpointing']
+    print(f"  {'项目':<16}{'检查点开':>12}{'检查点关':>12}")
+    for key in keys:
+        print(f"  {key:<16}{with_gc[key]:>12.2f}{without_gc[key]:>12.2f}")
+    print(f"  • 模型参数: {with_gc['model_params'] / 1e9:.2f}B, LoRA参数: {with_gc['lora_params'] / 1e6:.1f}M")
+
+    configured = 'with_gradient_checkpointing' if result['configured_gradient_checkpointing'] else 'without_gradient_checkpointing'
+    total = result['memory_gb'][configured]['total']
+    status = '✅ 可以放下' if result['fits'] else '❌ 预计OOM'
+    print(f"\n🎯 当前配置: {total:.2f} GB / {result['gpu_memory_gb']:.0f} GB → {status}")
+
+    steps = result['steps']
+    print("\n⏱️ 步数:")
+    print(f"  • 每epoch micro-batch: {steps['micro_batches_per_epoch']}, 优化步: {steps['steps_per_epoch']}")
+    print(f"  • 总优化步: {steps['total_steps']}")
+    if result['step_seconds']:
+        print(f"  • 实测 {result['step_seconds']:.2f} s/step → 预计 {result['projected_hours']:.1f} 小时")
+    else:
+        print("  • 未提供校准数据，无法推算总耗时（使用 --calibration-dir 或 --step-seconds）")
+
+def main():
+    """主函数"""
+    project_root = _model_trainer().get_project_root()
+    train_config = _model_trainer().load_config()
+
+    parser = argparse.ArgumentParser(description="训练前显存与耗时规划（离线）")
+    parser.add_argument('--model-config', default=None,
+                        help='本地模型配置(config.json或所在目录)，默认使用train_config中的config_file')
+    parser.add_argument('--tokenizer', default=None, help='本地tokenizer目录（可选）')
+    parser.add_argument('--data-file', default=str(project_root / train_config['data']['train_file']),
+                        help='训练数据')
+    parser.add_argument('--gpu-memory-gb', type=float, default=22.0, help='显存上限')
+    parser.add_argument('--calibration-dir', default=None, help='短时校准运行的输出目录')
+    parser.add_argument('--step-seconds', type=float, default=None, help='直接指定每个优化步耗时')
+    parser.add_argument('--output', default=str(project_root / 'results' / 'memory_plan.json'),
+                        help='规划结果输出路径')
+
+    args = parser.parse_args()
+
+    print("🧮 训练前显存与耗时规划")
+    print("=" * 50)
+
+    model_config = load_model_config(args.model_config)
+    token_stats = load_token_lengths(args.data_file, train_config['model']['model_id'],
+                                     train_config['training']['max_length'], args.tokenizer)
+
+    step_seconds = args.step_seconds
+    if step_seconds is None and args.calibration_dir:
+        step_seconds = read_calibration(args.calibration_dir)
+        if step_seconds is None:
+            print(f"⚠️ 校准目录中没有可用的trainer_state.json: {args.calibration_dir}")
+
+    result = plan(train_config, model_config, token_stats, args.gpu_memory_gb, step_seconds)
+    print_plan(result)
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"\n📄 规划结果已保存: {args.output}")
+
+if __name__ == '__main__':
+    main()
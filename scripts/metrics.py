@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+金融文本相似度分类竞赛 - 单遍混淆矩阵指标
+用np.bincount一次扫描得到混淆矩阵，准确率、宏/微平均和各类别的精确率/召回率/F1全部由它推出；
+计数可以按块累加、跨进程合并，支持数组和流式输入
+"""
+
+import os
+import json
+import time
+import argparse
+from typing import Dict, Any, Iterable, Optional, Tuple, Union
+
+import numpy as np
+
+# 每次bincount处理的样本数，限制int64编码数组的临时内存（约32MB）
+CHUNK_SIZE = 1 << 22
+
+class ConfusionCounts:
+    """
+    可合并的混淆矩阵计数，counts[i, j] 为真实标签i、预测标签j的样本数
+
+    各分块/各进程分别update，最后用merge（或 +）合并，结果与一次性计算完全相同。
+
+    Args:
+        num_classes: 类别数
+        counts: 已有的计数矩阵
+    """
+
+    def __init__(self, num_classes: int = 2, counts: Optional[np.ndarray] = None):
+        self.num_classes = num_classes
+        self.counts = np.zeros((num_classes, num_classes), dtype=np.int64) if counts is None \
+            else np.asarray(counts, dtype=np.int64).reshape(num_classes, num_classes)
+
+    @classmethod
+    def from_arrays(cls, y_true, y_pred, num_classes: int = 2) -> 'ConfusionCounts':
+        return cls(num_classes).update(y_true, y_pred)
+
+    def update(self, y_true, y_pred) -> 'ConfusionCounts':
+        """累加一批标签（列表或数组），返回自身"""
+        y_true, y_pred = np.asarray(y_true), np.asarray(y_pred)
+        if y_true.shape != y_pred.shape:
+            raise ValueError(f"标签和预测长度不匹配: {y_true.shape} vs {y_pred.shape}")
+        if y_true.size == 0:
+            return self
+
+        k = self.num_classes
+        for values in (y_true, y_pred):
+            if values.min() < 0 or values.max() >= k:
+                raise ValueError(f"标签超出范围 [0, {k}): {values.min()}..{values.max()}")
+
+        y_true, y_pred = y_true.ravel(), y_pred.ravel()
+        for start in range(0, y_true.size, CHUNK_SIZE):
+            codes = y_true[start:start + CHUNK_SIZE].astype(np.intp) * k + y_pred[start:start + CHUNK_SIZE]
+            self.counts += np.bincount(codes, minlength=k * k).reshape(k, k)
+        return self
+
+    def merge(self, other: 'ConfusionCounts') -> 'ConfusionCounts':
+        """原地合并另一份计数，返回自身"""
+        if other.num_classes != self.num_classes:
+            raise ValueError(f"类别数不一致: {self.num_classes} vs {other.num_classes}")
+        self.counts += other.counts
+        return self
+
+    def __add__(self, other: 'ConfusionCounts') -> 'ConfusionCounts':
+        return ConfusionCounts(self.num_classes, self.counts.copy()).merge(other)
+
+    @property
+    def total(self) -> int:
+        return int(self.counts.sum())
+
+    def metrics(self) -> Dict[str, Any]:
+        return metrics_from_confusion(self.counts)
+
+def accumulate_confusion(chunks: Iterable[Union[ConfusionCounts, Tuple[Any, Any]]],
+                         num_classes: int = 2) -> ConfusionCounts:
+    """
+    合并流式输入
+
+    Args:
+        chunks: 每项为 (y_true块, y_pred块) 或已经算好的ConfusionCounts
+    """
+    total = ConfusionCounts(num_classes)
+    for chunk in chunks:
+        if isinstance(chunk, ConfusionCounts):
+            total.merge(chunk)
+        else:
+            total.update(*chunk)
+    return total
+
+def _safe_divide(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    """分母为0时结果为0（与sklearn的zero_division默认行为一致）"""
+    return np.divide(numerator, denominator, out=np.zeros_like(numerator, dtype=np.float64),
+                     where=denominator > 0)
+
+def metrics_from_confusion(cm: np.ndarray) -> Dict[str, Any]:
+    """
+    由混淆矩阵推出全部指标（键名与evaluate.calculate_metrics保持一致）
+
+    宏平均只对真实或预测中出现过的类别取平均，单标签分类的微平均等于准确率，
+    均与sklearn相同。auc沿用原evaluate的硬标签AUC（即roc_auc_score(y_true, y_pred)，
+    二分类时等于两类召回率的均值），只有一类真实标签或非二分类时为None；
+    基于概率的AUC由curves.compute_curves计算。
+    """
+    cm = np.asarray(cm, dtype=np.int64)
+    total = cm.sum()
+    tp = np.diag(cm).astype(np.float64)
+    predicted = cm.sum(axis=0).astype(np.float64)
+    actual = cm.sum(axis=1).astype(np.float64)
+
+    precision = _safe_divide(tp, predicted)
+    recall = _safe_divide(tp, actual)
+    f1 = _safe_divide(2 * precision * recall, precision + recall)
+    present = (predicted + actual) > 0
+    accuracy = float(tp.sum() / total) if total else 0.0
+
+    metrics = {
+        'accuracy': accuracy,
+        'precision_macro': float(precision[present].mean()) if present.any() else 0.0,
+        'recall_macro': float(recall[present].mean()) if present.any() else 0.0,
+        'f1_macro': float(f1[present].mean()) if present.any() else 0.0,
+        'precision_micro': accuracy,
+        'recall_micro': accuracy,
+        'f1_micro': accuracy,
+    }
+    for c in range(len(cm)):
+        metrics[f'precision_class_{c}'] = float(precision[c])
+        metrics[f'recall_class_{c}'] = float(recall[c])
+        metrics[f'f1_class_{c}'] = float(f1[c])
+
+    metrics['auc'] = float(recall.mean()) if len(cm) == 2 and (actual > 0).all() else None
+    metrics['confusion_matrix'] = cm.tolist()
+    metrics['num_samples'] = int(total)
+    return metrics
+
+def benchmark(num_samples: int, chunk_samples: int = 1_000_000, seed: int = 0,
+              sklearn_samples: int = 1_000_000) -> Dict[str, Any]:
+    """
+    单遍bincount与逐指标调用sklearn的耗时对比
+
+    Args:
+        num_samples: bincount路径的样本数
+        chunk_samples: 流式路径每块的样本数
+        sklearn_samples: sklearn路径的样本数（按样本数线性外推到num_samples）
+    """
+    rng = np.random.default_rng(seed)
+    y_true = rng.integers(0, 2, num_samples, dtype=np.int8)
+    y_pred = np.where(rng.random(num_samples) < 0.85, y_true, 1 - y_true).astype(np.int8)
+
+    start = time.perf_counter()
+    counts = ConfusionCounts.from_arrays(y_true, y_pred)
+    metrics = counts.metrics()
+    array_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    chunks = ((y_true[i:i + chunk_samples], y_pred[i:i + chunk_samples])
+              for i in range(0, num_samples, chunk_samples))
+    streamed = accumulate_confusion(chunks)
+    stream_seconds = time.perf_counter() - start
+    assert np.array_equal(streamed.counts, counts.counts)
+
+    result = {
+        'num_samples': num_samples,
+        'bincount_seconds': array_seconds,
+        'streaming_seconds': stream_seconds,
+        'samples_per_second': num_samples / array_seconds,
+        'accuracy': metrics['accuracy'],
+        'sklearn_seconds_extrapolated': None
+    }
+
+    try:
+        from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score
+    except ImportError:
+        return result
+
+    t, p = y_true[:sklearn_samples], y_pred[:sklearn_samples]
+    start = time.perf_counter()
+    accuracy_score(t, p)
+    for fn in (precision_score, recall_score, f1_score):
+        for average in ('macro', 'micro'):
+            fn(t, p, average=average)
+        for label in (0, 1):
+            fn(t, p, pos_label=label)
+    elapsed = time.perf_counter() - start
+    result['sklearn_seconds_extrapolated'] = elapsed * num_samples / len(t)
+    return result
+
+def main():
+    """运行指标计算基准"""
+    parser = argparse.ArgumentParser(description="单遍混淆矩阵指标基准")
+    parser.add_argument('--num-samples', type=int, default=100_000_000, help='样本数')
+    parser.add_argument('--chunk-samples', type=int, default=1_000_000, help='流式路径每块样本数')
+    parser.add_argument('--sklearn-samples', type=int, default=1_000_000, help='sklearn对照的样本数')
+    parser.add_argument('--output', default='results/metrics_benchmark.json', help='结果输出路径')
+    args = parser.parse_args()
+
+    print("🧮 混淆矩阵指标基准")
+    print("=" * 50)
+    result = benchmark(args.num_samples, args.chunk_samples, sklearn_samples=args.sklearn_samples)
+    print(f"  • 样本数: {result['num_samples']:,}")
+    print(f"  • bincount单遍: {result['bincount_seconds']:.2f}s "
+          f"({result['samples_per_second'] / 1e6:.0f}M samples/s)")
+    print(f"  • 流式分块: {result['streaming_seconds']:.2f}s")
+    if result['sklearn_seconds_extrapolated'] is not None:
+        print(f"  • sklearn逐指标(外推): {result['sklearn_seconds_extrapolated']:.1f}s")
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"📄 结果已保存: {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+金融文本相似度分类竞赛 - 模型FLOPs利用率（MFU）
+根据Qwen配置推导每个训练token的FLOPs（区分冻结参数与LoRA参数、
+计入注意力和梯度检查点的重算），结合实测tokens/sec和硬件峰值算力计算MFU
+"""
+
+import time
+from typing import Dict, Any, Optional
+
+from transformers import TrainerCallback
+
+try:
+    from .memory_planner import count_parameters, model_dims
+    from .step_profiler import TrainingForwardHooks, count_tokens
+except ImportError:
+    from memory_planner import count_parameters, model_dims
+    from step_profiler import TrainingForwardHooks, count_tokens
+
+def training_flops_per_token(model_config: Dict[str, Any], seq_len: float, trainable_params: int,
+                             gradient_checkpointing: bool = False, top_n_layers: Optional[int] = None,
+                             lm_head_fraction: float = 1.0) -> Dict[str, float]:
+    """
+    估算每个训练token的FLOPs
+
+    记号：矩阵乘法每个参数每token前向2 FLOPs。
+        冻结参数：前向2N；需要向下传梯度的层反向只算输入梯度2N
+        可训练参数（LoRA或全量）：前向2N，反向4N（输入梯度+权重梯度）
+        注意力：因果注意力每层每token前向约 2×seq_len×hidden（QKᵀ与AV），反向为前向的2倍
+        梯度检查点：需要反向的层额外多一次前向
+        lm_head：视为冻结（前向2N、反向2N），只在部分位置计算时按lm_head_fraction折算；
+            全量微调时lm_head的权重梯度忽略不计
+
+    Args:
+        model_config: 模型配置（config.json内容）
+        seq_len: 平均序列长度
+        trainable_params: 可训练参数量（LoRA参数，或全量微调时的全部参数）
+        gradient_checkpointing: 是否开启梯度检查点
+        top_n_layers: 只有顶部N层需要反向（None表示全部）
+        lm_head_fraction: 实际计算lm_head的位置占比
+
+    Returns:
+        {'forward', 'backward', 'recompute', 'total'}
+    """
+    d = model_dims(model_config)
+    params = count_parameters(model_config)
+    backward_fraction = (top_n_layers or d['layers']) / d['layers']
+
+    layer_params = params['layers']
+    lm_head_params = (params['lm_head'] or params['embedding']) * lm_head_fraction
+    attention = 2 * seq_len * d['hidden'] * d['layers']
+
+    # 全量微调时可训练参数包含主干本身，冻结部分相应减少
+    trainable_matmul = min(trainable_params, layer_params)
+    frozen_layer_params = layer_params - trainable_matmul
+
+    layer_forward = 2 * (frozen_layer_params + trainable_matmul) + attention
+    forward = layer_forward + 2 * lm_head_params
+    backward = (2 * frozen_layer_params * backward_fraction + 4 * trainable_matmul
+                + 2 * attention * backward_fraction + 2 * lm_head_params)
+    recompute = layer_forward * backward_fraction if gradient_checkpointing else 0.0
+
+    return {
+        'forward': forward,
+        'backward': backward,
+        'recompute': recompute,
+        'total': forward + backward + recompute
+    }
+
+def compute_mfu(tokens_per_second: float, flops_per_token: float, peak_tflops: float,
+                num_devices: int = 1) -> float:
+    """MFU = 实际完成的模型FLOPs / 峰值算力（不把重算计入有效FLOPs）"""
+    return tokens_per_second * flops_per_token / (peak_tflops * 1e12 * num_devices)
+
+class MFUCallback(TrainerCallback):
+    """
+    训练中按logging_steps在日志里追加tokens_per_second和mfu
+
+    统计训练前向收到的有效token（hook同时挂在顶层和主干上，packing直接调用主干也能统计到；
+    评估前向不计入），用两次日志之间的墙钟时间计算吞吐，计时从第一个训练步开始，
+    不包含on_train_begin中torch.compile预热的前向和编译时间；FLOPs按实际模型配置和可训练参数量推导。
+
+    Args:
+        peak_tflops: 单卡峰值算力（TFLOPS）
+        top_n_layers: 只有顶部N层挂LoRA时传入
+        lm_head: 'all'每个位置都算词表投影，'last'每行只算一个位置，'none'为分类头（可忽略）
+    """
+
+    def __init__(self, peak_tflops: float, top_n_layers: Optional[int] = None, lm_head: str = 'all'):
+        if lm_head not in ('all', 'last', 'none'):
+            raise ValueError(f"不支持的lm_head口径: {lm_head}")
+        self.peak_tflops = peak_tflops
+        self.top_n_layers = top_n_layers
+        self.lm_head = lm_head
+        self._hooks: Optional[TrainingForwardHooks] = None
+        self._tokens = 0
+        self._rows = 0
+        self._last_time = None
+
+    def _count_tokens(self, args, kwargs):
+        counts = count_tokens(args, kwargs)
+        if counts is not None:
+            self._tokens += counts['real_tokens']
+            self._rows += counts['rows']
+
+    def on_train_begin(self, args, state, control, model=None, **kwargs):
+        self._model_config = model.config.to_dict()
+        self._trainable_params = sum(p.numel() for p in model.parameters() if p.requires_grad)
+        self._gradient_checkpointing = args.gradient_checkpointing
+        self._num_devices = max(args.world_size, 1)
+        self._hooks = TrainingForwardHooks(model, self._count_tokens)
+        self._last_time = None
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        if self._hooks is not None:
+            self._hooks.reset()
+        if self._last_time is None:
+            # 第一个训练步开始时清零，排除预热前向
+            self._tokens = 0
+            self._rows = 0
+            self._last_time = time.perf_counter()
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        if logs is None or 'loss' not in logs or self._last_time is None:
+            return
+
+        now = time.perf_counter()
+        elapsed = now - self._last_time
+        if elapsed <= 0 or self._tokens == 0:
+            return
+
+        # 每个进程只统计自己的token，乘以进程数得到全局吞吐
+        tokens_per_second = self._tokens * self._num_devices / elapsed
+        seq_len = self._tokens / max(self._rows, 1)
+        lm_head_fraction = {'all': 1.0, 'last': 1.0 / seq_len, 'none': 0.0}[self.lm_head]
+        flops = training_flops_per_token(self._model_config, seq_len, self._trainable_params,
+                                         self._gradient_checkpointing, self.top_n_layers,
+                                         lm_head_fraction)
+        mfu = compute_mfu(tokens_per_second, flops['forward'] + flops['backward'],
+                          self.peak_tflops, self._num_devices)
+
+        metrics = {'tokens_per_second': round(tokens_per_second, 1), 'mfu': round(mfu, 4)}
+        logs.update(metrics)
+        # Trainer在回调前已经把日志写入log_history，这里同步补上
+        if state.log_history and state.log_history[-1].get('step') == state.global_step:
+            state.log_history[-1].update(metrics)
+
+        self._tokens = 0
+        self._rows = 0
+        self._last_time = now
+
+    def on_train_end(self, args, state, control, **kwargs):
+        if self._hooks is not None:
+            self._hooks.remove()
+            self._hooks = None
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+金融文本相似度分类竞赛 - LoRA checkpoint平均（Model Soup）
+对同一次训练产生的多个LoRA checkpoint做参数平均，输出单个适配器，
+以单模型推理成本获得接近集成的效果
+"""
+
+import os
+import json
+import shutil
+import argparse
+from typing import Dict, Any, List, Optional
+
+import torch
+from safetensors.torch import load_file, save_file
+
+try:
+    from .model_trainer import get_project_root, load_config
+    from .checkpoint_sweep import (
+        list_checkpoints, load_base_model, load_validation_samples,
+        build_batch_cache, get_label_token_ids, score_batches
+    )
+except ImportError:
+    from model_trainer import get_project_root, load_config
+    from checkpoint_sweep import (
+        list_checkpoints, load_base_model, load_validation_samples,
+        build_batch_cache, get_label_token_ids, score_batches
+    )
+
+ADAPTER_WEIGHTS_NAME = 'adapter_model.safetensors'
+ADAPTER_BIN_NAME = 'adapter_model.bin'
+# 这些文件属于训练状态，不随soup一起复制
+SKIP_FILES = {
+    ADAPTER_WEIGHTS_NAME, ADAPTER_BIN_NAME, 'optimizer.pt', 'scheduler.pt',
+    'rng_state.pth', 'trainer_state.json', 'training_args.bin'
+}
+
+def load_adapter_tensors(checkpoint_dir: str) -> Dict[str, torch.Tensor]:
+    """读取checkpoint中的LoRA适配器权重"""
+    safetensors_path = os.path.join(checkpoint_dir, ADAPTER_WEIGHTS_NAME)
+    if os.path.exists(safetensors_path):
+        return load_file(safetensors_path, device='cpu')
+
+    bin_path = os.path.join(checkpoint_dir, ADAPTER_BIN_NAME)
+    if os.path.exists(bin_path):
+        return torch.load(bin_path, map_location='cpu')
+
+    raise FileNotFoundError(f"checkpoint中没有适配器权重: {checkpoint_dir}")
+
+def load_adapter_config(checkpoint_dir: str) -> Dict[str, Any]:
+    """读取adapter_config.json"""
+    with open(os.path.join(checkpoint_dir, 'adapter_config.json'), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def check_compatible(checkpoints: List[str]):
+    """确认所有checkpoint的LoRA结构一致，否则无法平均"""
+    reference = load_adapter_config(checkpoints[0])
+    keys = ('r', 'lora_alpha', 'target_modules', 'base_model_name_or_path')
+    for ckpt in checkpoints[1:]:
+        config = load_adapter_config(ckpt)
+        for key in keys:
+            ref_value, value = reference.get(key), config.get(key)
+            if isinstance(ref_value, list):
+                ref_value, value = sorted(ref_value), sorted(value or [])
+            if ref_value != value:
+                raise ValueError(f"{ckpt} 的 {key} 与 {checkpoints[0]} 不一致: {value} vs {ref_value}")
+
+def average_adapter_tensors(tensor_sets: List[Dict[str, torch.Tensor]],
+                            weights: Optional[List[float]] = None) -> Dict[str, torch.Tensor]:
+    """
+    对多组适配器权重做（加权）平均
+
+    LoRA的A、B矩阵分别平均。同一次训练的checkpoint共享初始化和优化轨迹，
+    分别平均与平均ΔW=BA的结果非常接近，且能保持原有rank不变。
+
+    Args:
+        tensor_sets: 每个checkpoint的权重字典
+        weights: 平均权重（默认均匀）
+
+    Returns:
+        平均后的权重字典
+    """
+    if weights is None:
+        weights = [1.0] * len(tensor_sets)
+    total = float(sum(weights))
+
+    reference = tensor_sets[0]
+    averaged = {}
+    for key, tensor in reference.items():
+        acc = torch.zeros_like(tensor, dtype=torch.float32)
+        for tensors, weight in zip(tensor_sets, weights):
+            if key not in tensors or tensors[key].shape != tensor.shape:
+                raise ValueError(f"适配器权重不匹配: {key}")
+            acc.add_(tensors[key].float(), alpha=weight / total)
+        averaged[key] = acc.to(tensor.dtype).contiguous()
+
+    return averaged
+
+def write_soup_adapter(tensors: Dict[str, torch.Tensor], template_dir: str, output_dir: str,
+                       soup_info: Dict[str, Any]):
+    """
+    写出soup适配器
+
+    复制模板checkpoint中的配置文件（adapter_config.json、args.json等），
+    使输出目录可以直接作为InferArguments的adapters使用。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    for name in os.listdir(template_dir):
+        src = os.path.join(template_dir, name)
+        if name in SKIP_FILES or not os.path.isfile(src):
+            continue
+        shutil.copy2(src, os.path.join(output_dir, name))
+
+    save_file(tensors, os.path.join(output_dir, ADAPTER_WEIGHTS_NAME), metadata={'format': 'pt'})
+
+    with open(os.path.join(output_dir, 'soup_info.json'), 'w', encoding='utf-8') as f:
+        json.dump(soup_info, f, ensure_ascii=False, indent=2)
+
+def uniform_soup(checkpoints: List[str]) -> Dict[str, Any]:
+    """均匀平均所有checkpoint"""
+    tensors = average_adapter_tensors([load_adapter_tensors(c) for c in checkpoints])
+    return {
+        'tensors': tensors,
+        'members': checkpoints,
+        'weights': [1.0 / len(checkpoints)] * len(checkpoints)
+    }
+
+def greedy_soup(checkpoints: List[str], model_id: str, num_samples: int = 1000,
+                batch_size: int = 16, max_length: int = 256) -> Dict[str, Any]:
+    """
+    Greedy soup：按单模型验证准确率从高到低尝试加入，只保留不降低准确率的成员
+
+    基座模型只加载一次，候选soup直接写入同一个适配器槽位进行打分。
+    """
+    from peft import PeftModel, set_peft_model_state_dict
+
+    model, tokenizer = load_base_model(model_id)
+    samples = load_validation_samples(num_samples)
+    y_true = torch.tensor([int(s['label']) for s in samples])
+    batches = build_batch_cache(tokenizer, samples, batch_size, max_length)
+    label_token_ids = get_label_token_ids(tokenizer)
+
+    model = PeftModel.from_pretrained(model, checkpoints[0], adapter_name='soup')
+    model.eval()
+
+    def accuracy_of(tensors: Dict[str, torch.Tensor]) -> float:
+        set_peft_model_state_dict(model, tensors, adapter_name='soup')
+        y_pred, _ = score_batches(model, batches, label_token_ids, len(samples))
+        return float((torch.from_numpy(y_pred) == y_true).float().mean())
+
+    print("📊 评估单个checkpoint...")
+    tensor_sets = {}
+    individual = {}
+    for ckpt in checkpoints:
+        tensor_sets[ckpt] = load_adapter_tensors(ckpt)
+        individual[ckpt] = accuracy_of(tensor_sets[ckpt])
+        print(f"  • {os.path.basename(ckpt)}: {individual[ckpt]:.4f}")
+
+    ranked = sorted(checkpoints, key=lambda c: individual[c], reverse=True)
+    members = [ranked[0]]
+    best_acc = individual[ranked[0]]
+    print(f"\n🥣 初始soup: {os.path.basename(ranked[0])} ({best_acc:.4f})")
+
+    for ckpt in ranked[1:]:
+        candidate = members + [ckpt]
+        acc = accuracy_of(average_adapter_tensors([tensor_sets[c] for c in candidate]))
+        if acc >= best_acc:
+            members, best_acc = candidate, acc
+            print(f"  ✅ 加入 {os.path.basename(ckpt)}: {acc:.4f}")
+        else:
+            print(f"  ⏭️ 跳过 {os.path.basename(ckpt)}: {acc:.4f}")
+
+    return {
+        'tensors': average_adapter_tensors([tensor_sets[c] for c in members]),
+        'members': members,
+        'weights': [1.0 / len(members)] * len(members),
+        'individual_accuracy': {c: individual[c] for c in checkpoints},
+        'soup_accuracy': best_acc
+    }
+
+def main():
+    """主函数"""
+    project_root = get_project_root()
+    config = load_config()
+
+    parser = argparse.ArgumentParser(description="LoRA checkpoint平均（Model Soup）")
+    parser.add_argument('--method', choices=['uniform', 'greedy'], default='uniform',
+                        help='平均方式: uniform(均匀平均) 或 greedy(按验证准确率贪心选择)')
+    parser.add_argument('--output-dir', default=str(project_root / 'models' / 'enhanced_output'),
+                        help='checkpoint所在目录')
+    parser.add_argument('--checkpoints', nargs='*', help='指定checkpoint列表（默认使用全部）')
+    parser.add_argument('--save-dir', default=str(project_root / 'models' / 'soup_adapter'),
+                        help='soup适配器输出目录')
+    parser.add_argument('--model', default=config['model']['model_id'], help='基座模型（greedy使用）')
+    parser.add_argument('--num-samples', type=int, default=1000, help='验证样本数（greedy使用）')
+    parser.add_argument('--batch-size', type=int, default=16, help='批次大小（greedy使用）')
+
+    args = parser.parse_args()
+
+    print("🥣 LoRA Model Soup")
+    print("=" * 50)
+
+    checkpoints = args.checkpoints or list_checkpoints(args.output_dir)
+    if len(checkpoints) < 2:
+        print(f"❌ 至少需要2个checkpoint，当前: {len(checkpoints)}")
+        return
+
+    check_compatible(checkpoints)
+    print(f"📁 候选checkpoint: {len(checkpoints)} 个")
+
+    if args.method == 'uniform':
+        soup = uniform_soup(checkpoints)
+    else:
+        soup = greedy_soup(checkpoints, args.model, args.num_samples, args.batch_size,
+                           config['training']['max_length'])
+
+    tensors = soup.pop('tensors')
+    soup['method'] = args.method
+    write_soup_adapter(tensors, soup['members'][0], args.save_dir, soup)
+
+    print(f"\n✅ soup适配器已保存: {args.save_dir}")
+    print(f"  • 成员: {', '.join(os.path.basename(m) for m in soup['members'])}")
+    if 'soup_accuracy' in soup:
+        print(f"  • 验证准确率: {soup['soup_accuracy']:.4f}")
+    print(f"💡 推理时使用: get_inference_args('{args.save_dir}')")
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,6 @@
 """
 
 import os
-import re
 import json
 import argparse
 from typing import Dict, Any, List, Optional
@@ -131,14 +130,14 @@ def get_project_root():
     current_file = Path(__file__).resolve()
     return current_file.parent.parent
 
-class EnhancedPreprocessor(ResponsePreprocessor):
-    """优化的数据预处理器"""
+SYSTEM_PROMPT = "你是一个专业的金融文本相似度判断专家。请仔细分析两句话在金融语境下的语义相似性，只输出0或1，不要输出其他内容。"
 
-    def preprocess(self, row: Dict[str, Any]) -> Dict[str, Any]:
-        query = f"""判断下面两句金融咨询文本是否表达相同的语义含义。
+def build_query(text1: str, text2: str) -> str:
+    """构建训练和推理共用的查询文本"""
+    return f"""判断下面两句金融咨询文本是否表达相同的语义含义。
 
-句子1: {row['text1']}
-句子2: {row['text2']}
+句子1: {text1}
+句子2: {text2}
 
 规则：
 - 含义相同或非常相似: 输出1
@@ -147,6 +146,12 @@ class EnhancedPreprocessor(ResponsePreprocessor):
 
 结果: """
 
+class EnhancedPreprocessor(ResponsePreprocessor):
+    """优化的数据预处理器"""
+
+    def preprocess(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        query = build_query(row['text1'], row['text2'])
+
         response = str(row['label'])
         row = {
             'query': query,
@@ -190,6 +195,18 @@ def get_training_args(output_dir: Optional[str] = None) -> TrainArguments:
     # 加载配置文件
     config = load_config()
 
+    # LoRA目标：默认所有层；配置top_n_layers时只挂在顶部N层
+    lora_target = {'target_modules': config['lora']['target_modules']}
+    top_n_layers = config['lora'].get('top_n_layers')
+    if top_n_layers:
+        try:
+            from .top_layer_lora import build_top_layer_target_regex, get_num_hidden_layers
+        except ImportError:
+            from top_layer_lora import build_top_layer_target_regex, get_num_hidden_layers
+        lora_target = {'target_regex': build_top_layer_target_regex(
+            get_num_hidden_layers(config['model']['model_id']), top_n_layers, config['lora']['target_modules']
+        )}
+
     return TrainArguments(
         model=config['model']['model_id'],
         model_type=config['model']['model_type'],
@@ -241,47 +258,120 @@ def get_training_args(output_dir: Optional[str] = None) -> TrainArguments:
         lora_rank=config['lora']['lora_rank'],
         lora_alpha=config['lora']['lora_alpha'],
         lora_dropout=config['lora']['lora_dropout'],
-        target_modules=config['lora']['target_modules'],
-        save_only_model=True,
+        **lora_target,
+        # 精确续训需要优化器、调度器和随机数状态
+        save_only_model=not config['training'].get('exact_resume', False),
+        resume_from_checkpoint=config['training'].get('resume_from_checkpoint'),
         attn_impl='flash_attn',
         use_nested_quant=True,
-        system="你是一个专业的金融文本相似度判断专家。请仔细分析两句话在金融语境下的语义相似性，只输出0或1，不要输出其他内容。",
+        system=SYSTEM_PROMPT,
         seed=42,
         early_stopping=True,
         early_stopping_patience=3,
         early_stopping_threshold=0.001,
     )
 
-def extract_prediction(response: str) -> int:
-    """从模型输出中提取预测结果"""
-    if not response:
-        return 0
-
-    response = response.strip()
-
-    # 直接匹配数字0或1
-    if response in ['0', '1']:
-        return int(response)
-
-    # 匹配包含数字的模式
-    digit_match = re.search(r'\b([01])\b', response)
-    if digit_match:
-        return int(digit_match.group(1))
-
-    # 基于关键词判断
-    response_lower = response.lower()
-    positive_keywords = ['相似', '相同', '类似', '一致', '是', 'yes', 'true']
-    negative_keywords = ['不同', '不相似', '不相同', '差异', '不是', 'no', 'false']
+def get_training_callbacks(config: Optional[Dict[str, Any]] = None) -> List[Any]:
+    """根据配置文件构建需要注入Trainer的回调"""
+    if config is None:
+        config = load_config()
+    training = config['training']
+    callbacks = []
+
+    if training.get('last_position_lm_head', False):
+        try:
+            from .lm_head_slicing import LastPositionLMHeadCallback
+        except ImportError:
+            from lm_head_slicing import LastPositionLMHeadCallback
+        callbacks.append(LastPositionLMHeadCallback(training.get('restrict_lm_head_to_labels', False),
+                                                    check=training.get('check_lm_head_slicing', False)))
+
+    top_n_layers = config['lora'].get('top_n_layers')
+    if top_n_layers:
+        try:
+            from .top_layer_lora import TopLayerNoGradCallback
+        except ImportError:
+            from top_layer_lora import TopLayerNoGradCallback
+        callbacks.append(TopLayerNoGradCallback(top_n_layers))
+
+    profiling = config.get('profiling', {})
+    if profiling.get('enabled', False):
+        try:
+            from .step_profiler import StepProfilerCallback
+        except ImportError:
+            from step_profiler import StepProfilerCallback
+        callbacks.append(StepProfilerCallback(
+            synchronize=profiling.get('synchronize', True),
+            trace_start_step=profiling.get('trace_start_step'),
+            trace_num_steps=profiling.get('trace_num_steps', 3)
+        ))
+
+    if profiling.get('report_mfu', False):
+        try:
+            from .mfu import MFUCallback
+        except ImportError:
+            from mfu import MFUCallback
+        lm_head = 'last' if training.get('last_position_lm_head', False) else 'all'
+        callbacks.append(MFUCallback(profiling.get('peak_tflops', 125.0), top_n_layers, lm_head))
+
+    return callbacks
+
+def get_trainer_mixins(config: Optional[Dict[str, Any]] = None) -> List[type]:
+    """根据配置文件构建需要混入Swift Trainer的mixin"""
+    if config is None:
+        config = load_config()
+    training = config['training']
+    mixins = []
+
+    if training.get('exact_resume', False):
+        try:
+            from .resumable_sampler import ResumableDataTrainerMixin
+        except ImportError:
+            from resumable_sampler import ResumableDataTrainerMixin
+        mixins.append(ResumableDataTrainerMixin)
+
+    if training.get('async_save', False):
+        try:
+            from .async_checkpoint import AsyncCheckpointTrainerMixin
+        except ImportError:
+            from async_checkpoint import AsyncCheckpointTrainerMixin
+        mixins.append(AsyncCheckpointTrainerMixin)
+
+    return mixins
+
+def run_sft(train_args: TrainArguments, callbacks: Optional[List[Any]] = None,
+            trainer_mixins: Optional[List[type]] = None):
+    """
+    运行sft_main，并把额外的回调和mixin注入Swift创建的Trainer
+
+    Args:
+        trainer_mixins: 混入Trainer类的mixin（按顺序排在Swift Trainer之前）
+    """
+    if not callbacks and not trainer_mixins:
+        return sft_main(train_args)
+
+    from swift.llm.train.sft import SwiftSft
+
+    class CallbackSwiftSft(SwiftSft):
+        def _prepare_callbacks(self):
+            super()._prepare_callbacks()
+            self.callbacks.extend(callbacks or [])
+
+        def train(self, trainer):
+            if trainer_mixins:
+                trainer_cls = type(trainer)
+                trainer.__class__ = type(f'Mixed{trainer_cls.__name__}', (*trainer_mixins, trainer_cls), {})
+            return super().train(trainer)
+
+    return CallbackSwiftSft(train_args).main()
 
-    positive_score = sum(1 for word in positive_keywords if word in response_lower)
-    negative_score = sum(1 for word in negative_keywords if word in response_lower)
-
-    if positive_score > negative_score:
-        return 1
-    elif negative_score > positive_score:
-        return 0
-    else:
-        return 0
+def extract_prediction(response: str) -> int:
+    """从模型输出中提取预测结果（取第一个独立的0/1，否则按关键词判断）"""
+    try:
+        from .response_parser import parse_response
+    except ImportError:
+        from response_parser import parse_response
+    return parse_response(response, mode='boundary')
 
 def find_best_checkpoint(output_dir: Optional[str] = None) -> Optional[str]:
     """查找最佳checkpoint"""
@@ -337,7 +427,9 @@ def run_training():
         gpu_name = torch.cuda.get_device_name(0)
         print(f"✅ GPU可用: {gpu_count} × {gpu_name}")
     else:
-        print("❌ 未检测到GPU，使用CPU训练")
+        # Swift LoRA训练7B模型在CPU上不可行；小模型可用 train_basic.py --cpu --model-name <小模型>
+        print("❌ 未检测到GPU，Swift LoRA训练需要GPU")
+        print("💡 CPU训练请使用: python train_basic.py --cpu --model-name Qwen/Qwen2-0.5B-Instruct")
         return False
 
     # 注册数据集
@@ -350,19 +442,26 @@ def run_training():
         return False
 
     # 获取训练参数
+    config = load_config()
     train_args = get_training_args()
+    callbacks = get_training_callbacks(config)
     print("\n📋 训练配置:")
     print(f"  • 模型: {train_args.model}")
     print(f"  • 训练轮数: {train_args.num_train_epochs}")
     print(f"  • 学习率: {train_args.learning_rate}")
     print(f"  • LoRA rank: {train_args.lora_rank}")
     print(f"  • 输出目录: {train_args.output_dir}")
+    if callbacks:
+        print(f"  • 训练回调: {', '.join(type(cb).__name__ for cb in callbacks)}")
+    trainer_mixins = get_trainer_mixins(config)
+    if trainer_mixins:
+        print(f"  • Trainer扩展: {', '.join(m.__name__ for m in trainer_mixins)}")
 
     # 开始训练
     print("\n🚀 开始训练...")
     print("💡 提示: 训练过程可能需要较长时间，请耐心等待...")
     try:
-        sft_main(train_args)
+        run_sft(train_args, callbacks, trainer_mixins)
         print("\n🎉 训练完成！")
         return True
     except Exception as e:
@@ -382,6 +481,22 @@ def run_training():
 
         return False
 
+def write_result_store(result_path: str) -> Optional[str]:
+    """把推理结果另存为列式存储（文本取自逐行对应的data/test.jsonl），供评估/集成/错误分析直接读取"""
+    try:
+        from .result_store import convert_jsonl_to_store
+    except ImportError:
+        from result_store import convert_jsonl_to_store
+
+    data_file = get_project_root() / 'data' / 'test.jsonl'
+    try:
+        store_path = convert_jsonl_to_store(result_path, data_file=str(data_file) if data_file.exists() else None)
+    except Exception as e:
+        print(f"⚠️ 列式结果写入失败: {e}")
+        return None
+    print(f"🗂️ 列式结果已保存: {store_path}")
+    return store_path
+
 def run_inference():
     """运行模型推理"""
     print("🧠 开始模型推理")
@@ -417,6 +532,7 @@ def run_inference():
     try:
         result = infer_main(infer_args)
         print("✅ 推理完成！")
+        write_result_store(infer_args.result_path)
         return True
     except Exception as e:
         print(f"\n❌ 推理失败: {e}")
@@ -455,6 +571,7 @@ def main():
         if args.action in ['inference', 'all']:
             print("\n📤 结果文件:")
             print("  • 推理结果: results/enhanced_result.jsonl")
+            print("  • 列式结果: results/enhanced_result.store")
             print("  • 竞赛提交: cp results/enhanced_result.jsonl results/result.json")
     else:
         print("\n❌ 操作失败")
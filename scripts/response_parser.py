@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+金融文本相似度分类竞赛 - 模型输出解析
+统一utils.clean_prediction_output与model_trainer.extract_prediction两套解析规则：
+正则预编译、前缀剥离合并为一个模式、精确"0"/"1"直接查表、重复的原始输出走LRU缓存，
+parse_batch一次解析整批输出为int8数组
+"""
+
+import os
+import re
+import json
+import time
+import random
+import argparse
+from functools import lru_cache
+from typing import Dict, Any, Iterable, List
+
+import numpy as np
+
+# 精确答案直接查表，不进入缓存和正则
+EXACT_RESPONSES = {'0': 0, '1': 1}
+POSITIVE_KEYWORDS = ('相似', '相同', '类似', '一致', '是', 'yes', 'true')
+NEGATIVE_KEYWORDS = ('不同', '不相似', '不相同', '差异', '不是', 'no', 'false')
+PARSE_CACHE_SIZE = 1 << 16
+
+# clean模式：依次尝试三种前缀，交替分支按顺序回溯，与逐个re.search后break等价
+_PREFIX_PATTERN = re.compile(
+    r'^(?:.*?(?:输出|结果|判断结果|类别|预测)[:：]'
+    r'|.*?(?:我认为|答案是|预测为)[:：]?'
+    r'|.*?[:：])\s*',
+    re.IGNORECASE
+)
+_DIGIT_PATTERN = re.compile(r'[01]')
+# boundary模式：0/1必须是独立的词
+_WORD_DIGIT_PATTERN = re.compile(r'\b([01])\b')
+
+PARSE_MODES = ('clean', 'boundary')
+
+def keyword_vote(text: str) -> int:
+    """关键词计票，正面关键词更多时为1，否则为0（数据集中类别0更多）"""
+    text = text.lower()
+    positive = sum(1 for word in POSITIVE_KEYWORDS if word in text)
+    negative = sum(1 for word in NEGATIVE_KEYWORDS if word in text)
+    return 1 if positive > negative else 0
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_clean(response: str) -> int:
+    response = response.strip()
+    if response in EXACT_RESPONSES:
+        return EXACT_RESPONSES[response]
+
+    match = _PREFIX_PATTERN.search(response)
+    if match:
+        response = response[match.end():].strip()
+        if response in EXACT_RESPONSES:
+            return EXACT_RESPONSES[response]
+
+    digit = _DIGIT_PATTERN.search(response)
+    if digit:
+        return EXACT_RESPONSES[digit.group()]
+    return keyword_vote(response)
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_boundary(response: str) -> int:
+    response = response.strip()
+    if response in EXACT_RESPONSES:
+        return EXACT_RESPONSES[response]
+
+    digit = _WORD_DIGIT_PATTERN.search(response)
+    if digit:
+        return EXACT_RESPONSES[digit.group(1)]
+    return keyword_vote(response)
+
+_PARSERS = {'clean': _parse_clean, 'boundary': _parse_boundary}
+
+def parse_response(response: str, mode: str = 'clean') -> int:
+    """
+    解析单条模型输出为0/1
+
+    Args:
+        response: 模型原始输出
+        mode: 'clean' 剥离"输出:"等前缀后取第一个0/1（同utils.clean_prediction_output）；
+              'boundary' 取第一个独立的0/1（同model_trainer.extract_prediction）
+    """
+    if not response:
+        return 0
+    if response in EXACT_RESPONSES:
+        return EXACT_RESPONSES[response]
+    return _PARSERS[mode](response)
+
+def parse_batch(responses: Iterable[str], mode: str = 'clean') -> np.ndarray:
+    """批量解析模型输出（列表或数组），返回int8数组"""
+    if not hasattr(responses, '__len__'):
+        responses = list(responses)
+    parse, exact = _PARSERS[mode], EXACT_RESPONSES
+    return np.fromiter(
+        (exact[r] if r in exact else (parse(r) if r else 0) for r in responses),
+        dtype=np.int8, count=len(responses)
+    )
+
+def cache_info() -> Dict[str, Any]:
+    """各模式LRU缓存的命中统计"""
+    return {mode: parse.cache_info()._asdict() for mode, parse in _PARSERS.items()}
+
+def clear_cache():
+    for parse in _PARSERS.values():
+        parse.cache_clear()
+
+def synthetic_responses(num_responses: int, seed: int = 0) -> List[str]:
+    """
+    合成模型输出：多数为精确的0/1，其余为带前缀/解释/关键词的变体，
+    带编号的变体让缓存也有未命中的情况
+    """
+    rng = random.Random(seed)
+    templates = ['{d}', ' {d}\n', '输出: {d}', '答案是{d}', '判断结果：{d}。', '我认为 {d}',
+                 '这两句话意思相似', '两句话不相同', '类别: {d} (样本{n})', '预测为{d}，理由{n}']
+    weights = [70, 8, 5, 4, 3, 3, 2, 2, 2, 1]
+    picked = rng.choices(templates, weights=weights, k=num_responses)
+    return [t.format(d=rng.randint(0, 1), n=rng.randint(0, 99_999)) if '{' in t else t for t in picked]
+
+def benchmark(num_responses: int = 1_000_000, seed: int = 0) -> Dict[str, Any]:
+    """parse_batch的吞吐：清空缓存后的首次解析与缓存命中后的再次解析"""
+    responses = synthetic_responses(num_responses, seed)
+    result: Dict[str, Any] = {'num_responses': num_responses}
+    for mode in PARSE_MODES:
+        clear_cache()
+        start = time.perf_counter()
+        parse_batch(responses, mode)
+        cold_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        parse_batch(responses, mode)
+        warm_seconds = time.perf_counter() - start
+
+        result[mode] = {
+            'cold_seconds': cold_seconds,
+            'warm_seconds': warm_seconds,
+            'cold_per_second': num_responses / cold_seconds,
+            'warm_per_second': num_responses / warm_seconds,
+            'cache': cache_info()[mode]
+        }
+    return result
+
+def main():
+    """解析器基准入口（与原实现的一致性由tests/test_response_parser.py检查）"""
+    parser = argparse.ArgumentParser(description="模型输出解析器基准")
+    parser.add_argument('--num-responses', type=int, default=1_000_000, help='基准的合成输出条数')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    parser.add_argument('--output', default='results/response_parser_benchmark.json', help='结果输出路径')
+    args = parser.parse_args()
+
+    print("🔤 模型输出解析器")
+    print("=" * 50)
+    result = {'benchmark': benchmark(args.num_responses, args.seed)}
+    for mode in PARSE_MODES:
+        row = result['benchmark'][mode]
+        print(f"  • {mode}: 首次 {row['cold_per_second'] / 1e6:.2f}M/s, "
+              f"缓存命中后 {row['warm_per_second'] / 1e6:.2f}M/s, 缓存命中 {row['cache']['hits']:,}")
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"📄 结果已保存: {args.output}")
+
+if __name__ == '__main__':
+    main()
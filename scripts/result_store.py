@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+金融文本相似度分类竞赛 - 列式预测结果存储
+推理结果按列保存为 .npy（行号、文本id、标签、预测、概率）加字符串块（去重后的文本、原始输出），
+字符串块配偏移量索引，可按行随机访问；读取全部走memmap，评估、集成和错误分析都不再用正则解析query
+
+目录结构:
+    <name>.store/
+        row_id.npy  text1_id.npy  text2_id.npy  label.npy  prediction.npy  probability.npy
+        texts.bin  texts.idx.npy  responses.bin  responses.idx.npy
+        meta.json   （最后写入，存在即代表完整；source记录转换来源，用于判断是否过期）
+"""
+
+import os
+import re
+import json
+import shutil
+import argparse
+from itertools import zip_longest
+from typing import Dict, Any, List, Optional, Sequence
+
+import numpy as np
+
+try:
+    from .streaming_eval import iter_jsonl_chunks, record_prediction
+    from .curves import record_probability
+except ImportError:
+    from streaming_eval import iter_jsonl_chunks, record_prediction
+    from curves import record_probability
+
+STORE_SUFFIX = '.store'
+META_NAME = 'meta.json'
+FORMAT_VERSION = 1
+NO_LABEL = -1
+
+COLUMN_DTYPES = {
+    'row_id': np.int64,
+    'text1_id': np.int32,
+    'text2_id': np.int32,
+    'label': np.int8,
+    'prediction': np.int8,
+    'probability': np.float32
+}
+
+def store_path_for(result_file: str) -> str:
+    """结果文件对应的列式存储目录（results/x.jsonl -> results/x.store）"""
+    return os.path.splitext(result_file)[0] + STORE_SUFFIX
+
+def is_result_store(path: str) -> bool:
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, META_NAME))
+
+class _StringTableWriter:
+    """字符串块写入：utf-8字节顺序追加，偏移量数组作为索引（可选去重）"""
+
+    def __init__(self, directory: str, name: str, dedupe: bool = False):
+        self.directory, self.name = directory, name
+        self.file = open(os.path.join(directory, f'{name}.bin'), 'wb')
+        self.offsets = [0]
+        self.ids: Optional[Dict[str, int]] = {} if dedupe else None
+
+    def add(self, text: str) -> int:
+        if self.ids is not None and text in self.ids:
+            return self.ids[text]
+        data = text.encode('utf-8')
+        self.file.write(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+        string_id = len(self.offsets) - 2
+        if self.ids is not None:
+            self.ids[text] = string_id
+        return string_id
+
+    def close(self) -> int:
+        self.file.close()
+        np.save(os.path.join(self.directory, f'{self.name}.idx.npy'), np.asarray(self.offsets, dtype=np.int64))
+        return len(self.offsets) - 1
+
+class _StringTable:
+    """字符串块只读访问（memmap）"""
+
+    def __init__(self, directory: str, name: str):
+        self.offsets = np.load(os.path.join(directory, f'{name}.idx.npy'), mmap_mode='r')
+        blob_path = os.path.join(directory, f'{name}.bin')
+        # 空文件无法memmap
+        self.blob = np.memmap(blob_path, dtype=np.uint8, mode='r') if os.path.getsize(blob_path) \
+            else np.empty(0, dtype=np.uint8)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        return self.blob[self.offsets[index]:self.offsets[index + 1]].tobytes().decode('utf-8')
+
+class ResultStoreWriter:
+    """
+    列式结果写入器：字符串直接流式写盘，数值列按块缓存，close时写出
+
+    先写入临时目录，close时把旧目录改名到一旁、再把临时目录重命名为正式目录，最后删除旧目录；
+    两次重命名之间正式路径短暂不存在，但读取方不会看到写了一半或新旧混合的存储。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        if os.path.exists(self.tmp_path):
+            shutil.rmtree(self.tmp_path)
+        os.makedirs(self.tmp_path)
+        self.texts = _StringTableWriter(self.tmp_path, 'texts', dedupe=True)
+        self.responses = _StringTableWriter(self.tmp_path, 'responses')
+        self.columns: Dict[str, List[np.ndarray]] = {name: [] for name in COLUMN_DTYPES}
+        self.num_rows = 0
+        # 写入meta.json的来源信息
+        self.source: Dict[str, Any] = {}
+
+    def append(self, text1: Sequence[str], text2: Sequence[str], responses: Sequence[str],
+               predictions: Sequence[int], probabilities: Optional[Sequence[Optional[float]]] = None,
+               labels: Optional[Sequence[Optional[int]]] = None, row_ids: Optional[Sequence[int]] = None):
+        """追加一批行（缺失的概率/标签分别记为NaN/-1，缺省行号为顺序编号）"""
+        n = len(predictions)
+        if row_ids is None:
+            row_ids = range(self.num_rows, self.num_rows + n)
+        if probabilities is None:
+            probabilities = [None] * n
+        if labels is None:
+            labels = [None] * n
+
+        batch = {
+            'row_id': row_ids,
+            'text1_id': [self.texts.add(t) for t in text1],
+            'text2_id': [self.texts.add(t) for t in text2],
+            'label': [NO_LABEL if v is None else v for v in labels],
+            'prediction': predictions,
+            'probability': [np.nan if v is None else v for v in probabilities]
+        }
+        for response in responses:
+            self.responses.add(response)
+        for name, values in batch.items():
+            column = np.asarray(values, dtype=COLUMN_DTYPES[name])
+            if len(column) != n:
+                raise ValueError(f"列{name}长度为{len(column)}，应为{n}")
+            self.columns[name].append(column)
+        self.num_rows += n
+
+    def close(self, source: Optional[Dict[str, Any]] = None) -> str:
+        num_texts = self.texts.close()
+        self.responses.close()
+        for name, chunks in self.columns.items():
+            column = np.concatenate(chunks) if chunks else np.empty(0, dtype=COLUMN_DTYPES[name])
+            np.save(os.path.join(self.tmp_path, f'{name}.npy'), column)
+
+        meta = {
+            'format': 'result_store',
+            'version': FORMAT_VERSION,
+            'num_rows': self.num_rows,
+            'num_texts': num_texts,
+            'columns': list(COLUMN_DTYPES),
+            'has_labels': bool(self.num_rows) and all(bool((c != NO_LABEL).all()) for c in self.columns['label']),
+            'has_probabilities': bool(self.num_rows) and all(
+                bool(np.isfinite(c).all()) for c in self.columns['probability']),
+            'source': source or self.source
+        }
+        with open(os.path.join(self.tmp_path, META_NAME), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+        # 目录不能用os.replace覆盖非空目录：旧目录先改名到一旁，新目录就位后再删除
+        old_path = self.path + '.old'
+        if os.path.exists(old_path):
+            shutil.rmtree(old_path)
+        if os.path.exists(self.path):
+            os.replace(self.path, old_path)
+        os.replace(self.tmp_path, self.path)
+        shutil.rmtree(old_path, ignore_errors=True)
+        return self.path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+class ResultStore:
+    """
+    列式结果只读视图，所有列均为memmap
+
+    Attributes:
+        row_ids / labels / predictions / probabilities: 各列数组（labels中-1表示无标签，probabilities中NaN表示无概率）
+    """
+
+    def __init__(self, path: str):
+        if not is_result_store(path):
+            raise FileNotFoundError(f"不是有效的结果存储: {path}")
+        self.path = path
+        with open(os.path.join(path, META_NAME), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self._columns = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in COLUMN_DTYPES}
+        self._texts = _StringTable(path, 'texts')
+        self._responses = _StringTable(path, 'responses')
+
+    def __len__(self) -> int:
+        return self.meta['num_rows']
+
+    @property
+    def row_ids(self) -> np.ndarray:
+        return self._columns['row_id']
+
+    @property
+    def labels(self) -> np.ndarray:
+        return self._columns['label']
+
+    @property
+    def predictions(self) -> np.ndarray:
+        return self._columns['prediction']
+
+    @property
+    def probabilities(self) -> Optional[np.ndarray]:
+        """所有行都有概率时返回概率列，否则返回None"""
+        return self._columns['probability'] if self.meta.get('has_probabilities') else None
+
+    @property
+    def probability_column(self) -> np.ndarray:
+        """完整的概率列，无概率的行为NaN"""
+        return self._columns['probability']
+
+    @property
+    def text_ids(self) -> np.ndarray:
+        """(num_rows, 2) 的文本id，可直接用于按文本分组"""
+        return np.stack([self._columns['text1_id'], self._columns['text2_id']], axis=1)
+
+    def text(self, text_id: int) -> str:
+        return self._texts[int(text_id)]
+
+    def text_pair(self, index: int) -> tuple:
+        return self.text(self._columns['text1_id'][index]), self.text(self._columns['text2_id'][index])
+
+    def response(self, index: int) -> str:
+        return self._responses[int(index)]
+
+    def record(self, index: int) -> Dict[str, Any]:
+        """单行还原为字典（与jsonl结果的字段对应）"""
+        text1, text2 = self.text_pair(index)
+        label = int(self.labels[index])
+        probability = float(self._columns['probability'][index])
+        return {
+            'row_id': int(self.row_ids[index]),
+            'text1': text1,
+            'text2': text2,
+            'label': None if label == NO_LABEL else label,
+            'prediction': int(self.predictions[index]),
+            'probability': None if np.isnan(probability) else probability,
+            'response': self.response(index)
+        }
+
+_TEXT1_PATTERN = re.compile(r'句子1:\s*(.*?)(?:\n|$)', re.DOTALL)
+_TEXT2_PATTERN = re.compile(r'句子2:\s*(.*?)(?:\n|$)', re.DOTALL)
+
+def _texts_from_query(record: Dict) -> tuple:
+    """只在旧结果文件没有对应数据文件时使用：从query中取回两句话"""
+    query = record.get('query', '')
+    text1, text2 = _TEXT1_PATTERN.search(query), _TEXT2_PATTERN.search(query)
+    return (text1.group(1).strip() if text1 else '', text2.group(1).strip() if text2 else '')
+
+def convert_jsonl_to_store(result_file: str, output_path: Optional[str] = None, data_file: Optional[str] = None,
+                           label_file: Optional[str] = None, chunk_size: int = 100_000) -> str:
+    """
+    把jsonl推理结果转换为列式存储
+
+    Args:
+        result_file: swift推理输出的jsonl
+        output_path: 存储目录，默认与结果文件同名的 .store
+        data_file: 与结果逐行对应的原始数据（text1/text2，可含label），提供时不解析query
+        label_file: 标签文件（label字段），优先于data_file中的label
+    """
+    output_path = output_path or store_path_for(result_file)
+    sources = [iter_jsonl_chunks(result_file, chunk_size)]
+    sources.append(iter_jsonl_chunks(data_file, chunk_size) if data_file else iter(()))
+    sources.append(iter_jsonl_chunks(label_file, chunk_size) if label_file else iter(()))
+
+    with ResultStoreWriter(output_path) as writer:
+        writer.source = {'result_file': result_file, 'data_file': data_file, 'label_file': label_file}
+        for records, data, label_records in zip_longest(*sources):
+            if records is None:
+                raise ValueError(f"{result_file} 的行数少于数据/标签文件")
+            if data is not None and len(data) != len(records) or \
+                    label_records is not None and len(label_records) != len(records):
+                raise ValueError(f"{result_file} 与数据/标签文件的行数不一致")
+
+            if data is not None:
+                texts = [(r.get('text1', ''), r.get('text2', '')) for r in data]
+            else:
+                texts = [_texts_from_query(r) for r in records]
+            label_source = label_records if label_records is not None else data
+            labels = [r.get('label') for r in label_source] if label_source is not None \
+                else [r.get('label') for r in records]
+
+            writer.append(
+                text1=[t[0] for t in texts],
+                text2=[t[1] for t in texts],
+                responses=[str(r.get('response', '')) for r in records],
+                predictions=[record_prediction(r) for r in records],
+                probabilities=[record_probability(r) for r in records],
+                labels=[None if v is None else int(v) for v in labels]
+            )
+    return output_path
+
+def _count_jsonl_rows(path: str) -> int:
+    """jsonl的非空行数（与iter_jsonl_chunks的计数一致）"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return sum(1 for line in f if line.strip())
+
+def store_mismatch(store: ResultStore, result_file: str) -> Optional[str]:
+    """
+    检查列式存储是否由该结果文件转换而来且未过期
+
+    依次比较meta中记录的来源文件、结果文件是否在转换后被修改、行数是否一致。
+
+    Returns:
+        不一致的原因；一致时返回None
+    """
+    source_file = store.meta.get('source', {}).get('result_file')
+    if not source_file or os.path.realpath(source_file) != os.path.realpath(result_file):
+        return f"来源为 {source_file}，不是 {result_file}"
+    if os.path.getmtime(result_file) > os.path.getmtime(os.path.join(store.path, META_NAME)):
+        return f"{result_file} 在转换之后被修改"
+    num_rows = _count_jsonl_rows(result_file)
+    if num_rows != len(store):
+        return f"行数不一致: {len(store)} vs {num_rows}"
+    return None
+
+def open_results(path: str) -> ResultStore:
+    """打开结果：传入存储目录或jsonl路径（自动查找同名 .store）"""
+    store_path = path if is_result_store(path) else store_path_for(path)
+    return ResultStore(store_path)
+
+def main():
+    """jsonl结果转换为列式存储"""
+    parser = argparse.ArgumentParser(description="把jsonl推理结果转换为列式存储")
+    parser.add_argument('result_file', help='jsonl推理结果')
+    parser.add_argument('--data-file', default='data/test.jsonl', help='逐行对应的text1/text2文件（不存在时从query解析）')
+    parser.add_argument('--label-file', default=None, help='标签文件（可选）')
+    parser.add_argument('--output', default=None, help='存储目录，默认与结果文件同名的.store')
+    args = parser.parse_args()
+
+    data_file = args.data_file if args.data_file and os.path.exists(args.data_file) else None
+    print(f"🗂️ 转换: {args.result_file}")
+    path = convert_jsonl_to_store(args.result_file, args.output, data_file, args.label_file)
+    store = ResultStore(path)
+    print(f"✅ {len(store)} 行, {store.meta['num_texts']} 条去重文本, "
+          f"标签: {'有' if store.meta['has_labels'] else '无'}, 概率: {'有' if store.meta['has_probabilities'] else '无'}")
+    print(f"📄 已保存: {path}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+金融文本相似度分类竞赛 - 训练中断后按样本精确续训
+每个checkpoint额外保存采样器状态（打乱后的排列、本epoch已消费的位置），
+恢复时直接从断点位置继续取数据，不重放也不跳过样本；
+Trainer自身保存的rng_state.pth负责dropout等随机数状态
+"""
+
+import os
+import copy
+from typing import Dict, Any
+
+import torch
+from torch.utils.data import Sampler
+
+SAMPLER_STATE_NAME = 'sampler_state.pt'
+
+class ResumableSampler(Sampler):
+    """
+    可保存/恢复位置的采样器
+
+    每个epoch用 seed+epoch 生成排列（shuffle=False时为顺序），
+    position由Trainer在真正消费一个批次后推进，不受DataLoader预取影响。
+
+    恢复的断点在Trainer对该epoch调用set_epoch时才生效：此前长度为完整epoch，
+    Trainer据此算出与不中断时相同的max_steps和学习率调度；生效后长度只计剩余部分，
+    Trainer的steps_in_epoch与实际迭代的批次数一致，最后一个不满的累积组照常执行优化步。
+
+    Args:
+        num_samples: 样本（或token预算下的优化步）数量
+        seed: 随机种子
+        shuffle: 是否打乱
+    """
+
+    def __init__(self, num_samples: int, seed: int = 42, shuffle: bool = True):
+        self.num_samples = num_samples
+        self.seed = seed
+        self.shuffle = shuffle
+        self._pending = None
+        self.set_epoch(0)
+
+    def _make_permutation(self, epoch: int) -> torch.Tensor:
+        if not self.shuffle:
+            return torch.arange(self.num_samples)
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + epoch)
+        return torch.randperm(self.num_samples, generator=generator)
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+        self.start = 0
+        self.permutation = self._make_permutation(epoch)
+        if self._pending is not None and self._pending['epoch'] == epoch:
+            self.permutation = self._pending['permutation'].clone()
+            self.start = self._pending['position']
+        if self._pending is not None and epoch >= self._pending['epoch']:
+            self._pending = None
+        self.position = self.start
+
+    def advance(self, num_indices: int):
+        """Trainer消费了num_indices个样本"""
+        self.position = min(self.position + num_indices, self.num_samples)
+
+    def __iter__(self):
+        # 只产出断点之后的部分
+        return iter(self.permutation[self.start:].tolist())
+
+    def __len__(self):
+        # 断点按优化步对齐，剩余批次数对累积步数取余与完整epoch相同
+        return self.num_samples - self.start
+
+    def state_dict(self) -> Dict[str, Any]:
+        return {
+            'epoch': self.epoch,
+            'seed': self.seed,
+            'shuffle': self.shuffle,
+            'num_samples': self.num_samples,
+            'position': self.position,
+            'permutation': self.permutation.clone()
+        }
+
+    def load_state_dict(self, state: Dict[str, Any]):
+        if state['num_samples'] != self.num_samples:
+            raise ValueError(f"采样器样本数不一致: checkpoint为{state['num_samples']}，当前为{self.num_samples}")
+        # Trainer计算完max_steps后会对断点所在epoch调用set_epoch，届时应用
+        self._pending = copy.deepcopy(state)
+
+class ResumableDataTrainerMixin:
+    """
+    Trainer mixin：训练采样器换成ResumableSampler，并随checkpoint保存其状态
+
+    恢复时读取checkpoint中的sampler_state.pt，把ignore_data_skip设为True，
+    由采样器直接从断点位置开始，跳过Trainer逐批重放数据的过程。
+    与token预算mixin组合时，采样单位是整个优化步（计划本身由seed+epoch决定）。
+    """
+
+    def _make_resumable_sampler(self, num_samples: int, shuffle: bool, indices_per_batch: int) -> ResumableSampler:
+        sampler = ResumableSampler(num_samples, self.args.seed, shuffle)
+        resume_state = getattr(self, '_resume_sampler_state', None)
+        if resume_state is not None:
+            sampler.load_state_dict(resume_state)
+        self._resumable_sampler = sampler
+        self._indices_per_batch = indices_per_batch
+        return sampler
+
+    def _get_train_sampler(self, *args, **kwargs):
+        dataset = args[0] if args else kwargs.get('train_dataset')
+        if dataset is None:
+            dataset = self.train_dataset
+        return self._make_resumable_sampler(len(dataset), True, self._train_batch_size)
+
+    def _get_step_sampler(self, step_dataset):
+        # token预算计划已经打乱过，按顺序取步
+        return self._make_resumable_sampler(len(step_dataset), False, 1)
+
+    def training_step(self, model, inputs, *args, **kwargs):
+        sampler = getattr(self, '_resumable_sampler', None)
+        if sampler is not None:
+            sampler.advance(self._indices_per_batch)
+        return super().training_step(model, inputs, *args, **kwargs)
+
+    def extra_checkpoint_state(self) -> Dict[str, Any]:
+        """随checkpoint额外保存的对象（文件名 -> 对象）"""
+        state = getattr(super(), 'extra_checkpoint_state', dict)()
+        sampler = getattr(self, '_resumable_sampler', None)
+        if sampler is not None:
+            state[SAMPLER_STATE_NAME] = sampler.state_dict()
+        return state
+
+    def _save_rng_state(self, output_dir, *args, **kwargs):
+        # 同步保存路径：与rng_state.pth一起写出
+        super()._save_rng_state(output_dir, *args, **kwargs)
+        if self.args.should_save:
+            for name, obj in self.extra_checkpoint_state().items():
+                torch.save(obj, os.path.join(output_dir, name))
+
+    def train(self, resume_from_checkpoint=None, *args, **kwargs):
+        checkpoint = resume_from_checkpoint
+        if isinstance(checkpoint, bool) and checkpoint:
+            from transformers.trainer_utils import get_last_checkpoint
+            checkpoint = get_last_checkpoint(self.args.output_dir)
+
+        self._resume_sampler_state = None
+        if checkpoint and os.path.isfile(os.path.join(checkpoint, SAMPLER_STATE_NAME)):
+            self._resume_sampler_state = torch.load(os.path.join(checkpoint, SAMPLER_STATE_NAME))
+            self.args.ignore_data_skip = True
+            state = self._resume_sampler_state
+            print(f"🔁 从 {checkpoint} 精确恢复数据顺序: epoch {state['epoch']}, "
+                  f"位置 {state['position']}/{state['num_samples']}")
+
+        return super().train(resume_from_checkpoint, *args, **kwargs)
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+金融文本相似度分类竞赛 - Bootstrap置信区间与配对显著性检验
+准确率/F1只取决于各混淆矩阵单元的计数，对样本有放回重抽样等价于对单元计数做多项分布抽样，
+因此一次rng.multinomial就能生成全部重抽样结果，耗时与样本数无关；
+两个结果文件的配对比较在 (真实标签, A预测, B预测) 的8个联合单元上做同样的抽样，另附McNemar检验
+"""
+
+import os
+import json
+import math
+import time
+import argparse
+from typing import Dict, Any, List
+
+import numpy as np
+
+try:
+    from .streaming_eval import iter_jsonl_chunks, record_prediction
+    from .result_store import ResultStore, is_result_store
+except ImportError:
+    from streaming_eval import iter_jsonl_chunks, record_prediction
+    from result_store import ResultStore, is_result_store
+
+# 每块生成的重抽样次数，限制临时内存
+RESAMPLE_CHUNK = 100_000
+
+def _cell_counts(codes: np.ndarray, num_cells: int) -> np.ndarray:
+    return np.bincount(codes, minlength=num_cells).astype(np.int64)
+
+def _resample_cells(cell_counts: np.ndarray, num_resamples: int, seed: int) -> np.ndarray:
+    """
+    按单元计数做多项分布重抽样，返回 (num_resamples, num_cells)
+
+    分块生成，每块使用独立的子种子，结果与分块大小无关地可复现。
+    """
+    n = int(cell_counts.sum())
+    pvals = cell_counts / n
+    children = np.random.SeedSequence(seed).spawn((num_resamples + RESAMPLE_CHUNK - 1) // RESAMPLE_CHUNK)
+    draws = []
+    for i, child in enumerate(children):
+        size = min(RESAMPLE_CHUNK, num_resamples - i * RESAMPLE_CHUNK)
+        draws.append(np.random.default_rng(child).multinomial(n, pvals, size=size))
+    return np.concatenate(draws)
+
+def _f1(tp: np.ndarray, fp: np.ndarray, fn: np.ndarray) -> np.ndarray:
+    denominator = 2 * tp + fp + fn
+    return np.divide(2 * tp, denominator, out=np.zeros(tp.shape, dtype=np.float64), where=denominator > 0)
+
+def metrics_from_cells(cells: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    批量由二分类混淆矩阵单元计算指标
+
+    Args:
+        cells: (..., 4)，依次为 TN, FP, FN, TP（即 真实标签*2 + 预测标签）
+    """
+    tn, fp, fn, tp = (cells[..., i].astype(np.float64) for i in range(4))
+    total = tn + fp + fn + tp
+    f1_1 = _f1(tp, fp, fn)
+    f1_0 = _f1(tn, fn, fp)
+    return {
+        'accuracy': (tp + tn) / total,
+        'f1_class_1': f1_1,
+        'f1_macro': (f1_0 + f1_1) / 2
+    }
+
+def _interval(values: np.ndarray, alpha: float) -> List[float]:
+    low, high = np.quantile(values, [alpha / 2, 1 - alpha / 2])
+    return [float(low), float(high)]
+
+def bootstrap_ci(y_true, y_pred, num_resamples: int = 10_000, alpha: float = 0.05,
+                 seed: int = 0) -> Dict[str, Dict[str, Any]]:
+    """
+    准确率、F1(类别1)、F1(宏)的百分位bootstrap置信区间
+
+    Returns:
+        {指标: {'value', 'ci', 'std'}}
+    """
+    y_true, y_pred = np.asarray(y_true, dtype=np.int64), np.asarray(y_pred, dtype=np.int64)
+    cells = _cell_counts(y_true * 2 + y_pred, 4)
+    observed = metrics_from_cells(cells)
+    resampled = metrics_from_cells(_resample_cells(cells, num_resamples, seed))
+    return {
+        name: {'value': float(observed[name]), 'ci': _interval(values, alpha), 'std': float(values.std())}
+        for name, values in resampled.items()
+    }
+
+def mcnemar_test(a_correct: np.ndarray, b_correct: np.ndarray) -> Dict[str, Any]:
+    """
+    McNemar检验：只看两个模型判断不一致的样本
+
+    不一致样本少于25个时用精确二项检验，否则用带连续性校正的卡方近似。
+    """
+    only_a = int(np.count_nonzero(a_correct & ~b_correct))
+    only_b = int(np.count_nonzero(~a_correct & b_correct))
+    discordant = only_a + only_b
+    if discordant == 0:
+        return {'only_a_correct': only_a, 'only_b_correct': only_b, 'statistic': 0.0,
+                'p_value': 1.0, 'method': 'exact'}
+
+    if discordant < 25:
+        k = min(only_a, only_b)
+        tail = sum(math.comb(discordant, i) for i in range(k + 1)) / 2 ** discordant
+        return {'only_a_correct': only_a, 'only_b_correct': only_b, 'statistic': float(k),
+                'p_value': min(1.0, 2 * tail), 'method': 'exact'}
+
+    statistic = (abs(only_a - only_b) - 1) ** 2 / discordant
+    # 自由度为1的卡方分布生存函数
+    return {'only_a_correct': only_a, 'only_b_correct': only_b, 'statistic': statistic,
+            'p_value': math.erfc(math.sqrt(statistic / 2)), 'method': 'chi2'}
+
+def paired_bootstrap(y_true, pred_a, pred_b, num_resamples: int = 10_000, alpha: float = 0.05,
+                     seed: int = 0) -> Dict[str, Any]:
+    """
+    两个模型在同一测试集上的配对bootstrap比较（B - A）
+
+    每次重抽样两个模型使用相同的样本，p值为以观测差值为中心平移后
+    重抽样差值绝对值不小于观测差值绝对值的比例（双侧）。
+    """
+    y_true = np.asarray(y_true, dtype=np.int64)
+    pred_a, pred_b = np.asarray(pred_a, dtype=np.int64), np.asarray(pred_b, dtype=np.int64)
+    joint = _cell_counts(y_true * 4 + pred_a * 2 + pred_b, 8)
+    resampled = _resample_cells(joint, num_resamples, seed).reshape(-1, 2, 2, 2)
+
+    def model_cells(counts: np.ndarray, axis: int) -> np.ndarray:
+        # 对另一个模型的预测维度求和，得到 (..., 4) 的 TN/FP/FN/TP
+        return counts.sum(axis=axis).reshape(*counts.shape[:-3], 4)
+
+    observed = joint.reshape(2, 2, 2)
+    obs_a, obs_b = metrics_from_cells(model_cells(observed, -1)), metrics_from_cells(model_cells(observed, -2))
+    res_a, res_b = metrics_from_cells(model_cells(resampled, -1)), metrics_from_cells(model_cells(resampled, -2))
+
+    comparison = {}
+    for name in obs_a:
+        delta = float(obs_b[name] - obs_a[name])
+        deltas = res_b[name] - res_a[name]
+        comparison[name] = {
+            'a': float(obs_a[name]),
+            'b': float(obs_b[name]),
+            'delta': delta,
+            'ci': _interval(deltas, alpha),
+            'p_value': float(np.mean(np.abs(deltas - delta) >= abs(delta))),
+            'prob_b_better': float(np.mean(deltas > 0))
+        }
+
+    comparison['mcnemar'] = mcnemar_test(pred_a == y_true, pred_b == y_true)
+    return comparison
+
+def load_label_array(label_file: str, chunk_size: int = 100_000) -> np.ndarray:
+    """读取标签文件（jsonl的label字段）为int8数组"""
+    chunks = [np.fromiter((int(r['label']) for r in chunk), dtype=np.int8, count=len(chunk))
+              for chunk in iter_jsonl_chunks(label_file, chunk_size)]
+    return np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int8)
+
+def load_prediction_array(result_file: str, chunk_size: int = 100_000) -> np.ndarray:
+    """读取结果文件的预测为int8数组（取值规则同evaluate.load_predictions；列式结果直接读预测列）"""
+    if is_result_store(result_file):
+        return np.asarray(ResultStore(result_file).predictions, dtype=np.int8)
+    chunks = [np.fromiter((record_prediction(r) for r in chunk), dtype=np.int8, count=len(chunk))
+              for chunk in iter_jsonl_chunks(result_file, chunk_size)]
+    return np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int8)
+
+def print_ci(name: str, ci: Dict[str, Dict[str, Any]], alpha: float):
+    print(f"📏 {name} ({(1 - alpha) * 100:.0f}% 置信区间):")
+    for metric, row in ci.items():
+        print(f"  • {metric}: {row['value']:.4f} [{row['ci'][0]:.4f}, {row['ci'][1]:.4f}]")
+
+def main():
+    """置信区间 / 配对显著性检验入口"""
+    parser = argparse.ArgumentParser(description="Bootstrap置信区间与配对显著性检验")
+    parser.add_argument('--result-a', required=True, help='结果文件A')
+    parser.add_argument('--result-b', default=None, help='结果文件B（提供时做配对比较）')
+    parser.add_argument('--label-file', default='test_label.jsonl', help='标签文件')
+    parser.add_argument('--num-resamples', type=int, default=10_000, help='重抽样次数')
+    parser.add_argument('--alpha', type=float, default=0.05, help='显著性水平')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    parser.add_argument('--output', default='results/significance.json', help='结果输出路径')
+    args = parser.parse_args()
+
+    print("📐 Bootstrap显著性分析")
+    print("=" * 50)
+    y_true = load_label_array(args.label_file)
+    pred_a = load_prediction_array(args.result_a)
+    if len(pred_a) != len(y_true):
+        print(f"❌ 标签和预测长度不匹配: {len(y_true)} vs {len(pred_a)}")
+        return
+
+    start = time.perf_counter()
+    result: Dict[str, Any] = {'num_samples': len(y_true), 'num_resamples': args.num_resamples, 'alpha': args.alpha}
+    result['a'] = {'result_file': args.result_a,
+                   'ci': bootstrap_ci(y_true, pred_a, args.num_resamples, args.alpha, args.seed)}
+    print_ci(args.result_a, result['a']['ci'], args.alpha)
+
+    if args.result_b:
+        pred_b = load_prediction_array(args.result_b)
+        if len(pred_b) != len(y_true):
+            print(f"❌ 标签和预测长度不匹配: {len(y_true)} vs {len(pred_b)}")
+            return
+        result['b'] = {'result_file': args.result_b,
+                       'ci': bootstrap_ci(y_true, pred_b, args.num_resamples, args.alpha, args.seed)}
+        print_ci(args.result_b, result['b']['ci'], args.alpha)
+        result['paired'] = paired_bootstrap(y_true, pred_a, pred_b, args.num_resamples, args.alpha, args.seed)
+
+        print("\n⚖️ 配对比较 (B - A):")
+        for metric in ('accuracy', 'f1_class_1', 'f1_macro'):
+            row = result['paired'][metric]
+            print(f"  • {metric}: {row['delta']:+.4f} [{row['ci'][0]:+.4f}, {row['ci'][1]:+.4f}], "
+                  f"p={row['p_value']:.4f}")
+        mcnemar = result['paired']['mcnemar']
+        print(f"  • McNemar: 仅A正确 {mcnemar['only_a_correct']}, 仅B正确 {mcnemar['only_b_correct']}, "
+              f"p={mcnemar['p_value']:.4f} ({mcnemar['method']})")
+    result['seconds'] = time.perf_counter() - start
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"📄 结果已保存: {args.output}")
+
+if __name__ == '__main__':
+    main()
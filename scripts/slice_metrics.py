@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+金融文本相似度分类竞赛 - 分片指标
+按产品关键词、文本长度、字符级Jaccard和脱敏标记（***）把样本分片，
+特征列预先算好（可缓存为npz），分组统计用一次bincount完成，
+用于找出哪些片段贡献了最多的错误
+"""
+
+import os
+import json
+import hashlib
+import argparse
+from typing import Dict, Any, List, Optional, Sequence
+
+import numpy as np
+
+try:
+    from .significance import metrics_from_cells
+    from .streaming_eval import iter_jsonl_chunks
+except ImportError:
+    from significance import metrics_from_cells
+    from streaming_eval import iter_jsonl_chunks
+
+# 按优先级排列：一条样本同时出现多个关键词时归入靠前的那个
+PRODUCT_KEYWORDS = ('花呗', '借呗', '余额宝', '网商贷', '备用金', '信用卡', '支付宝', '蚂蚁')
+LENGTH_EDGES = (10, 20, 30, 40, 60)
+JACCARD_EDGES = (0.2, 0.4, 0.6, 0.8)
+MASK_TOKEN = '***'
+# 特征定义变化时递增，旧缓存随之失效
+FEATURE_VERSION = 2
+
+def _bucket_names(edges: Sequence[float], fmt: str, upper: Optional[float] = None) -> List[str]:
+    """区间名称，upper为None时最后一个区间无上界，否则为闭区间"""
+    bounds = ['0'] + [fmt.format(e) for e in edges] + ['∞' if upper is None else fmt.format(upper)]
+    names = [f'[{bounds[i]}, {bounds[i + 1]})' for i in range(len(edges) + 1)]
+    if upper is not None:
+        names[-1] = names[-1][:-1] + ']'
+    return names
+
+def char_jaccard(text1: str, text2: str) -> float:
+    """字符级Jaccard相似度（同utils.calculate_text_similarity的jaccard_char）"""
+    set1, set2 = set(text1), set(text2)
+    union = len(set1 | set2)
+    return len(set1 & set2) / union if union else 0.0
+
+def compute_feature_columns(text1: List[str], text2: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    计算分片用的特征列，每列为整数编码加各编码对应的名称
+
+    Returns:
+        {特征名: {'codes': int数组, 'names': [编码名称]}}
+    """
+    n = len(text1)
+
+    # 产品：从后往前覆盖，最终保留优先级最高的关键词；
+    # 关键词分别在两句中查找，不拼接，避免跨越句子边界误匹配
+    product = np.full(n, len(PRODUCT_KEYWORDS), dtype=np.int64)
+    for code in range(len(PRODUCT_KEYWORDS) - 1, -1, -1):
+        keyword = PRODUCT_KEYWORDS[code]
+        product[np.fromiter((keyword in a or keyword in b for a, b in zip(text1, text2)),
+                            dtype=bool, count=n)] = code
+
+    length = np.fromiter((len(a) + len(b) for a, b in zip(text1, text2)), dtype=np.int64, count=n)
+    jaccard = np.fromiter((char_jaccard(a, b) for a, b in zip(text1, text2)), dtype=np.float64, count=n)
+    masked = np.fromiter((MASK_TOKEN in a or MASK_TOKEN in b for a, b in zip(text1, text2)),
+                         dtype=np.int64, count=n)
+
+    return {
+        'product': {'codes': product, 'names': list(PRODUCT_KEYWORDS) + ['其他']},
+        'length': {'codes': np.searchsorted(LENGTH_EDGES, length, side='right'),
+                   'names': _bucket_names(LENGTH_EDGES, '{}')},
+        'jaccard_char': {'codes': np.searchsorted(JACCARD_EDGES, jaccard, side='right'),
+                         'names': _bucket_names(JACCARD_EDGES, '{:.1f}', upper=1.0)},
+        'masked': {'codes': masked, 'names': ['无***', '含***']}
+    }
+
+def _fingerprint(text1: List[str], text2: List[str]) -> str:
+    digest = hashlib.sha1()
+    for a, b in zip(text1, text2):
+        digest.update(a.encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(b.encode('utf-8'))
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+def get_or_compute_features(text1: List[str], text2: List[str],
+                            cache_path: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """特征列带缓存：npz中保存各列编码，json中保存名称和文本指纹"""
+    if cache_path is None:
+        return compute_feature_columns(text1, text2)
+
+    meta_path = os.path.splitext(cache_path)[0] + '.json'
+    fingerprint = _fingerprint(text1, text2)
+    if os.path.exists(cache_path) and os.path.exists(meta_path):
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('fingerprint') == fingerprint and meta.get('version') == FEATURE_VERSION:
+            arrays = np.load(cache_path)
+            return {name: {'codes': arrays[name], 'names': names} for name, names in meta['names'].items()}
+
+    features = compute_feature_columns(text1, text2)
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    np.savez(cache_path, **{name: f['codes'] for name, f in features.items()})
+    # 元信息最后写入，存在即代表缓存完整
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump({'fingerprint': fingerprint, 'version': FEATURE_VERSION, 'num_samples': len(text1),
+                   'names': {name: f['names'] for name, f in features.items()}}, f, ensure_ascii=False)
+    return features
+
+def group_metrics(codes: np.ndarray, names: List[str], y_true: np.ndarray, y_pred: np.ndarray) -> List[Dict[str, Any]]:
+    """
+    一次bincount得到每个分组的TN/FP/FN/TP，再批量推出各组指标
+
+    error_share为该组错误占全部错误的比例，error_lift为该组错误率相对整体错误率的倍数。
+    """
+    num_groups = len(names)
+    cells = np.bincount(codes * 4 + y_true * 2 + y_pred, minlength=num_groups * 4).reshape(num_groups, 4)
+    counts = cells.sum(axis=1)
+    errors = cells[:, 1] + cells[:, 2]
+    overall_rate = errors.sum() / max(counts.sum(), 1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        metrics = metrics_from_cells(cells)
+
+    rows = []
+    for g in np.flatnonzero(counts):
+        rate = errors[g] / counts[g]
+        rows.append({
+            'slice': names[g],
+            'count': int(counts[g]),
+            'errors': int(errors[g]),
+            'FP': int(cells[g, 1]),
+            'FN': int(cells[g, 2]),
+            'positive_rate': float((cells[g, 2] + cells[g, 3]) / counts[g]),
+            'accuracy': float(metrics['accuracy'][g]),
+            'f1_macro': float(metrics['f1_macro'][g]),
+            'error_rate': float(rate),
+            'error_share': float(errors[g] / errors.sum()) if errors.sum() else 0.0,
+            'error_lift': float(rate / overall_rate) if overall_rate else 0.0
+        })
+    return sorted(rows, key=lambda r: r['errors'], reverse=True)
+
+def compute_slice_metrics(features: Dict[str, Dict[str, Any]], y_true, y_pred) -> Dict[str, List[Dict[str, Any]]]:
+    """对每个特征列分别分组统计"""
+    y_true = np.asarray(y_true, dtype=np.int64)
+    y_pred = np.asarray(y_pred, dtype=np.int64)
+    return {name: group_metrics(np.asarray(f['codes'], dtype=np.int64), f['names'], y_true, y_pred)
+            for name, f in features.items()}
+
+def print_slice_report(report: Dict[str, List[Dict[str, Any]]]):
+    """打印各特征的分片指标"""
+    for name, rows in report.items():
+        print(f"\n🧩 {name}")
+        print(f"{'分片':<14}{'样本数':>10}{'错误':>8}{'错误率':>9}{'错误占比':>10}{'倍数':>7}{'准确率':>9}")
+        for row in rows:
+            print(f"{row['slice']:<14}{row['count']:>10}{row['errors']:>8}{row['error_rate']:>9.3f}"
+                  f"{row['error_share']:>10.3f}{row['error_lift']:>7.2f}{row['accuracy']:>9.3f}")
+
+def main():
+    """分片指标入口"""
+    try:
+        from .significance import load_label_array, load_prediction_array
+        from .result_store import ResultStore, is_result_store
+    except ImportError:
+        from significance import load_label_array, load_prediction_array
+        from result_store import ResultStore, is_result_store
+
+    parser = argparse.ArgumentParser(description="按产品/长度/相似度/脱敏标记的分片指标")
+    parser.add_argument('--result-file', default='results/enhanced_result.jsonl', help='预测结果文件（jsonl或列式结果目录）')
+    parser.add_argument('--label-file', default='test_label.jsonl', help='标签文件')
+    parser.add_argument('--data-file', default='data/test.jsonl', help='与标签逐行对应的text1/text2文件')
+    parser.add_argument('--feature-cache', default='results/slice_features.npz', help='特征列缓存，传空字符串关闭')
+    parser.add_argument('--output', default='evaluation_results/slice_metrics.json', help='结果输出路径')
+    args = parser.parse_args()
+
+    print("🧩 分片指标分析")
+    print("=" * 50)
+    text1, text2 = [], []
+    if is_result_store(args.result_file):
+        # 列式结果自带文本，按文本id还原
+        store = ResultStore(args.result_file)
+        ids = store.text_ids
+        text1 = [store.text(i) for i in ids[:, 0]]
+        text2 = [store.text(i) for i in ids[:, 1]]
+    else:
+        for chunk in iter_jsonl_chunks(args.data_file, 100_000):
+            text1.extend(r.get('text1', '') for r in chunk)
+            text2.extend(r.get('text2', '') for r in chunk)
+    y_true = load_label_array(args.label_file)
+    y_pred = load_prediction_array(args.result_file)
+    if not (len(text1) == len(y_true) == len(y_pred)):
+        print(f"❌ 文本/标签/预测长度不匹配: {len(text1)} / {len(y_true)} / {len(y_pred)}")
+        return
+
+    features = get_or_compute_features(text1, text2, args.feature_cache or None)
+    report = compute_slice_metrics(features, y_true, y_pred)
+    print_slice_report(report)
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n📄 结果已保存: {args.output}")
+
+if __name__ == '__main__':
+    main()
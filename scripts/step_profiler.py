@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+金融文本相似度分类竞赛 - 训练步耗时分解
+TrainerCallback：逐步记录数据等待、前向、反向、优化器、checkpoint保存耗时，
+以及tokens/sec、padding比例和峰值显存，写入输出目录下的JSONL；
+可选在指定步区间内采集torch.profiler的Chrome trace
+"""
+
+import os
+import json
+import time
+import resource
+from typing import Dict, Any, List, Optional, Callable
+
+import torch
+from transformers import TrainerCallback
+
+GB = 1024 ** 3
+
+def forward_modules(model: torch.nn.Module) -> List[torch.nn.Module]:
+    """
+    需要挂前向hook的模块：顶层模型，以及去掉DDP/PEFT包装后的主干（.model）
+
+    packing等路径绕过顶层forward直接调用主干，只挂在顶层时这些前向统计不到。
+    """
+    modules = [model]
+    base = model
+    while hasattr(base, 'module'):
+        base = base.module
+    if hasattr(base, 'get_base_model'):
+        base = base.get_base_model()
+    backbone = getattr(base, 'model', None)
+    if isinstance(backbone, torch.nn.Module) and all(backbone is not m for m in modules):
+        modules.append(backbone)
+    return modules
+
+def count_tokens(args, kwargs) -> Optional[Dict[str, int]]:
+    """
+    前向输入的 {总token, 有效token, 行数}，没有input_ids时返回None
+
+    2D attention_mask直接求和；packing的4D掩码无法区分padding，改由position_ids推断：
+    每个样本的位置从0递增，行尾padding的位置都是0，只有后面紧跟位置1的0才是样本开头。
+    """
+    input_ids = kwargs.get('input_ids', args[0] if args else None)
+    if not isinstance(input_ids, torch.Tensor):
+        return None
+    attention_mask = kwargs.get('attention_mask')
+    position_ids = kwargs.get('position_ids')
+    if isinstance(attention_mask, torch.Tensor) and attention_mask.dim() == 2:
+        real = int(attention_mask.sum())
+    elif isinstance(position_ids, torch.Tensor) and position_ids.shape == input_ids.shape:
+        starts = (position_ids[..., :-1] == 0) & (position_ids[..., 1:] == 1)
+        real = int((position_ids > 0).sum() + starts.sum())
+    else:
+        real = input_ids.numel()
+    return {'tokens': input_ids.numel(), 'real_tokens': real,
+            'rows': input_ids.shape[0] if input_ids.dim() > 1 else 1}
+
+class TrainingForwardHooks:
+    """
+    在forward_modules返回的嵌套模块上注册hook，每次训练前向只回调一次
+
+    只响应最外层的前向（顶层调用主干时不重复计数），跳过评估等module.training为False的前向。
+
+    Args:
+        model: 训练的模型
+        on_start: 前向开始时调用 on_start(args, kwargs)
+        on_end: 前向结束时调用 on_end()
+    """
+
+    def __init__(self, model: torch.nn.Module, on_start: Callable, on_end: Optional[Callable] = None):
+        self.on_start = on_start
+        self.on_end = on_end
+        self._depth = 0
+        self._active = False
+        self._handles = []
+        for module in forward_modules(model):
+            self._handles.append(module.register_forward_pre_hook(self._pre_hook, with_kwargs=True))
+            self._handles.append(module.register_forward_hook(self._post_hook, with_kwargs=True))
+
+    def _pre_hook(self, module, args, kwargs):
+        self._depth += 1
+        if self._depth == 1 and module.training:
+            self._active = True
+            self.on_start(args, kwargs)
+
+    def _post_hook(self, module, args, kwargs, output):
+        self._depth = max(self._depth - 1, 0)
+        if self._depth == 0 and self._active:
+            self._active = False
+            if self.on_end is not None:
+                self.on_end()
+
+    def reset(self):
+        """前向中途抛出异常时嵌套深度可能残留，每步开始时清零"""
+        self._depth = 0
+        self._active = False
+
+    def remove(self):
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+
+class StepProfilerCallback(TrainerCallback):
+    """
+    逐步耗时分解
+
+    计时口径：
+        data_wait: 上一步结束到本步开始（新版Trainer在步开始前取齐整个梯度累积组的数据）
+        forward: 训练前向的累计耗时（梯度累积时为多次前向之和；packing直接调用主干时计主干前向）
+        backward: 步开始到优化器前的耗时减去前向，旧版Trainer中也包含步内取数据的时间
+        optimizer: on_pre_optimizer_step到on_optimizer_step（旧版transformers没有这两个事件时为None）
+        save: 步结束到on_save，包含同一步内的评估和日志
+
+    Args:
+        output_file: JSONL路径，默认为 output_dir/step_profile.jsonl
+        synchronize: 计时前同步CUDA，保证各阶段耗时准确（有少量开销）
+        trace_start_step: 从该步开始采集torch.profiler trace，None表示不采集
+        trace_num_steps: 采集的步数
+        extra_metric_fns: 每步调用并合并进记录的指标函数（如torch.compile的重编译计数）
+    """
+
+    def __init__(self, output_file: Optional[str] = None, synchronize: bool = True,
+                 trace_start_step: Optional[int] = None, trace_num_steps: int = 3,
+                 extra_metric_fns: Optional[List[Callable[[], Dict[str, Any]]]] = None):
+        self.output_file = output_file
+        self.synchronize = synchronize
+        self.trace_start_step = trace_start_step
+        self.trace_num_steps = trace_num_steps
+        self.extra_metric_fns = extra_metric_fns or []
+
+        self._file = None
+        self._hooks: Optional[TrainingForwardHooks] = None
+        self._profiler = None
+        self._pending = None
+        self._last_step_end = None
+        self._data_wait = 0.0
+        self._reset_step()
+
+    def _now(self) -> float:
+        if self.synchronize and torch.cuda.is_available():
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def _reset_step(self):
+        self._step_start = None
+        self._forward_start = None
+        self._forward_seconds = 0.0
+        self._pre_optimizer = None
+        self._optimizer_seconds = None
+        self._tokens = 0
+        self._real_tokens = 0
+
+    def _forward_start_hook(self, args, kwargs):
+        counts = count_tokens(args, kwargs)
+        if counts is not None:
+            self._tokens += counts['tokens']
+            self._real_tokens += counts['real_tokens']
+        self._forward_start = self._now()
+
+    def _forward_end_hook(self):
+        if self._forward_start is not None:
+            self._forward_seconds += self._now() - self._forward_start
+            self._forward_start = None
+
+    def _peak_memory_gb(self) -> float:
+        if torch.cuda.is_available():
+            return torch.cuda.max_memory_allocated() / GB
+        # CPU上只能取进程生命周期内的常驻内存峰值（Linux单位为KB）
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 ** 2
+
+    def _write(self, record: Dict[str, Any]):
+        if self._file is not None:
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._file.flush()
+
+    def _flush_pending(self):
+        if self._pending is not None:
+            self._write(self._pending)
+            self._pending = None
+
+    def extra_metrics(self) -> Dict[str, Any]:
+        """供子类或其他组件追加到每步记录中的指标"""
+        metrics = {}
+        for fn in self.extra_metric_fns:
+            metrics.update(fn())
+        return metrics
+
+    def on_train_begin(self, args, state, control, model=None, **kwargs):
+        if state.is_world_process_zero:
+            path = self.output_file or os.path.join(args.output_dir, 'step_profile.jsonl')
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self._file = open(path, 'a', encoding='utf-8')
+            print(f"⏱️ 训练步耗时分解写入: {path}")
+
+        if model is not None:
+            self._hooks = TrainingForwardHooks(model, self._forward_start_hook, self._forward_end_hook)
+        self._last_step_end = self._now()
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        self._flush_pending()
+        now = self._now()
+        self._reset_step()
+        if self._hooks is not None:
+            self._hooks.reset()
+        self._step_start = now
+        self._data_wait = now - self._last_step_end if self._last_step_end is not None else 0.0
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+
+        step = state.global_step + 1
+        if (self.trace_start_step is not None and self._profiler is None
+                and step == self.trace_start_step and state.is_world_process_zero):
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self._profiler = torch.profiler.profile(activities=activities, record_shapes=True)
+            self._profiler.start()
+            self._trace_dir = args.output_dir
+
+    def on_pre_optimizer_step(self, args, state, control, **kwargs):
+        self._pre_optimizer = self._now()
+
+    def on_optimizer_step(self, args, state, control, **kwargs):
+        if self._pre_optimizer is not None:
+            self._optimizer_seconds = self._now() - self._pre_optimizer
+
+    def on_step_end(self, args, state, control, **kwargs):
+        now = self._now()
+        if self._step_start is None:
+            return
+
+        step_seconds = now - self._step_start
+        before_optimizer = (self._pre_optimizer or now) - self._step_start
+        record = {
+            'step': state.global_step,
+            'step_seconds': step_seconds,
+            'data_wait_seconds': self._data_wait,
+            'forward_seconds': self._forward_seconds,
+            'backward_seconds': max(before_optimizer - self._forward_seconds, 0.0),
+            'optimizer_seconds': self._optimizer_seconds,
+            'save_seconds': 0.0,
+            'tokens': self._tokens,
+            'tokens_per_second': self._tokens / step_seconds if step_seconds > 0 else 0.0,
+            'padding_ratio': 1 - self._real_tokens / self._tokens if self._tokens else 0.0,
+            'peak_memory_gb': self._peak_memory_gb(),
+        }
+        record.update(self.extra_metrics())
+        # 等到下一步开始（或训练结束）再写出，以便补上本步的checkpoint保存耗时
+        self._pending = record
+        self._last_step_end = now
+
+        if self._profiler is not None:
+            self._profiler.step()
+            if state.global_step >= self.trace_start_step + self.trace_num_steps - 1:
+                self._stop_trace()
+
+    def on_save(self, args, state, control, **kwargs):
+        if self._pending is not None and self._last_step_end is not None:
+            self._pending['save_seconds'] = self._now() - self._last_step_end
+        # 保存时间不计入下一步的数据等待
+        self._last_step_end = self._now()
+
+    def _stop_trace(self):
+        self._profiler.stop()
+        path = os.path.join(self._trace_dir, f'profile_trace_step{self.trace_start_step}.json')
+        self._profiler.export_chrome_trace(path)
+        print(f"📈 Chrome trace已保存: {path}")
+        self._profiler = None
+
+    def on_train_end(self, args, state, control, **kwargs):
+        self._flush_pending()
+        if self._profiler is not None:
+            self._stop_trace()
+        if self._hooks is not None:
+            self._hooks.remove()
+            self._hooks = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
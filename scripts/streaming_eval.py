@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+金融文本相似度分类竞赛 - 流式评估
+逐块同时读取预测文件和标签文件，更新可合并的混淆矩阵计数、有界的错误样本蓄水池
+和在线的滑动窗口错误率，内存占用与文件大小无关
+"""
+
+import os
+import re
+import json
+import time
+import argparse
+from itertools import islice, zip_longest
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    from .metrics import ConfusionCounts
+except ImportError:
+    from metrics import ConfusionCounts
+
+_TEXT1_PATTERN = re.compile(r'句子1:\s*(.*?)(?:\n|$)', re.DOTALL)
+_TEXT2_PATTERN = re.compile(r'句子2:\s*(.*?)(?:\n|$)', re.DOTALL)
+
+def iter_jsonl_chunks(path: str, chunk_size: int) -> Iterator[List[Dict]]:
+    """按块读取jsonl（跳过空行），每块最多chunk_size条"""
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = (line for line in f if line.strip())
+        while True:
+            chunk = [json.loads(line) for line in islice(lines, chunk_size)]
+            if not chunk:
+                return
+            yield chunk
+
+def record_prediction(record: Dict) -> int:
+    """与evaluate.load_predictions相同的取值规则：response为0/1，否则取prediction字段，都没有时记为0"""
+    response = str(record.get('response', '')).strip()
+    if response in ('0', '1'):
+        return int(response)
+    prediction = record.get('prediction')
+    return int(prediction) if prediction is not None else 0
+
+class ErrorReservoir:
+    """
+    错误样本的均匀蓄水池，最多保留capacity个
+
+    每个错误样本分配一个均匀随机键，只保留键最小的capacity个，
+    等价于对全部错误做无放回均匀抽样；两个蓄水池合并后仍保留最小的capacity个键，结果同样均匀。
+    只有键小于当前门槛的候选才会构造样本详情。
+    """
+
+    def __init__(self, capacity: int = 50, seed: int = 0):
+        self.capacity = capacity
+        self.rng = np.random.default_rng(seed)
+        self.keys = np.empty(0, dtype=np.float64)
+        self.samples: List[Dict] = []
+
+    def _threshold(self) -> float:
+        return self.keys.max() if len(self.keys) >= self.capacity else np.inf
+
+    def _keep(self, keys: np.ndarray, samples: List[Dict]):
+        if len(keys) > self.capacity:
+            order = np.argpartition(keys, self.capacity - 1)[:self.capacity]
+            keys, samples = keys[order], [samples[i] for i in order]
+        self.keys, self.samples = keys, samples
+
+    def add(self, positions: np.ndarray, build_sample) -> None:
+        """
+        Args:
+            positions: 本块内的错误位置
+            build_sample: 位置 -> 样本详情，只对入选的候选调用
+        """
+        if self.capacity <= 0 or len(positions) == 0:
+            return
+        keys = self.rng.random(len(positions))
+        selected = np.flatnonzero(keys < self._threshold())
+        if len(selected) > self.capacity:
+            selected = selected[np.argpartition(keys[selected], self.capacity - 1)[:self.capacity]]
+        self._keep(np.concatenate([self.keys, keys[selected]]),
+                   self.samples + [build_sample(int(positions[i])) for i in selected])
+
+    def merge(self, other: 'ErrorReservoir') -> 'ErrorReservoir':
+        self._keep(np.concatenate([self.keys, other.keys]), self.samples + other.samples)
+        return self
+
+    def sorted_samples(self) -> List[Dict]:
+        return sorted(self.samples, key=lambda s: s['index'])
+
+class WindowedErrorRate:
+    """
+    在线的分窗错误率（与evaluate.plot_error_analysis相同，按不重叠的固定窗口统计）
+
+    窗口数超过max_points时相邻窗口两两合并、窗口大小翻倍，
+    因此无论样本多少，保存的点数都不超过max_points。
+    """
+
+    def __init__(self, window: int = 100, max_points: int = 2048):
+        self.window = window
+        self.max_points = max_points
+        self.window_errors: List[int] = []
+        self._pending = np.empty(0, dtype=np.int64)
+
+    def update(self, errors: np.ndarray):
+        """errors: 本块每个样本是否出错（按原始顺序）"""
+        errors = np.concatenate([self._pending, errors.astype(np.int64)])
+        full = len(errors) // self.window * self.window
+        if full:
+            self.window_errors.extend(errors[:full].reshape(-1, self.window).sum(axis=1).tolist())
+        self._pending = errors[full:]
+        while len(self.window_errors) > self.max_points:
+            self._coarsen()
+
+    def _coarsen(self):
+        counts = self.window_errors
+        if len(counts) % 2:
+            # 落单的最后一个窗口放回未满窗口的缓冲区
+            self._pending = np.concatenate([np.ones(counts[-1], dtype=np.int64),
+                                            np.zeros(self.window - counts[-1], dtype=np.int64),
+                                            self._pending])
+            counts = counts[:-1]
+        self.window_errors = [counts[i] + counts[i + 1] for i in range(0, len(counts), 2)]
+        self.window *= 2
+
+    def rates(self) -> Dict[str, Any]:
+        """各窗口错误率（最后不满一个窗口的部分单独作为一个点）"""
+        rates = [count / self.window for count in self.window_errors]
+        if len(self._pending):
+            rates.append(float(self._pending.mean()))
+        return {'window_size': self.window, 'error_rates': rates}
+
+class StreamingEvaluator:
+    """
+    流式评估状态：混淆矩阵计数 + 错误样本蓄水池 + 分窗错误率
+
+    计数和蓄水池可以跨分片合并（merge），分窗错误率依赖样本顺序，只在单个流内累计。
+    """
+
+    def __init__(self, reservoir_size: int = 50, window: int = 100, max_points: int = 2048, seed: int = 0):
+        self.counts = ConfusionCounts(2)
+        self.reservoir = ErrorReservoir(reservoir_size, seed)
+        self.windows = WindowedErrorRate(window, max_points)
+        self.num_samples = 0
+
+    def update(self, y_true: np.ndarray, y_pred: np.ndarray, records: Optional[List[Dict]] = None):
+        """累加一块（y_true/y_pred为同长度数组，records为对应的预测记录，用于错误样本详情）"""
+        offset = self.num_samples
+        self.counts.update(y_true, y_pred)
+        errors = y_true != y_pred
+        self.windows.update(errors)
+
+        def build_sample(pos: int) -> Dict:
+            true, pred = int(y_true[pos]), int(y_pred[pos])
+            sample = {
+                'index': offset + pos,
+                'true_label': true,
+                'pred_label': pred,
+                'error_type': 'FP' if true == 0 else 'FN'
+            }
+            if records is not None:
+                query = records[pos].get('query', '')
+                text1, text2 = _TEXT1_PATTERN.search(query), _TEXT2_PATTERN.search(query)
+                if text1 and text2:
+                    sample['text1'] = text1.group(1).strip()
+                    sample['text2'] = text2.group(1).strip()
+            return sample
+
+        self.reservoir.add(np.flatnonzero(errors), build_sample)
+        self.num_samples += len(y_true)
+
+    def merge(self, other: 'StreamingEvaluator') -> 'StreamingEvaluator':
+        self.counts.merge(other.counts)
+        self.reservoir.merge(other.reservoir)
+        self.num_samples += other.num_samples
+        return self
+
+    def report(self) -> Dict[str, Any]:
+        """与evaluate.save_evaluation_report相同结构的报告，另附分窗错误率"""
+        cm = self.counts.counts
+        total_errors = int(cm[0, 1] + cm[1, 0])
+        metrics = self.counts.metrics()
+        return {
+            'evaluation_summary': {
+                'total_samples': self.num_samples,
+                'accuracy': metrics.get('accuracy', 0)
+            },
+            'metrics': metrics,
+            'error_analysis': {
+                'total_errors': total_errors,
+                'error_rate': total_errors / self.num_samples if self.num_samples else 0,
+                'error_types': {'FP': int(cm[0, 1]), 'FN': int(cm[1, 0]), 'other': 0},
+                'windowed_error_rate': self.windows.rates()
+            }
+        }
+
+def evaluate_files(result_file: str, label_file: str, chunk_size: int = 100_000,
+                   reservoir_size: int = 50, window: int = 100, seed: int = 0) -> Tuple[Dict[str, Any], List[Dict]]:
+    """
+    流式评估一个结果文件
+
+    Returns:
+        (报告, 错误样本)
+
+    Raises:
+        ValueError: 两个文件的行数不一致
+    """
+    evaluator = StreamingEvaluator(reservoir_size, window, seed=seed)
+    predictions = iter_jsonl_chunks(result_file, chunk_size)
+    labels = iter_jsonl_chunks(label_file, chunk_size)
+
+    start = time.perf_counter()
+    for records, label_records in zip_longest(predictions, labels):
+        # 一侧先读完时另一侧这一块已被取出，只能在这里判断
+        if records is None or label_records is None or len(records) != len(label_records):
+            raise ValueError(f"标签和预测长度不匹配（第{evaluator.num_samples}行之后）")
+        y_pred = np.fromiter((record_prediction(r) for r in records), dtype=np.int64, count=len(records))
+        y_true = np.fromiter((int(r['label']) for r in label_records), dtype=np.int64, count=len(label_records))
+        evaluator.update(y_true, y_pred, records)
+    elapsed = time.perf_counter() - start
+
+    report = evaluator.report()
+    report['evaluation_summary'].update({
+        'result_file': result_file,
+        'label_file': label_file,
+        'evaluation_seconds': elapsed,
+        'samples_per_second': evaluator.num_samples / elapsed if elapsed > 0 else 0
+    })
+    return report, evaluator.reservoir.sorted_samples()
+
+def main():
+    """流式评估入口"""
+    parser = argparse.ArgumentParser(description="流式评估大规模预测文件")
+    parser.add_argument('--result-file', default='results/enhanced_result.jsonl', help='预测结果文件(jsonl)')
+    parser.add_argument('--label-file', default='test_label.jsonl', help='标签文件(jsonl，含label字段)')
+    parser.add_argument('--chunk-size', type=int, default=100_000, help='每块行数')
+    parser.add_argument('--reservoir-size', type=int, default=50, help='随机保留的错误样本数')
+    parser.add_argument('--window-size', type=int, default=100, help='错误率窗口大小（初始值）')
+    parser.add_argument('--seed', type=int, default=0, help='蓄水池抽样种子')
+    parser.add_argument('--output-dir', default='evaluation_results', help='输出目录')
+    args = parser.parse_args()
+
+    print("📊 流式评估")
+    print("=" * 50)
+    for path in (args.result_file, args.label_file):
+        if not os.path.exists(path):
+            print(f"❌ 找不到文件: {path}")
+            return
+
+    try:
+        report, error_samples = evaluate_files(args.result_file, args.label_file, args.chunk_size,
+                                               args.reservoir_size, args.window_size, args.seed)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return
+
+    summary, errors = report['evaluation_summary'], report['error_analysis']
+    print(f"✅ 样本数: {summary['total_samples']:,} ({summary['samples_per_second']:,.0f} 条/s)")
+    print(f"🎯 准确率: {summary['accuracy']:.4f}, F1(宏): {report['metrics'].get('f1_macro', 0):.4f}")
+    print(f"❌ 错误: {errors['total_errors']} (FP {errors['error_types']['FP']}, FN {errors['error_types']['FN']})")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    report_path = os.path.join(args.output_dir, 'evaluation_report.json')
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    samples_path = os.path.join(args.output_dir, 'error_samples.json')
+    with open(samples_path, 'w', encoding='utf-8') as f:
+        json.dump(error_samples, f, ensure_ascii=False, indent=2)
+
+    print("📄 评估报告已保存:")
+    print(f"  • 完整报告: {report_path}")
+    print(f"  • 错误样本: {samples_path}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+金融文本相似度分类竞赛 - 按token预算动态梯度累积
+每个优化步固定看到相同数量的样本，但步内按token预算把样本装进尽量少的micro-batch，
+取代per_device_train_batch_size=1 + 大梯度累积的大量小前向
+"""
+
+import random
+from typing import Dict, Any, List, Callable, Optional
+
+import torch
+from torch.utils.data import Dataset, DataLoader
+
+def plan_token_budget_steps(lengths: List[int], examples_per_step: int, max_tokens: int,
+                            seed: int = 42, packed: bool = False) -> List[List[List[int]]]:
+    """
+    生成一个epoch的训练计划
+
+    先打乱样本并按examples_per_step切成优化步（保证每步样本数固定、组成随机），
+    再在步内按长度排序，贪心装入token预算内的micro-batch。
+
+    Args:
+        lengths: 每个样本的token长度
+        examples_per_step: 每个优化步的样本数
+        max_tokens: 每个micro-batch的token预算
+        seed: 随机种子（每个epoch传入不同的种子）
+        packed: True时按实际token数计费（配合打包collator），否则按padding后的 最长长度×样本数 计费
+
+    Returns:
+        plan[步][micro-batch] = 样本下标列表
+    """
+    order = list(range(len(lengths)))
+    random.Random(seed).shuffle(order)
+
+    plan = []
+    for start in range(0, len(order), examples_per_step):
+        step = sorted(order[start:start + examples_per_step], key=lambda i: lengths[i])
+        micro_batches, current, longest, total = [], [], 0, 0
+        for i in step:
+            new_longest = max(longest, lengths[i])
+            cost = total + lengths[i] if packed else new_longest * (len(current) + 1)
+            if current and cost > max_tokens:
+                micro_batches.append(current)
+                current, longest, total = [], 0, 0
+                new_longest = lengths[i]
+            current.append(i)
+            longest, total = new_longest, total + lengths[i]
+        if current:
+            micro_batches.append(current)
+        plan.append(micro_batches)
+
+    return plan
+
+def summarize_plan(plan: List[List[List[int]]], lengths: List[int], packed: bool = False) -> Dict[str, float]:
+    """统计计划的micro-batch数量和padding比例"""
+    num_micro = sum(len(step) for step in plan)
+    real_tokens = sum(lengths[i] for step in plan for micro in step for i in micro)
+    if packed:
+        computed_tokens = real_tokens
+    else:
+        computed_tokens = sum(max(lengths[i] for i in micro) * len(micro) for step in plan for micro in step)
+
+    return {
+        'num_steps': len(plan),
+        'micro_batches_per_step': num_micro / max(len(plan), 1),
+        'examples_per_micro_batch': sum(len(m) for s in plan for m in s) / max(num_micro, 1),
+        'padding_ratio': 1 - real_tokens / max(computed_tokens, 1)
+    }
+
+class TokenBudgetStepDataset(Dataset):
+    """每个元素是一个优化步：已经collate好的micro-batch列表"""
+
+    def __init__(self, dataset: Dataset, lengths: List[int], collate_fn: Callable,
+                 examples_per_step: int, max_tokens: int, seed: int = 42, packed: bool = False):
+        self.dataset = dataset
+        self.lengths = lengths
+        self.collate_fn = collate_fn
+        self.examples_per_step = examples_per_step
+        self.max_tokens = max_tokens
+        self.seed = seed
+        self.packed = packed
+        self.set_epoch(0)
+
+    def set_epoch(self, epoch: int):
+        """每个epoch重新打乱并生成计划，步数保持不变"""
+        self.plan = plan_token_budget_steps(self.lengths, self.examples_per_step, self.max_tokens,
+                                            self.seed + epoch, self.packed)
+
+    def __len__(self):
+        return len(self.plan)
+
+    def __getitem__(self, idx):
+        micro_batches = [
+            self.collate_fn([self.dataset[i] for i in micro]) for micro in self.plan[idx]
+        ]
+        return {
+            'micro_batches': micro_batches,
+            'num_examples': sum(len(micro) for micro in self.plan[idx])
+        }
+
+class StepPlanDataLoader(DataLoader):
+    """把Trainer的set_epoch转发给计划数据集"""
+
+    def set_epoch(self, epoch: int):
+        self.dataset.set_epoch(epoch)
+        if hasattr(self.sampler, 'set_epoch'):
+            self.sampler.set_epoch(epoch)
+
+class TokenBudgetTrainerMixin:
+    """
+    Trainer mixin：数据加载器每次产出一个完整优化步，training_step在内部完成累积
+
+    TrainingArguments中gradient_accumulation_steps需设为1。
+    loss按样本数加权：每个micro-batch的平均loss乘以 micro样本数/步样本数，
+    与一次性在整步样本上求平均完全等价。
+
+    Args:
+        token_budget: {'lengths', 'examples_per_step', 'max_tokens', 'packed'}
+    """
+
+    def __init__(self, *args, token_budget: Optional[Dict[str, Any]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.token_budget = token_budget
+
+    def _get_step_sampler(self, step_dataset):
+        """按优化步取数据的采样器，None表示顺序读取（可被续训mixin覆盖）"""
+        return None
+
+    def get_train_dataloader(self):
+        if self.token_budget is None:
+            return super().get_train_dataloader()
+
+        step_dataset = TokenBudgetStepDataset(
+            self.train_dataset,
+            self.token_budget['lengths'],
+            self.data_collator,
+            self.token_budget['examples_per_step'],
+            self.token_budget['max_tokens'],
+            seed=self.args.seed,
+            packed=self.token_budget.get('packed', False)
+        )
+        # 计划数据集已经包含了打乱与组批，这里不再做自动batch
+        return StepPlanDataLoader(
+            step_dataset,
+            batch_size=None,
+            sampler=self._get_step_sampler(step_dataset),
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+        )
+
+    def training_step(self, model, inputs, num_items_in_batch=None):
+        if 'micro_batches' not in inputs:
+            return super().training_step(model, inputs, num_items_in_batch)
+
+        model.train()
+        total_examples = inputs['num_examples']
+        step_loss = torch.zeros((), device=self.args.device)
+
+        for micro in inputs['micro_batches']:
+            micro = self._prepare_inputs(micro)
+            with self.compute_loss_context_manager():
+                loss = self.compute_loss(model, micro)
+            loss = loss * (micro['labels'].shape[0] / total_examples)
+            self.accelerator.backward(loss)
+            step_loss += loss.detach()
+
+        return step_loss
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+金融文本相似度分类竞赛 - 只在顶部N层挂LoRA
+LoRA只加在最后N个Transformer块上，下面冻结的块在梯度检查点之外、no_grad下前向，
+反向传播只需要经过顶部N层，缩短反向链路、省掉下层激活的保存和检查点重算
+"""
+
+import os
+import json
+import time
+import argparse
+import functools
+from typing import Dict, Any, List, Optional
+
+import torch
+from transformers import TrainerCallback
+
+def build_top_layer_target_regex(num_layers: int, top_n: int, target_modules: List[str]) -> str:
+    """
+    生成只匹配顶部N层目标模块的正则（PEFT对模块名做fullmatch）
+
+    例如28层、top_n=2: .*\\.layers\\.(?:26|27)\\..*\\.(?:q_proj|v_proj)
+    """
+    if not 0 < top_n <= num_layers:
+        raise ValueError(f"top_n必须在1到{num_layers}之间: {top_n}")
+    layers = '|'.join(str(i) for i in range(num_layers - top_n, num_layers))
+    modules = '|'.join(target_modules)
+    return rf'.*\.layers\.(?:{layers})\..*\.(?:{modules})'
+
+def get_num_hidden_layers(model_id: str) -> int:
+    """读取模型配置中的层数（只下载config，不下载权重）"""
+    from transformers import AutoConfig
+    return AutoConfig.from_pretrained(model_id, trust_remote_code=True).num_hidden_layers
+
+def find_decoder_backbone(model):
+    """找到持有Transformer块列表的主干（兼容DDP/PEFT包装）"""
+    while hasattr(model, 'module'):
+        model = model.module
+    if hasattr(model, 'get_base_model'):
+        model = model.get_base_model()
+    if hasattr(model, 'model') and hasattr(model.model, 'layers'):
+        return model.model
+    raise ValueError(f"不支持的模型结构: {type(model).__name__}")
+
+def find_decoder_layers(model) -> torch.nn.ModuleList:
+    """找到Transformer块列表（兼容DDP/PEFT包装）"""
+    return find_decoder_backbone(model).layers
+
+def _no_grad_forward(forward, is_boundary: bool):
+    """把块的前向包在no_grad中；边界块的输出作为不连图的叶子重新打开requires_grad，供顶部块的检查点使用"""
+    @functools.wraps(forward)
+    def wrapped(*args, **kwargs):
+        with torch.no_grad():
+            outputs = forward(*args, **kwargs)
+        if is_boundary and torch.is_grad_enabled():
+            hidden = outputs[0] if isinstance(outputs, tuple) else outputs
+            # 可重入检查点要求输入带梯度，否则顶部块的LoRA参数收不到梯度
+            hidden.requires_grad_(True)
+        return outputs
+    return wrapped
+
+def _owner_layer(function):
+    """检查点函数所包装的块：decoder_layer.__call__ 或 partial(super().__call__)"""
+    function = getattr(function, 'func', function)
+    return getattr(function, '__self__', None)
+
+def _bypass_checkpoint(checkpoint_func, frozen_layers):
+    """冻结块不经过检查点，直接调用"""
+    frozen_ids = {id(layer) for layer in frozen_layers}
+
+    @functools.wraps(checkpoint_func)
+    def wrapped(function, *args, **kwargs):
+        if id(_owner_layer(function)) in frozen_ids:
+            return function(*args, **kwargs)
+        return checkpoint_func(function, *args, **kwargs)
+    return wrapped
+
+def run_lower_layers_without_grad(model, top_n: int) -> int:
+    """
+    让最后N层以下的块在梯度检查点之外、no_grad下前向
+
+    这些块没有可训练参数，也不需要把梯度传回去。开启梯度检查点时，
+    块若在检查点内前向，其输出仍会随带梯度的embedding输出接入计算图，反向时被重算；
+    因此冻结块的检查点被关闭（逐层开关的新版Transformers直接关闭，
+    在模型循环里统一包装的旧版则让检查点函数对这些块直接调用），
+    边界块的输出是不连图的叶子，打开requires_grad后作为顶部块的输入。
+    需在开启梯度检查点之后调用（gradient_checkpointing_enable会重新设置检查点函数）。
+
+    Returns:
+        被冻结的块数
+    """
+    layers = find_decoder_layers(model)
+    num_frozen = max(len(layers) - top_n, 0)
+    frozen = list(layers[:num_frozen])
+    if not frozen:
+        return 0
+
+    for i, layer in enumerate(frozen):
+        layer.forward = _no_grad_forward(layer.forward, is_boundary=(i == num_frozen - 1))
+        if getattr(layer, 'gradient_checkpointing', False):
+            layer.gradient_checkpointing = False
+
+    # 旧版在Qwen2Model.forward里对每个块调用 self._gradient_checkpointing_func(layer.__call__, ...)
+    backbone = find_decoder_backbone(model)
+    if hasattr(backbone, '_gradient_checkpointing_func'):
+        backbone._gradient_checkpointing_func = _bypass_checkpoint(backbone._gradient_checkpointing_func, frozen)
+    return num_frozen
+
+class TopLayerNoGradCallback(TrainerCallback):
+    """训练开始时让顶部N层以下的块跳过梯度计算"""
+
+    def __init__(self, top_n: int):
+        self.top_n = top_n
+
+    def on_train_begin(self, args, state, control, model=None, **kwargs):
+        num_frozen = run_lower_layers_without_grad(model, self.top_n)
+        print(f"🧊 底部 {num_frozen} 层在梯度检查点之外、no_grad下前向，LoRA只训练顶部 {self.top_n} 层")
+
+def benchmark_top_n(model_id: str, top_ns: List[Optional[int]], target_modules: List[str],
+                    steps: int = 20, batch_size: int = 4, max_length: int = 256,
+                    lora_rank: int = 16, num_eval: int = 200, learning_rate: float = 1e-4,
+                    peak_tflops: Optional[float] = None, gradient_checkpointing: bool = True) -> List[Dict[str, Any]]:
+    """
+    在小模型上比较不同N的单步耗时、峰值显存、MFU和验证准确率
+
+    Args:
+        model_id: 小模型（如Qwen/Qwen2-0.5B-Instruct）
+        top_ns: 待比较的N，None表示所有层都挂LoRA
+        steps: 每个N训练的步数
+        peak_tflops: 硬件峰值算力，None时不计算MFU
+        gradient_checkpointing: 与训练配置一致开启（可重入）梯度检查点
+    """
+    from peft import LoraConfig, get_peft_model
+    try:
+        from .checkpoint_sweep import (load_base_model, load_validation_samples, build_batch_cache,
+                                       get_label_token_ids, score_batches)
+        from .model_trainer import get_project_root, build_query, SYSTEM_PROMPT
+        from .mfu import training_flops_per_token, compute_mfu
+    except ImportError:
+        from checkpoint_sweep import (load_base_model, load_validation_samples, build_batch_cache,
+                                      get_label_token_ids, score_batches)
+        from model_trainer import get_project_root, build_query, SYSTEM_PROMPT
+        from mfu import training_flops_per_token, compute_mfu
+    from swift.utils import read_from_jsonl
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    eval_samples = load_validation_samples(num_eval)
+    train_samples = read_from_jsonl(str(get_project_root() / 'data' / 'train.jsonl'))[num_eval:num_eval + steps * batch_size]
+
+    results = []
+    for top_n in top_ns:
+        model, tokenizer = load_base_model(model_id)
+        model.to(device)
+        num_layers = model.config.num_hidden_layers
+        if gradient_checkpointing:
+            model.gradient_checkpointing_enable(gradient_checkpointing_kwargs={'use_reentrant': True})
+            model.enable_input_require_grads()
+        target = build_top_layer_target_regex(num_layers, top_n, target_modules) if top_n else target_modules
+        model = get_peft_model(model, LoraConfig(r=lora_rank, lora_alpha=2 * lora_rank, target_modules=target))
+        if top_n:
+            run_lower_layers_without_grad(model, top_n)
+
+        optimizer = torch.optim.AdamW([p for p in model.parameters() if p.requires_grad], lr=learning_rate)
+        label_token_ids = get_label_token_ids(tokenizer)
+        model.train()
+        if device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats()
+
+        step_times, step_tokens, step_rows = [], [], []
+        for step in range(steps):
+            batch = train_samples[step * batch_size:(step + 1) * batch_size]
+            prompts = [tokenizer.apply_chat_template(
+                [{'role': 'system', 'content': SYSTEM_PROMPT},
+                 {'role': 'user', 'content': build_query(s['text1'], s['text2'])}],
+                tokenize=False, add_generation_prompt=True) for s in batch]
+            encoding = tokenizer(prompts, padding=True, truncation=True, max_length=max_length,
+                                 return_tensors='pt', add_special_tokens=False).to(device)
+            targets = torch.tensor([label_token_ids[int(s['label'])] for s in batch], device=device)
+
+            start = time.time()
+            hidden = model.get_base_model().model(**encoding, use_cache=False)[0][:, -1]
+            logits = model.get_base_model().lm_head(hidden).float()
+            loss = torch.nn.functional.cross_entropy(logits, targets)
+            loss.backward()
+            optimizer.step()
+            optimizer.zero_grad(set_to_none=True)
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+            step_times.append(time.time() - start)
+            step_tokens.append(int(encoding['attention_mask'].sum()))
+            step_rows.append(len(batch))
+
+        model.eval()
+        batches = build_batch_cache(tokenizer, eval_samples, batch_size * 4, max_length)
+        y_pred, _ = score_batches(model, batches, label_token_ids, len(eval_samples))
+        accuracy = float((y_pred == [int(s['label']) for s in eval_samples]).mean())
+
+        # 去掉前两步预热
+        warmup = 2 if len(step_times) > 2 else 0
+        measured = step_times[warmup:]
+        tokens_per_second = sum(step_tokens[warmup:]) / sum(measured)
+        trainable_params = sum(p.numel() for p in model.parameters() if p.requires_grad)
+        mfu = None
+        if peak_tflops:
+            seq_len = sum(step_tokens[warmup:]) / sum(step_rows[warmup:])
+            # 每行只在最后一个位置计算lm_head
+            flops = training_flops_per_token(model.config.to_dict(), seq_len, trainable_params,
+                                             top_n_layers=top_n, lm_head_fraction=1.0 / seq_len)
+            mfu = compute_mfu(tokens_per_second, flops['forward'] + flops['backward'], peak_tflops)
+
+        results.append({
+            'top_n': top_n or num_layers,
+            'num_layers': num_layers,
+            'gradient_checkpointing': gradient_checkpointing,
+            'trainable_params': trainable_params,
+            'step_seconds': sum(measured) / len(measured),
+            'tokens_per_second': tokens_per_second,
+            'mfu': mfu,
+            'peak_memory_gb': torch.cuda.max_memory_allocated() / 1024**3 if device.type == 'cuda' else None,
+            'accuracy': accuracy
+        })
+        print(f"  • top_n={results[-1]['top_n']}: {results[-1]['step_seconds'] * 1000:.1f} ms/step, "
+              f"准确率 {accuracy:.4f}")
+
+        del model, optimizer
+        if device.type == 'cuda':
+            torch.cuda.empty_cache()
+
+    return results
+
+def main():
+    """运行顶部N层LoRA基准"""
+    parser = argparse.ArgumentParser(description="顶部N层LoRA基准")
+    parser.add_argument('--model', default='Qwen/Qwen2-0.5B-Instruct', help='基准使用的小模型')
+    parser.add_argument('--top-n', type=int, nargs='+', default=[2, 4, 8, 0],
+                        help='待比较的N，0表示所有层')
+    parser.add_argument('--steps', type=int, default=20, help='每个N训练的步数')
+    parser.add_argument('--batch-size', type=int, default=4, help='批次大小')
+    parser.add_argument('--peak-tflops', type=float, default=None, help='硬件峰值算力(TFLOPS)，用于计算MFU')
+    parser.add_argument('--no-gradient-checkpointing', action='store_true', help='关闭梯度检查点（训练配置默认开启）')
+    parser.add_argument('--output', default='results/top_layer_benchmark.json', help='结果输出路径')
+
+    args = parser.parse_args()
+
+    print("🧊 顶部N层LoRA基准")
+    print("=" * 50)
+
+    target_modules = ['q_proj', 'k_proj', 'v_proj', 'o_proj', 'gate_proj', 'up_proj', 'down_proj']
+    results = benchmark_top_n(args.model, [n or None for n in args.top_n], target_modules,
+                              args.steps, args.batch_size, peak_tflops=args.peak_tflops,
+                              gradient_checkpointing=not args.no_gradient_checkpointing)
+
+    print("\n" + "=" * 72)
+    print(f"{'top_n':>8}{'可训练参数':>14}{'ms/step':>12}{'MFU':>8}{'峰值显存(GB)':>16}{'准确率':>10}")
+    print("-" * 72)
+    for row in results:
+        memory = f"{row['peak_memory_gb']:.2f}" if row['peak_memory_gb'] is not None else '-'
+        mfu = f"{row['mfu']:.1%}" if row['mfu'] is not None else '-'
+        print(f"{row['top_n']:>8}{row['trainable_params']:>14,}{row['step_seconds'] * 1000:>12.1f}"
+              f"{mfu:>8}{memory:>16}{row['accuracy']:>10.4f}")
+    print("=" * 72)
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"📄 结果已保存: {args.output}")
+
+if __name__ == '__main__':
+    main()
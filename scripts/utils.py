@@ -12,6 +12,15 @@ from collections import Counter, defaultdict
 import jieba
 from swift.utils import read_from_jsonl, write_to_jsonl
 
+try:
+    from .result_store import ResultStore, is_result_store
+    from .response_parser import parse_response, parse_batch
+    from .ensemble import iter_ensemble
+except ImportError:
+    from result_store import ResultStore, is_result_store
+    from response_parser import parse_response, parse_batch
+    from ensemble import iter_ensemble
+
 def clean_prediction_output(response: str) -> str:
     """
     清洗模型输出，只保留预测结果
@@ -22,53 +31,7 @@ def clean_prediction_output(response: str) -> str:
     Returns:
         清洗后的预测结果字符串
     """
-    if not response:
-        return "0"
-
-    # 移除所有空白字符
-    response = response.strip()
-
-    # 直接匹配数字0或1
-    if response in ['0', '1']:
-        return response
-
-    # 移除可能的额外内容，如"输出:"、"结果:"等
-    patterns_to_remove = [
-        r'^.*?(?:输出|结果|判断结果|类别|预测)[:：]\s*',
-        r'^.*?(?:我认为|答案是|预测为)[:：]?\s*',
-        r'^.*?[:：]\s*'
-    ]
-
-    for pattern in patterns_to_remove:
-        match = re.search(pattern, response, re.IGNORECASE)
-        if match:
-            response = response[match.end():].strip()
-            break
-
-    # 再次检查是否为纯数字
-    if response in ['0', '1']:
-        return response
-
-    # 提取第一个数字字符
-    digits = re.findall(r'[01]', response)
-    if digits:
-        return digits[0]
-
-    # 基于关键词判断
-    response_lower = response.lower()
-    positive_keywords = ['相似', '相同', '类似', '一致', '是', 'yes', 'true']
-    negative_keywords = ['不同', '不相似', '不相同', '差异', '不是', 'no', 'false']
-
-    positive_score = sum(1 for word in positive_keywords if word in response_lower)
-    negative_score = sum(1 for word in negative_keywords if word in response_lower)
-
-    if positive_score > negative_score:
-        return "1"
-    elif negative_score > positive_score:
-        return "0"
-    else:
-        # 默认返回"0"（基于数据集分布，类别0更多）
-        return "0"
+    return str(parse_response(response))
 
 def batch_clean_predictions(predictions: List[Dict]) -> List[Dict]:
     """
@@ -81,15 +44,13 @@ def batch_clean_predictions(predictions: List[Dict]) -> List[Dict]:
         清洗后的预测结果列表
     """
     cleaned_predictions = []
+    parsed = parse_batch([pred.get('response', '') for pred in predictions])
 
-    for pred in predictions:
-        original_response = pred.get('response', '')
-        cleaned_response = clean_prediction_output(original_response)
-
+    for pred, prediction in zip(predictions, parsed.tolist()):
         cleaned_pred = pred.copy()
-        cleaned_pred['original_response'] = original_response
-        cleaned_pred['response'] = cleaned_response
-        cleaned_pred['prediction'] = int(cleaned_response) if cleaned_response.isdigit() else 0
+        cleaned_pred['original_response'] = pred.get('response', '')
+        cleaned_pred['response'] = str(prediction)
+        cleaned_pred['prediction'] = prediction
 
         cleaned_predictions.append(cleaned_pred)
 
@@ -136,17 +97,22 @@ def calculate_text_similarity(text1: str, text2: str) -> Dict[str, float]:
 
     return features
 
-def analyze_prediction_errors(predictions: List[Dict], labels: List[int]) -> Dict[str, Any]:
+def analyze_prediction_errors(predictions: List[Dict], labels: List[int],
+                              store: Optional[ResultStore] = None) -> Dict[str, Any]:
     """
     分析预测错误模式
 
     Args:
-        predictions: 预测结果列表
+        predictions: 预测结果列表（提供store时可为None）
         labels: 真实标签列表
+        store: 列式结果，提供时预测和文本直接按行读取，不解析query
 
     Returns:
         错误分析结果
     """
+    if store is not None:
+        predictions = store.predictions
+
     error_analysis = {
         'total_samples': len(predictions),
         'total_errors': 0,
@@ -157,7 +123,7 @@ def analyze_prediction_errors(predictions: List[Dict], labels: List[int]) -> Dic
     }
 
     for i, (pred, true_label) in enumerate(zip(predictions, labels)):
-        pred_label = pred.get('prediction', 0)
+        pred_label = int(pred) if store is not None else pred.get('prediction', 0)
 
         if pred_label != true_label:
             error_analysis['total_errors'] += 1
@@ -173,14 +139,16 @@ def analyze_prediction_errors(predictions: List[Dict], labels: List[int]) -> Dic
             error_analysis['error_types'][error_type] += 1
 
             # 提取文本进行模式分析
-            query = pred.get('query', '')
-            text1_match = re.search(r'句子1:\s*(.*?)(?:\n|$)', query, re.DOTALL)
-            text2_match = re.search(r'句子2:\s*(.*?)(?:\n|$)', query, re.DOTALL)
-
-            if text1_match and text2_match:
-                text1 = text1_match.group(1).strip()
-                text2 = text2_match.group(1).strip()
+            if store is not None:
+                text1, text2 = store.text_pair(i)
+            else:
+                query = pred.get('query', '')
+                text1_match = re.search(r'句子1:\s*(.*?)(?:\n|$)', query, re.DOTALL)
+                text2_match = re.search(r'句子2:\s*(.*?)(?:\n|$)', query, re.DOTALL)
+                text1 = text1_match.group(1).strip() if text1_match and text2_match else None
+                text2 = text2_match.group(1).strip() if text1_match and text2_match else None
 
+            if text1 is not None and text2 is not None:
                 # 计算相似度特征
                 similarity_features = calculate_text_similarity(text1, text2)
 
@@ -309,61 +277,31 @@ def load_best_checkpoint(output_dir: str, metric: str = 'accuracy') -> Optional[
         print(f"加载checkpoint信息失败: {e}")
         return None
 
-def ensemble_predictions(prediction_files: List[str], method: str = 'majority_vote') -> List[Dict]:
+def ensemble_predictions(prediction_files: List[str], method: str = 'majority_vote',
+                         weights: Optional[List[float]] = None, threshold: float = 0.5) -> List[Dict]:
     """
-    对多个预测结果进行集成
+    对多个预测结果进行集成（逐块读取、按矩阵合并，见ensemble.iter_ensemble）
 
     Args:
-        prediction_files: 预测结果文件列表
+        prediction_files: 预测结果文件列表（jsonl或列式结果目录）
         method: 集成方法 ('majority_vote', 'average', 'weighted')
+        weights: weighted方法的模型权重，None为等权
+        threshold: average/weighted方法判为1的概率阈值
 
     Returns:
         集成后的预测结果
     """
+    prediction_files = [file for file in prediction_files if is_result_store(file) or os.path.exists(file)]
     if not prediction_files:
         return []
 
-    all_predictions = []
-    for file in prediction_files:
-        if os.path.exists(file):
-            preds = read_from_jsonl(file)
-            all_predictions.append(preds)
-
-    if not all_predictions:
-        return []
-
-    # 确保所有预测文件有相同数量的样本
-    num_samples = len(all_predictions[0])
-    if not all(preds and len(preds) == num_samples for preds in all_predictions):
-        print("预测文件长度不一致，无法进行集成")
+    try:
+        return [record for records in iter_ensemble(prediction_files, method, weights, threshold)
+                for record in records]
+    except ValueError as e:
+        print(f"无法进行集成: {e}")
         return []
 
-    ensemble_results = []
-
-    for sample_idx in range(num_samples):
-        votes = []
-        sample_data = all_predictions[0][sample_idx].copy()
-
-        # 收集所有模型的预测
-        for preds in all_predictions:
-            pred = preds[sample_idx]
-            response = pred.get('response', '0')
-            prediction = clean_prediction_output(response)
-            votes.append(int(prediction) if prediction.isdigit() else 0)
-
-        # 多数投票
-        final_prediction = 1 if sum(votes) > len(votes) / 2 else 0
-
-        sample_data['original_responses'] = [preds[sample_idx].get('response', '0') for preds in all_predictions]
-        sample_data['votes'] = votes
-        sample_data['response'] = str(final_prediction)
-        sample_data['prediction'] = final_prediction
-        sample_data['vote_count'] = len(votes)
-
-        ensemble_results.append(sample_data)
-
-    return ensemble_results
-
 def validate_dataset_integrity(dataset_path: str) -> Dict[str, Any]:
     """
     验证数据集完整性
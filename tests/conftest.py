@@ -0,0 +1,8 @@
+"""测试直接从scripts目录导入模块（避免scripts/__init__引入Swift依赖）"""
+
+import os
+import sys
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts')
+if SCRIPTS_DIR not in sys.path:
+    sys.path.append(SCRIPTS_DIR)
@@ -0,0 +1,86 @@
+"""回答位置lm_head切片的loss与完整lm_head计算一致（CPU，微型Qwen2）"""
+
+import pytest
+
+torch = pytest.importorskip('torch')
+pytest.importorskip('transformers')
+
+import torch.nn.functional as F
+from transformers import Qwen2Config, Qwen2ForCausalLM
+
+from lm_head_slicing import (compare_with_full_loss, disable_last_position_lm_head,
+                             enable_last_position_lm_head)
+
+VOCAB_SIZE = 64
+LABEL_TOKEN_IDS = [5, 6]
+EOS_TOKEN_ID = 7
+
+
+def make_model():
+    config = Qwen2Config(vocab_size=VOCAB_SIZE, hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+                         num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=64,
+                         use_cache=False)
+    torch.manual_seed(0)
+    return Qwen2ForCausalLM(config).train()
+
+
+def make_inputs(batch_size=3, seq_len=12):
+    """每行最后两个位置是回答（标签数字+结束符），其余位置不计算loss"""
+    generator = torch.Generator().manual_seed(0)
+    input_ids = torch.randint(8, VOCAB_SIZE, (batch_size, seq_len), generator=generator)
+    answers = torch.tensor(LABEL_TOKEN_IDS * batch_size)[:batch_size]
+    input_ids[:, -2] = answers
+    input_ids[:, -1] = EOS_TOKEN_ID
+    labels = torch.full_like(input_ids, -100)
+    labels[:, -2:] = input_ids[:, -2:]
+    return {'input_ids': input_ids, 'attention_mask': torch.ones_like(input_ids), 'labels': labels}
+
+
+@pytest.mark.parametrize('num_items_in_batch', [None, 5])
+def test_sliced_loss_matches_full_loss(num_items_in_batch):
+    model = make_model()
+    inputs = make_inputs()
+    if num_items_in_batch is not None:
+        inputs['num_items_in_batch'] = num_items_in_batch
+    enable_last_position_lm_head(model)
+
+    full_loss, sliced_loss = compare_with_full_loss(model, inputs)
+    assert sliced_loss == pytest.approx(full_loss, rel=1e-5)
+    # 对比不会卸下切片
+    assert 'forward' in model.__dict__
+    assert model(**inputs).logits is None
+
+
+def test_sliced_gradients_match_full_gradients():
+    inputs = make_inputs()
+    full_model = make_model()
+    full_model(**inputs).loss.backward()
+
+    sliced_model = make_model()
+    enable_last_position_lm_head(sliced_model)
+    sliced_model(**inputs).loss.backward()
+
+    sliced_grads = dict(sliced_model.named_parameters())
+    for name, param in full_model.named_parameters():
+        torch.testing.assert_close(sliced_grads[name].grad, param.grad, rtol=1e-4, atol=1e-6)
+
+
+def test_restricted_loss_matches_full_logits_on_restricted_vocab():
+    """限制词表时，与完整logits只取标签行（加目标中出现的token）后的交叉熵一致"""
+    model = make_model()
+    inputs = make_inputs()
+    enable_last_position_lm_head(model, restrict_token_ids=LABEL_TOKEN_IDS)
+    sliced_loss = model(**inputs).loss.item()
+
+    disable_last_position_lm_head(model)
+    with torch.no_grad():
+        logits = model(input_ids=inputs['input_ids'], attention_mask=inputs['attention_mask']).logits
+    targets = inputs['labels'][:, 1:]
+    selected = targets != -100
+    rows = torch.unique(torch.tensor(LABEL_TOKEN_IDS + [EOS_TOKEN_ID]))
+    restricted_logits = logits[:, :-1][selected][:, rows].float()
+    restricted_targets = torch.searchsorted(rows, targets[selected])
+    expected = F.cross_entropy(restricted_logits, restricted_targets).item()
+
+    assert sliced_loss == pytest.approx(expected, rel=1e-5)
+    assert 'forward' not in model.__dict__
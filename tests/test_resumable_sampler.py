@@ -0,0 +1,155 @@
+"""中断后续训与不中断训练的样本顺序、步数和最终参数完全一致（CPU，微型Qwen2）"""
+
+import copy
+import os
+
+import pytest
+
+torch = pytest.importorskip('torch')
+transformers = pytest.importorskip('transformers')
+
+from torch.utils.data import Dataset
+from transformers import (Qwen2Config, Qwen2ForSequenceClassification, Trainer,
+                          TrainingArguments, TrainerCallback)
+
+from resumable_sampler import ResumableDataTrainerMixin, ResumableSampler
+from token_budget import TokenBudgetTrainerMixin
+
+
+def make_samples(num_samples):
+    generator = torch.Generator().manual_seed(0)
+    lengths = torch.randint(6, 13, (num_samples,), generator=generator).tolist()
+    samples = [{
+        'input_ids': torch.randint(1, 64, (n,), generator=generator).tolist(),
+        'labels': i % 2,
+        'sample_index': i
+    } for i, n in enumerate(lengths)]
+    return samples, lengths
+
+
+def collate(batch):
+    longest = max(len(s['input_ids']) for s in batch)
+    return {
+        'input_ids': torch.tensor([s['input_ids'] + [0] * (longest - len(s['input_ids'])) for s in batch]),
+        'attention_mask': torch.tensor([[1] * len(s['input_ids']) + [0] * (longest - len(s['input_ids']))
+                                        for s in batch]),
+        'labels': torch.tensor([s['labels'] for s in batch]),
+        'sample_index': torch.tensor([s['sample_index'] for s in batch])
+    }
+
+
+class ListDataset(Dataset):
+    def __init__(self, samples):
+        self.samples = samples
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, idx):
+        return self.samples[idx]
+
+
+class Recorder:
+    """记录每个训练步实际看到的样本编号"""
+
+    def training_step(self, model, inputs, *args, **kwargs):
+        batches = inputs['micro_batches'] if 'micro_batches' in inputs else [inputs]
+        for batch in batches:
+            self.seen.extend(batch.pop('sample_index').tolist())
+        return super().training_step(model, inputs, *args, **kwargs)
+
+
+class StopAtStep(TrainerCallback):
+    def __init__(self, kill_step):
+        self.kill_step = kill_step
+
+    def on_step_end(self, args, state, control, **kwargs):
+        if state.global_step == self.kill_step:
+            control.should_save = True
+            control.should_training_stop = True
+
+
+CONFIG = dict(vocab_size=64, hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+              num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=64,
+              num_labels=2, pad_token_id=0)
+
+
+def run_training(run_dir, samples, lengths, initial_state, seen, batch_size, grad_accum,
+                 use_token_budget=False, resume=None, kill_step=None):
+    mixins = [Recorder, ResumableDataTrainerMixin]
+    kwargs = {}
+    if use_token_budget:
+        mixins.append(TokenBudgetTrainerMixin)
+        kwargs['token_budget'] = {'lengths': lengths, 'examples_per_step': 4, 'max_tokens': 24}
+
+    model = Qwen2ForSequenceClassification(Qwen2Config(**CONFIG))
+    model.load_state_dict(initial_state)
+    args = TrainingArguments(
+        output_dir=run_dir,
+        per_device_train_batch_size=batch_size,
+        gradient_accumulation_steps=grad_accum,
+        num_train_epochs=2,
+        learning_rate=1e-3,
+        save_strategy='steps',
+        save_steps=kill_step or 10_000,
+        logging_steps=1,
+        report_to=[],
+        use_cpu=True,
+        seed=0,
+        dataloader_num_workers=0,
+        remove_unused_columns=False,
+    )
+    trainer_cls = type('ResumeTestTrainer', (*mixins, Trainer), {})
+    trainer = trainer_cls(model=model, args=args, train_dataset=ListDataset(samples), data_collator=collate,
+                          callbacks=[StopAtStep(kill_step)] if kill_step else None, **kwargs)
+    trainer.seen = seen
+    trainer.train(resume_from_checkpoint=resume)
+    return model, trainer.state.global_step
+
+
+@pytest.mark.parametrize('num_samples, batch_size, grad_accum, kill_step, use_token_budget', [
+    # 每个epoch 6个优化步，整除
+    (24, 2, 2, 7, False),
+    # 每个epoch 13个micro-batch、累积4步：最后一个累积组只有1个micro-batch
+    (26, 2, 4, 5, False),
+    # 最后一个batch不满且累积不整除
+    (25, 2, 3, 6, False),
+    (24, 2, 1, 7, True),
+])
+def test_exact_resume(tmp_path, num_samples, batch_size, grad_accum, kill_step, use_token_budget):
+    samples, lengths = make_samples(num_samples)
+    torch.manual_seed(0)
+    initial_state = copy.deepcopy(Qwen2ForSequenceClassification(Qwen2Config(**CONFIG)).state_dict())
+    common = dict(samples=samples, lengths=lengths, initial_state=initial_state,
+                  batch_size=batch_size, grad_accum=grad_accum, use_token_budget=use_token_budget)
+
+    full_order, resumed_order = [], []
+    full_model, full_steps = run_training(str(tmp_path / 'full'), seen=full_order, **common)
+    resumed_dir = str(tmp_path / 'resumed')
+    _, stopped_at = run_training(resumed_dir, seen=resumed_order, kill_step=kill_step, **common)
+    assert stopped_at == kill_step
+    resumed_model, resumed_steps = run_training(resumed_dir, seen=resumed_order,
+                                                resume=os.path.join(resumed_dir, f'checkpoint-{kill_step}'),
+                                                **common)
+
+    assert resumed_order == full_order
+    assert resumed_steps == full_steps
+    for name, value in full_model.state_dict().items():
+        torch.testing.assert_close(resumed_model.state_dict()[name], value, rtol=0, atol=1e-5)
+
+
+def test_sampler_length_switches_to_remainder_at_set_epoch():
+    sampler = ResumableSampler(10, seed=0)
+    sampler.set_epoch(1)
+    sampler.advance(4)
+    state = sampler.state_dict()
+
+    resumed = ResumableSampler(10, seed=0)
+    resumed.load_state_dict(state)
+    # Trainer计算max_steps时仍为完整epoch
+    assert len(resumed) == 10
+    resumed.set_epoch(1)
+    assert len(resumed) == 6
+    assert list(resumed) == state['permutation'][4:].tolist()
+    resumed.set_epoch(2)
+    assert len(resumed) == 10
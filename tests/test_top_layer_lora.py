@@ -0,0 +1,60 @@
+"""底部冻结块跳过梯度时，开启可重入梯度检查点的顶部块梯度不变，且冻结块不在反向时重算"""
+
+import pytest
+
+torch = pytest.importorskip('torch')
+pytest.importorskip('transformers')
+
+from transformers import Qwen2Config, Qwen2ForCausalLM
+
+from top_layer_lora import build_top_layer_target_regex, find_decoder_layers, run_lower_layers_without_grad
+
+NUM_LAYERS, TOP_N = 4, 2
+
+
+def make_model():
+    config = Qwen2Config(vocab_size=64, hidden_size=32, intermediate_size=64, num_hidden_layers=NUM_LAYERS,
+                         num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=64,
+                         use_cache=False)
+    torch.manual_seed(0)
+    model = Qwen2ForCausalLM(config)
+    # 与训练配置一致：HF默认的可重入检查点，embedding输出打开requires_grad
+    model.gradient_checkpointing_enable(gradient_checkpointing_kwargs={'use_reentrant': True})
+    model.enable_input_require_grads()
+    for name, param in model.named_parameters():
+        param.requires_grad_(any(f'layers.{i}.' in name for i in range(NUM_LAYERS - TOP_N, NUM_LAYERS)))
+    model.train()
+    return model
+
+
+def top_layer_grads(model, input_ids):
+    model(input_ids=input_ids, labels=input_ids).loss.backward()
+    return {name: p.grad.clone() for name, p in model.named_parameters() if p.requires_grad}
+
+
+def test_frozen_layers_skip_checkpoint_recompute():
+    input_ids = torch.randint(1, 64, (2, 10), generator=torch.Generator().manual_seed(0))
+    expected = top_layer_grads(make_model(), input_ids)
+
+    model = make_model()
+    assert run_lower_layers_without_grad(model, TOP_N) == NUM_LAYERS - TOP_N
+    calls = []
+    for layer in find_decoder_layers(model)[:NUM_LAYERS - TOP_N]:
+        layer.register_forward_hook(lambda module, args, output: calls.append(module))
+    grads = top_layer_grads(model, input_ids)
+
+    # 每个冻结块只在前向调用一次，反向时没有重算
+    assert len(calls) == NUM_LAYERS - TOP_N
+    assert grads.keys() == expected.keys()
+    for name, grad in grads.items():
+        torch.testing.assert_close(grad, expected[name])
+    assert all(p.grad is None for name, p in model.named_parameters() if not p.requires_grad)
+
+
+def test_target_regex_matches_only_top_layers():
+    import re
+    pattern = build_top_layer_target_regex(28, 2, ['q_proj', 'v_proj'])
+    assert re.fullmatch(pattern, 'base_model.model.model.layers.27.self_attn.q_proj')
+    assert re.fullmatch(pattern, 'base_model.model.model.layers.26.self_attn.v_proj')
+    assert not re.fullmatch(pattern, 'base_model.model.model.layers.25.self_attn.q_proj')
+    assert not re.fullmatch(pattern, 'base_model.model.model.layers.27.mlp.up_proj')
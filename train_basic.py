@@ -5,29 +5,56 @@
 """
 
 import os
+import sys
+import argparse
 import torch
 import torch.nn as nn
 from torch.utils.data import Dataset, DataLoader
 import pandas as pd
 from transformers import (
-    AutoTokenizer, AutoModelForSequenceClassification,
+    AutoTokenizer, AutoModel, AutoModelForSequenceClassification,
     Trainer, TrainingArguments, DataCollatorWithPadding
 )
 from datasets import load_dataset
 import numpy as np
 from sklearn.metrics import accuracy_score, f1_score
 
-# 设置GPU
-os.environ['CUDA_VISIBLE_DEVICES'] = '0'
+# 直接从scripts目录导入，避免scripts/__init__引入Swift依赖；
+# 追加到sys.path末尾，scripts/evaluate.py等不会遮蔽同名的第三方包
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts'))
+from feature_cache import get_or_extract_features, train_head
+from packing import PackedSequenceCollator, PackedSequenceTrainerMixin, check_packing_isolation
+from token_budget import TokenBudgetTrainerMixin, plan_token_budget_steps, summarize_plan
+from step_profiler import StepProfilerCallback
+from mfu import MFUCallback
+from async_checkpoint import AsyncCheckpointTrainerMixin
+from resumable_sampler import ResumableDataTrainerMixin
+from cpu_training import (CPUTrainerMixin, configure_cpu_threads, cpu_supports_bf16, bind_to_numa_node,
+                          numa_nodes, physical_cores, available_cpus)
+from compile_utils import BucketPaddingCollator, CompileWarmupCallback, RecompileCounter, make_buckets
+from distributed import (ShardedDataTrainerMixin, setup_distributed, cleanup_distributed, get_or_pretokenize,
+                         is_main_process)
+
+# 设置GPU（--cpu时在main中切换到CPU；torchrun多进程时由LOCAL_RANK选择GPU）
+if 'LOCAL_RANK' not in os.environ:
+    os.environ.setdefault('CUDA_VISIBLE_DEVICES', '0')
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
+MODEL_NAME = "Qwen/Qwen2-7B-Instruct"
+
+def build_input_text(item):
+    """构建输入文本"""
+    return f"判断以下两句话是否语义相似：句子1: {item['text1']} 句子2: {item['text2']}"
+
 class FinancialSimilarityDataset(Dataset):
     """金融文本相似度数据集"""
 
-    def __init__(self, tokenizer, data, max_length=512):
+    def __init__(self, tokenizer, data, max_length=512, pad_to_max_length=True):
         self.tokenizer = tokenizer
         self.data = data
         self.max_length = max_length
+        # 打包训练时返回未padding的样本，由collator负责拼接
+        self.pad_to_max_length = pad_to_max_length
 
     def __len__(self):
         return len(self.data)
@@ -36,13 +63,13 @@ class FinancialSimilarityDataset(Dataset):
         item = self.data[idx]
 
         # 构建输入文本
-        text = f"判断以下两句话是否语义相似：句子1: {item['text1']} 句子2: {item['text2']}"
+        text = build_input_text(item)
 
         # 编码
         encoding = self.tokenizer(
             text,
             truncation=True,
-            padding='max_length',
+            padding='max_length' if self.pad_to_max_length else False,
             max_length=self.max_length,
             return_tensors='pt'
         )
@@ -66,13 +93,8 @@ def compute_metrics(eval_pred):
         'f1': f1
     }
 
-def main():
-    print("🚀 金融文本相似度分类 - 基础PyTorch版本")
-    print("🎯 目标准确率: 0.85+")
-    print("🤖 使用模型: Qwen2-7B (分类头)")
-    print("="*50)
-
-    # 1. 加载数据
+def load_data():
+    """加载训练集和测试集"""
     print("📚 加载数据集...")
     try:
         dataset = load_dataset('swift/financial_classification')
@@ -97,49 +119,146 @@ def main():
             })
 
         print(f"✅ 数据加载完成 - 训练集: {len(train_list)}, 测试集: {len(test_list)}")
+        return train_list, test_list
 
     except Exception as e:
         print(f"❌ 数据加载失败: {e}")
         print("💡 请确保数据集可用或手动下载")
-        return
+        return None, None
+
+def load_model_and_tokenizer(attn_implementation=None, model_name=MODEL_NAME, torch_dtype=torch.bfloat16):
+    """加载分类模型和tokenizer"""
+    print(f"🤖 加载模型 {model_name}...")
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    tokenizer.pad_token = tokenizer.eos_token
+
+    model_kwargs = {}
+    if attn_implementation:
+        model_kwargs['attn_implementation'] = attn_implementation
+
+    model = AutoModelForSequenceClassification.from_pretrained(
+        model_name,
+        num_labels=2,
+        torch_dtype=torch_dtype,
+        **model_kwargs
+    )
 
+    # 调整模型以适应分类任务
+    if hasattr(model, 'score'):
+        # Qwen模型的分类头调整
+        model.score = nn.Linear(model.config.hidden_size, 2)
+
+    model.to(device)
+    print("✅ 模型加载完成")
+    return model, tokenizer
+
+def load_backbone(model_name=MODEL_NAME, torch_dtype=torch.bfloat16):
+    """加载冻结的主干网络（不含分类头），用于特征提取"""
+    print(f"🤖 加载主干网络: {model_name}...")
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = 'right'
+
+    backbone = AutoModel.from_pretrained(model_name, torch_dtype=torch_dtype)
+    backbone.requires_grad_(False)
+    backbone.to(device)
+    print("✅ 主干网络加载完成")
+    return backbone, tokenizer
+
+def train_full(args, train_list, test_list):
+    """完整训练：主干+分类头一起前向/反向"""
     # 2. 加载模型和tokenizer
-    print("🤖 加载Qwen2-7B模型...")
+    # varlen布局依赖flash attention根据position_ids切分样本
+    attn_implementation = 'flash_attention_2' if args.packing and args.packing_layout == 'varlen' else None
+    # CPU上权重保持fp32，由bf16 autocast负责低精度计算
+    torch_dtype = torch.float32 if args.cpu else torch.bfloat16
     try:
-        model_name = "Qwen/Qwen2-7B-Instruct"
-        tokenizer = AutoTokenizer.from_pretrained(model_name)
-        tokenizer.pad_token = tokenizer.eos_token
-
-        model = AutoModelForSequenceClassification.from_pretrained(
-            model_name,
-            num_labels=2,
-            torch_dtype=torch.bfloat16,
-        )
-
-        # 调整模型以适应分类任务
-        if hasattr(model, 'score'):
-            # Qwen模型的分类头调整
-            model.score = nn.Linear(model.config.hidden_size, 2)
-
-        model.to(device)
-        print("✅ 模型加载完成")
-
+        model, tokenizer = load_model_and_tokenizer(attn_implementation, args.model_name, torch_dtype)
     except Exception as e:
         print(f"❌ 模型加载失败: {e}")
         return
 
     # 3. 创建数据集
     print("🔧 创建数据集...")
-    train_dataset = FinancialSimilarityDataset(tokenizer, train_list)
-    test_dataset = FinancialSimilarityDataset(tokenizer, test_list)
+    if args.world_size > 1:
+        # 多进程时只由rank 0分词一次，各rank读取同一份预分词缓存
+        def tokenize(texts):
+            return tokenizer(texts, truncation=True, max_length=args.max_length)['input_ids']
+
+        meta = {'model_name': args.model_name, 'max_length': args.max_length}
+        train_dataset, test_dataset = [
+            get_or_pretokenize(tokenize, [build_input_text(item) for item in items],
+                               [item['label'] for item in items], args.tokenized_cache_dir, name, meta)
+            for name, items in (('train', train_list), ('test', test_list))
+        ]
+    else:
+        pad_to_max_length = not (args.packing or args.token_budget or args.compile)
+        train_dataset = FinancialSimilarityDataset(tokenizer, train_list, args.max_length, pad_to_max_length)
+        test_dataset = FinancialSimilarityDataset(tokenizer, test_list, args.max_length, pad_to_max_length)
+
+    trainer_mixins = []
+    trainer_kwargs = {}
+    callbacks = []
+    data_collator = DataCollatorWithPadding(tokenizer)
+    if args.compile:
+        if args.packing or args.token_budget:
+            print("❌ --compile 暂不支持与 --packing/--token-budget 同时使用")
+            return
+        # 动态padding后再pad到固定的桶长度，编译图数量=桶数×(训练+评估)
+        buckets = args.compile_buckets or make_buckets(args.max_length)
+        data_collator = BucketPaddingCollator(data_collator, buckets, tokenizer.pad_token_id)
+        print(f"🔥 torch.compile分桶: {buckets}")
+    examples_per_step = 8  # 有效批次大小=8
+    per_device_batch_size, gradient_accumulation_steps = 1, examples_per_step
+    if args.packing:
+        print(f"📦 启用序列打包 (布局: {args.packing_layout}, 每批{args.pack_examples}个样本)")
+        data_collator = PackedSequenceCollator(tokenizer.pad_token_id, args.max_length, args.packing_layout)
+        trainer_mixins.append(PackedSequenceTrainerMixin)
+        per_device_batch_size = args.pack_examples
+        gradient_accumulation_steps = max(1, 8 // args.pack_examples)
+
+        if args.check_packing:
+            max_diff = check_packing_isolation(model, data_collator, [train_dataset[i] for i in range(8)])
+            print(f"🔍 打包隔离检查: 打包与单独前向的logits最大误差 {max_diff:.2e}")
+
+    if args.token_budget:
+        # 每个优化步仍是examples_per_step个样本，步内按token预算自动决定micro-batch数
+        lengths = [len(ids) for ids in tokenizer(
+            [build_input_text(item) for item in train_list], truncation=True, max_length=args.max_length
+        )['input_ids']]
+        summary = summarize_plan(
+            plan_token_budget_steps(lengths, examples_per_step, args.token_budget, packed=args.packing),
+            lengths, packed=args.packing
+        )
+        print(f"🪙 token预算: {args.token_budget} tokens/micro-batch, 每步{examples_per_step}个样本")
+        print(f"  • 平均每步micro-batch数: {summary['micro_batches_per_step']:.2f} "
+              f"(原梯度累积: {gradient_accumulation_steps})")
+        print(f"  • padding比例: {summary['padding_ratio']:.1%}")
+
+        trainer_mixins.insert(0, TokenBudgetTrainerMixin)
+        trainer_kwargs['token_budget'] = {
+            'lengths': lengths,
+            'examples_per_step': examples_per_step,
+            'max_tokens': args.token_budget,
+            'packed': args.packing
+        }
+        gradient_accumulation_steps = 1
 
     # 4. 训练参数
+    bf16 = True
+    if args.cpu:
+        bf16 = args.cpu_precision == 'bf16' or (args.cpu_precision == 'auto' and cpu_supports_bf16())
+        print(f"🧵 CPU训练: {args.cpu_threads['intra_op']} 个计算线程, "
+              f"{args.num_workers} 个数据worker, {'bf16 autocast' if bf16 else 'fp32'}")
+        trainer_mixins.append(CPUTrainerMixin)
+        trainer_kwargs['cpu_threads'] = args.cpu_threads
+
     training_args = TrainingArguments(
         output_dir='./results_qwen2_7b_basic',
         num_train_epochs=5,
-        per_device_train_batch_size=1,
-        per_device_eval_batch_size=1,
-        gradient_accumulation_steps=8,  # 有效批次大小=8
+        per_device_train_batch_size=per_device_batch_size,
+        per_device_eval_batch_size=per_device_batch_size if not args.token_budget else examples_per_step,
+        gradient_accumulation_steps=gradient_accumulation_steps,
         learning_rate=5e-5,
         warmup_ratio=0.1,
         weight_decay=0.01,
@@ -153,19 +272,49 @@ def main():
         metric_for_best_model="accuracy",
         greater_is_better=True,
         fp16=False,  # 使用bf16
-        bf16=True,
-        dataloader_num_workers=2,
+        bf16=bf16,
+        use_cpu=args.cpu,
+        dataloader_num_workers=args.num_workers,
+        dataloader_pin_memory=not args.cpu,
         remove_unused_columns=False,
+        # 编译模式下丢弃最后的不完整批次，保证批次维度固定
+        dataloader_drop_last=args.compile,
     )
 
-    # 5. 创建Trainer
-    trainer = Trainer(
+    if args.profile:
+        callbacks.append(StepProfilerCallback(
+            trace_start_step=args.profile_trace_start,
+            trace_num_steps=args.profile_trace_steps,
+            extra_metric_fns=[RecompileCounter()] if args.compile else None
+        ))
+    if args.peak_tflops:
+        # 分类头只有2行，词表投影的FLOPs不计入
+        callbacks.append(MFUCallback(args.peak_tflops, lm_head='none'))
+    if args.compile:
+        # 放在其他回调之后，让它们注册的hook在编译前就位，避免重编译
+        callbacks.append(CompileWarmupCallback(buckets, training_args.per_device_train_batch_size,
+                                               training_args.per_device_eval_batch_size,
+                                               tokenizer.pad_token_id, args.compile_mode))
+
+    if args.world_size > 1:
+        trainer_mixins.append(ShardedDataTrainerMixin)
+    if args.async_save:
+        trainer_mixins.insert(0, AsyncCheckpointTrainerMixin)
+    if args.exact_resume:
+        # 需排在token预算mixin之前，才能替换其按步取数据的采样器
+        trainer_mixins.insert(0, ResumableDataTrainerMixin)
+
+    # 5. 创建Trainer（按启用的功能组合mixin）
+    trainer_cls = type('FinancialTrainer', (*trainer_mixins, Trainer), {}) if trainer_mixins else Trainer
+    trainer = trainer_cls(
         model=model,
         args=training_args,
         train_dataset=train_dataset,
         eval_dataset=test_dataset,
         compute_metrics=compute_metrics,
-        data_collator=DataCollatorWithPadding(tokenizer),
+        data_collator=data_collator,
+        callbacks=callbacks,
+        **trainer_kwargs
     )
 
     # 6. 开始训练
@@ -174,7 +323,8 @@ def main():
     print("="*50)
 
     try:
-        trainer.train()
+        resume = args.resume_from_checkpoint
+        trainer.train(resume_from_checkpoint=True if resume == 'last' else resume)
         print("✅ 训练完成！")
 
         # 7. 评估
@@ -185,9 +335,10 @@ def main():
 
         # 8. 保存模型
         print("💾 保存模型...")
-        trainer.save_model('./best_model_qwen2_7b')
-        tokenizer.save_pretrained('./best_model_qwen2_7b')
-        print("✅ 模型已保存到: ./best_model_qwen2_7b")
+        trainer.save_model(args.output_dir)
+        if is_main_process():
+            tokenizer.save_pretrained(args.output_dir)
+            print(f"✅ 模型已保存到: {args.output_dir}")
 
     except KeyboardInterrupt:
         print("⏹️ 训练被用户中断")
@@ -196,5 +347,151 @@ def main():
         import traceback
         traceback.print_exc()
 
+def train_head_only(args, train_list, test_list):
+    """
+    只训练分类头：冻结主干在训练集/测试集上只跑一次，
+    之后在缓存的特征上训练任意多个epoch
+    """
+    train_texts = [build_input_text(item) for item in train_list]
+    test_texts = [build_input_text(item) for item in test_list]
+
+    backbone_cache = {}
+    torch_dtype = torch.float32 if args.cpu else torch.bfloat16
+
+    def cached_backbone():
+        if 'model' not in backbone_cache:
+            backbone_cache['model'] = load_backbone(args.model_name, torch_dtype)
+        return backbone_cache['model']
+
+    train_features = get_or_extract_features(
+        cached_backbone, train_texts, args.feature_cache_dir, f'train_{args.max_length}',
+        args.model_name, args.max_length, args.extract_batch_size
+    )
+    test_features = get_or_extract_features(
+        cached_backbone, test_texts, args.feature_cache_dir, f'test_{args.max_length}',
+        args.model_name, args.max_length, args.extract_batch_size
+    )
+
+    # 特征提取完成后释放主干占用的显存
+    backbone_cache.clear()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+    print(f"🏃 训练{args.head_type}分类头 ({args.head_epochs} 轮)...")
+    head, history = train_head(
+        train_features, [item['label'] for item in train_list],
+        test_features, [item['label'] for item in test_list],
+        head_type=args.head_type,
+        epochs=args.head_epochs,
+        learning_rate=args.head_lr,
+        batch_size=args.head_batch_size,
+        device=device
+    )
+
+    best = max(history, key=lambda h: h['eval_accuracy'])
+    print(f"🎯 最佳准确率: {best['eval_accuracy']:.4f} (第{best['epoch']}轮)")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    head_path = os.path.join(args.output_dir, f'head_{args.head_type}.pt')
+    torch.save({'head_type': args.head_type, 'state_dict': head.state_dict(), 'history': history}, head_path)
+    print(f"✅ 分类头已保存到: {head_path}")
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description='金融文本相似度分类 - 基础PyTorch版本')
+    parser.add_argument('--mode', choices=['full', 'head'], default='full',
+                        help='训练模式: full(主干+分类头) 或 head(冻结主干，缓存特征后只训练分类头)')
+    parser.add_argument('--max-length', type=int, default=512, help='最大序列长度')
+    parser.add_argument('--model-name', default=MODEL_NAME, help='模型名称（CPU训练时建议使用小模型）')
+    parser.add_argument('--output-dir', default='./best_model_qwen2_7b', help='模型输出目录')
+    parser.add_argument('--feature-cache-dir', default='./cache/features', help='特征缓存目录')
+    parser.add_argument('--extract-batch-size', type=int, default=32, help='特征提取批次大小')
+    parser.add_argument('--head-type', choices=['linear', 'mlp'], default='linear', help='分类头类型')
+    parser.add_argument('--head-epochs', type=int, default=50, help='分类头训练轮数')
+    parser.add_argument('--head-lr', type=float, default=1e-3, help='分类头学习率')
+    parser.add_argument('--head-batch-size', type=int, default=256, help='分类头批次大小')
+    parser.add_argument('--packing', action='store_true', help='启用无padding序列打包（full模式）')
+    parser.add_argument('--packing-layout', choices=['block', 'varlen'], default='block',
+                        help='打包布局: block(块对角掩码) 或 varlen(flash attention按position_ids切分)')
+    parser.add_argument('--pack-examples', type=int, default=8, help='打包时每个批次的样本数')
+    parser.add_argument('--check-packing', action='store_true', help='训练前检查打包是否存在跨样本注意力泄漏')
+    parser.add_argument('--token-budget', type=int, default=None,
+                        help='每个micro-batch的token预算，启用后按预算动态决定梯度累积次数')
+    parser.add_argument('--profile', action='store_true', help='逐步记录耗时分解到 输出目录/step_profile.jsonl')
+    parser.add_argument('--profile-trace-start', type=int, default=None,
+                        help='从该步开始采集torch.profiler Chrome trace')
+    parser.add_argument('--profile-trace-steps', type=int, default=3, help='采集trace的步数')
+    parser.add_argument('--async-save', action='store_true',
+                        help='checkpoint快照到CPU内存后立即返回训练，后台线程写盘')
+    parser.add_argument('--exact-resume', action='store_true',
+                        help='随checkpoint保存采样器状态，续训时从断点样本精确继续')
+    parser.add_argument('--resume-from-checkpoint', default=None,
+                        help='从checkpoint目录续训，传 last 表示输出目录中最新的checkpoint')
+    parser.add_argument('--cpu', action='store_true', help='在CPU上训练（full模式）')
+    parser.add_argument('--intra-op-threads', type=int, default=None,
+                        help='CPU计算线程数，默认为物理核心数减去数据worker数')
+    parser.add_argument('--inter-op-threads', type=int, default=None, help='CPU算子间并行线程数，默认1')
+    parser.add_argument('--numa-node', type=int, default=None, help='把训练进程绑定到指定NUMA节点')
+    parser.add_argument('--cpu-precision', choices=['auto', 'bf16', 'fp32'], default='auto',
+                        help='CPU计算精度，auto表示CPU支持原生bf16时使用bf16 autocast')
+    parser.add_argument('--num-workers', type=int, default=2, help='DataLoader worker数')
+    parser.add_argument('--tokenized-cache-dir', default='./cache/tokenized',
+                        help='torchrun多进程训练时的预分词缓存目录')
+    parser.add_argument('--compile', action='store_true',
+                        help='torch.compile训练模型，序列长度按桶padding并在训练开始时逐桶预热')
+    parser.add_argument('--compile-buckets', type=int, nargs='+', default=None,
+                        help='序列长度桶，默认64起按2倍递增到max-length')
+    parser.add_argument('--compile-mode', default=None, choices=['default', 'reduce-overhead', 'max-autotune'],
+                        help='torch.compile的mode')
+    parser.add_argument('--peak-tflops', type=float, default=None,
+                        help='单卡峰值算力(TFLOPS)，设置后在训练日志中输出tokens_per_second和mfu')
+    return parser.parse_args()
+
+def main():
+    global device
+    args = parse_args()
+
+    # torchrun启动时初始化进程组：CPU上用gloo，GPU上用NCCL
+    dist_info = setup_distributed('gloo' if args.cpu else None)
+    args.world_size = dist_info['world_size']
+    if args.world_size > 1:
+        if args.token_budget or args.exact_resume or args.mode == 'head':
+            print("❌ 多进程训练暂不支持 --token-budget、--exact-resume 和 --mode head")
+            cleanup_distributed()
+            return
+        if not args.cpu:
+            device = torch.device(f"cuda:{dist_info['local_rank']}")
+        print(f"🔗 rank {dist_info['rank']}/{args.world_size} (后端: {dist_info['backend']})")
+
+    if args.cpu:
+        # 线程数必须在任何并行计算之前设置
+        device = torch.device('cpu')
+        if args.numa_node is not None:
+            cpus = bind_to_numa_node(args.numa_node)
+            print(f"📌 绑定到NUMA节点{args.numa_node} ({len(cpus)}个逻辑CPU，共{len(numa_nodes())}个节点)")
+        intra_op = args.intra_op_threads
+        if intra_op is None and args.world_size > 1:
+            # 同一台机器上的进程平分物理核心
+            local_world_size = int(os.environ.get('LOCAL_WORLD_SIZE', args.world_size))
+            intra_op = max(len(physical_cores(available_cpus())) // local_world_size - args.num_workers, 1)
+        args.cpu_threads = configure_cpu_threads(intra_op, args.inter_op_threads, args.num_workers)
+
+    print("🚀 金融文本相似度分类 - 基础PyTorch版本")
+    print("🎯 目标准确率: 0.85+")
+    print(f"🤖 使用模型: {args.model_name} (分类头)")
+    print(f"🔧 训练模式: {args.mode}")
+    print("="*50)
+
+    # 1. 加载数据
+    train_list, test_list = load_data()
+    if train_list is None:
+        return
+
+    if args.mode == 'head':
+        train_head_only(args, train_list, test_list)
+    else:
+        train_full(args, train_list, test_list)
+    cleanup_distributed()
+
 if __name__ == '__main__':
     main()